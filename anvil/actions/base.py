@@ -18,11 +18,16 @@ import abc
 import collections
 
 from anvil import colorizer
+from anvil import downloader
 from anvil import exceptions as excp
 from anvil import importer
 from anvil import log as logging
+from anvil import packager
 from anvil import phase
+from anvil import pip
+from anvil import pool
 from anvil import shell as sh
+from anvil import trace as tr
 from anvil import utils
 
 LOG = logging.getLogger(__name__)
@@ -39,7 +44,40 @@ class Action(object):
         self.cfg = cfg
         self.keep_old = kargs.get('keep_old', False)
         self.force = kargs.get('force', False)
+        self.jobs = max(1, int(kargs.get('jobs') or 1))
         self.root_dir = root_dir
+        # Shared by all the components so that they know what the others
+        # have installed (or removed)
+        self.package_registries = packager.PackageRegistries()
+        self.download_cache = self._get_download_cache()
+        downloader.set_cache(self.download_cache)
+        downloader.set_ranges(self.cfg.getdefaulted('DEFAULT', 'download_ranges', 1))
+        self.git_mirrors = self._get_git_mirrors()
+        pip.set_wheelhouse(self._get_wheelhouse())
+        # Set by actions that fetch what they need ahead of time
+        self.prefetcher = None
+
+    def _get_download_cache(self):
+        max_size = int(self.cfg.getdefaulted('DEFAULT', 'download_cache_mb', 0)) * 1024 * 1024
+        if max_size <= 0:
+            return None
+        cache_dir = self.cfg.getdefaulted('DEFAULT', 'download_cache_dir',
+                                          sh.joinpths(self.root_dir, 'cache', 'downloads'))
+        return downloader.DownloadCache(sh.abspth(cache_dir), max_size)
+
+    def _get_git_mirrors(self):
+        if not self.cfg.getboolean('DEFAULT', 'git_mirrors'):
+            return None
+        mirror_dir = self.cfg.getdefaulted('DEFAULT', 'git_mirror_dir',
+                                           sh.joinpths(self.root_dir, 'cache', 'git'))
+        return downloader.GitMirrors(self.distro, sh.abspth(mirror_dir))
+
+    def _get_wheelhouse(self):
+        if not self.cfg.getboolean('DEFAULT', 'pip_wheelhouse'):
+            return None
+        wheel_dir = self.cfg.getdefaulted('DEFAULT', 'wheelhouse_dir',
+                                          sh.joinpths(self.root_dir, 'wheelhouse'))
+        return pip.Wheelhouse(self.distro.get_command_config('pip'), sh.abspth(wheel_dir))
 
     @staticmethod
     def get_lookup_name():
@@ -155,35 +193,132 @@ class Action(object):
         sh.mkdirslist(dirname)
         return sh.joinpths(dirname, "%s.phases" % (phase_name.lower()))
 
+    def _get_dependencies(self, component_order, instances):
+        """
+        Returns a mapping of component name to the set of components (in this
+        run) that must finish a phase before that component may start it.
+
+        Components that do not declare their 'dependencies' (in the distro or
+        persona options) depend on every component ordered before them.
+        """
+        dependencies = dict()
+        for (i, c) in enumerate(component_order):
+            wanted = instances[c].get_option('dependencies')
+            if wanted is None:
+                dependencies[c] = set(component_order[0:i])
+            else:
+                dependencies[c] = set()
+                for d in wanted:
+                    if d == c:
+                        continue
+                    if d not in instances:
+                        LOG.debug("Component %r depends on %r which is not active, ignoring it.", c, d)
+                        continue
+                    dependencies[c].add(d)
+        return dependencies
+
+    def _invert_dependencies(self, dependencies):
+        inverted = dict()
+        for c in dependencies.keys():
+            inverted[c] = set()
+        for (c, deps) in dependencies.items():
+            for d in deps:
+                inverted[d].add(c)
+        return inverted
+
+    def _verify_dependencies(self, component_order, dependencies):
+        finished = set()
+        remaining = list(component_order)
+        while remaining:
+            ready = [c for c in remaining if dependencies[c].issubset(finished)]
+            if not ready:
+                msg = "Dependency cycle detected between components: %s" % (", ".join(remaining))
+                raise excp.ConfigException(msg)
+            for c in ready:
+                remaining.remove(c)
+                finished.add(c)
+
+    def _run_component_phase(self, functors, instance, phase_recorder, phase_name):
+        c = instance.name
+        if phase_recorder.has_ran(c):
+            LOG.debug("Skipping phase named %r for component %r since it already happened.", phase_name, c)
+            return (False, None)
+        try:
+            result = None
+            with phase_recorder.mark(c):
+                try:
+                    if functors.start:
+                        functors.start(instance)
+                    if functors.run:
+                        result = functors.run(instance)
+                    if functors.end:
+                        functors.end(instance, result)
+                finally:
+                    # What was traced must be written out before the phase
+                    # gets marked as done (or if it failed).
+                    tr.flush_all()
+            return (True, result)
+        except (excp.NoTraceException) as e:
+            if self.force:
+                LOG.debug("Skipping exception: %s" % (e))
+                return (False, None)
+            else:
+                raise
+
     def _run_phase(self, functors, component_order, instances, phase_name):
         """
-        Run a given 'functor' across all of the components, in order.
+        Run a given 'functor' across all of the components, in order (or
+        concurrently, respecting component dependencies, if more than one job
+        is allowed).
         """
-        component_results = dict()
         if phase_name:
             phase_recorder = phase.PhaseRecorder(self._get_phase_fn(phase_name))
         else:
             phase_recorder = phase.NullPhaseRecorder()
+        if self.jobs > 1 and len(component_order) > 1:
+            return self._run_parallel_phase(functors, component_order, instances, phase_name, phase_recorder)
+        component_results = dict()
         for c in component_order:
             instance = instances[c]
-            if phase_recorder.has_ran(c):
-                LOG.debug("Skipping phase named %r for component %r since it already happened.", phase_name, c)
-            else:
+            (ran, result) = self._run_component_phase(functors, instance, phase_recorder, phase_name)
+            if ran:
+                component_results[instance] = result
+        return component_results
+
+    def _run_parallel_phase(self, functors, component_order, instances, phase_name, phase_recorder):
+        dependencies = self._get_dependencies(component_order, instances)
+        self._verify_dependencies(component_order, dependencies)
+        component_results = dict()
+        remaining = list(component_order)
+        finished = set()
+        running = dict()
+        failures = list()
+        waiter = pool.Waiter()
+        LOG.debug("Running phase %r using %s workers.", phase_name, self.jobs)
+        with pool.WorkerPool(self.jobs, name='phase') as workers:
+            while remaining or running:
+                if not failures:
+                    for c in list(remaining):
+                        if dependencies[c].issubset(finished):
+                            remaining.remove(c)
+                            fut = workers.submit(self._run_component_phase, functors,
+                                                 instances[c], phase_recorder, phase_name)
+                            running[waiter.watch(fut)] = c
+                if not running:
+                    break
+                fut = waiter.next_done()
+                c = running.pop(fut)
                 try:
-                    result = None
-                    with phase_recorder.mark(c):
-                        if functors.start:
-                            functors.start(instance)
-                        if functors.run:
-                            result = functors.run(instance)
-                        if functors.end:
-                            functors.end(instance, result)
-                    component_results[instance] = result
-                except (excp.NoTraceException) as e:
-                    if self.force:
-                        LOG.debug("Skipping exception: %s" % (e))
-                    else:
-                        raise
+                    (ran, result) = fut.result()
+                    if ran:
+                        component_results[instances[c]] = result
+                    finished.add(c)
+                except Exception as e:
+                    LOG.error("Phase %r for component %r failed: %s", phase_name, c, e)
+                    failures.append(fut)
+        if failures:
+            # Re-raise the first failure (with its original traceback)
+            failures[0].result()
         return component_results
 
     def _delete_phase_files(self, action_names):
@@ -199,5 +334,9 @@ class Action(object):
                         logger=LOG)
         self._verify_components(component_order, instances)
         self._warm_components(component_order, instances)
-        self._run(persona, component_order, instances)
+        try:
+            self._run(persona, component_order, instances)
+        finally:
+            if self.download_cache:
+                self.download_cache.log_stats()
         return component_order
@@ -16,7 +16,11 @@
 
 from anvil import colorizer
 from anvil import env_rc
+from anvil import exceptions as excp
 from anvil import log
+from anvil import packager
+from anvil import phase
+from anvil import prefetch
 from anvil import settings
 from anvil import shell as sh
 from anvil import utils
@@ -49,8 +53,119 @@ class InstallAction(base.Action):
             am_upd = writer.update(fn)
             LOG.info("Updated %s settings.", colorizer.quote(am_upd))
 
+    def _install_packages(self, component_order, instances):
+        # Install the distribution packages (and pips) that the components
+        # still to be installed need in as few transactions as possible, the
+        # install phase then finds them already installed.
+        phase_recorder = phase.PhaseRecorder(self._get_phase_fn("Install"))
+        installs = list()
+        pip_installs = list()
+        for c in component_order:
+            if not phase_recorder.has_ran(c):
+                installs.extend(instances[c].get_package_installs())
+                pip_installs.extend(instances[c].get_pip_installs())
+        # Pips all end up in the same place so the components can't disagree
+        # on which version of one they want
+        conflicts = packager.find_conflicts(pip_installs)
+        if conflicts:
+            details = ["%s (%s)" % (name, ", ".join([str(v) for v in versions]))
+                       for (name, versions) in sorted(conflicts.items())]
+            msg = "Components want different versions of python packages: %s" % (", ".join(details))
+            raise excp.ConfigException(msg)
+        # Traced (packages and pips) before anything gets installed so that
+        # what an interrupted install leaves behind still gets uninstalled
+        for c in component_order:
+            if not phase_recorder.has_ran(c):
+                instances[c].trace_installs()
+        if installs:
+            LOG.info("Installing %s distribution packages for %s components.",
+                     colorizer.quote(len(installs)), colorizer.quote(len(component_order)))
+            packager.install_batched(installs)
+        if pip_installs:
+            LOG.info("Installing %s python packages for %s components.",
+                     colorizer.quote(len(pip_installs)), colorizer.quote(len(component_order)))
+            packager.install_batched(pip_installs)
+
+    def _install_python_setups(self, component_order, instances):
+        # The python directories of all the components are set up together
+        # (using one pool of workers) once what they need has been installed,
+        # since each setup rewrites setuptools easy-install.pth file what
+        # setups running at the same time lose is then put back (one at a time)
+        setups = list()
+        for c in component_order:
+            get_python_setups = getattr(instances[c], 'get_python_setups', None)
+            if get_python_setups:
+                setups.extend(get_python_setups())
+        if not setups:
+            return
+        workers = int(self.cfg.getdefaulted('DEFAULT', 'python_setup_workers', 1))
+        LOG.info("Setting up %s python directories (%s at a time).",
+                 colorizer.quote(len(setups)), colorizer.quote(workers))
+        failures = list()
+        with sh.Executor(workers) as executor:
+            futures = [(executor.submit(*cmd, **kwargs), done) for (cmd, kwargs, done) in setups]
+        for (fut, done) in futures:
+            if fut.exception():
+                failures.append(fut)
+            else:
+                done()
+        if len(setups) > 1:
+            repaired = 0
+            for c in component_order:
+                repair = getattr(instances[c], 'repair_python_setups', None)
+                if repair:
+                    repaired += repair()
+            if repaired:
+                LOG.info("Put back %s lost easy-install.pth entries.", colorizer.quote(repaired))
+        if failures:
+            failures[0].result()
+
+    def _log_changed_downloads(self, component_order, instances):
+        changed = list()
+        unchanged = list()
+        for c in component_order:
+            downloads_changed = getattr(instances[c], 'downloads_changed', None)
+            if downloads_changed:
+                changed.append(c)
+            elif downloads_changed is not None:
+                unchanged.append(c)
+        if changed:
+            utils.log_iterable(changed, logger=LOG,
+                header="Downloads changed for %s components" % (len(changed)))
+        if unchanged:
+            utils.log_iterable(unchanged, logger=LOG,
+                header="Downloads did not change for %s components" % (len(unchanged)))
+
+    def _prefetch(self, component_order, instances):
+        # Start fetching what the components will need (downloads, images,
+        # source rpms...) so that it happens while other work gets done,
+        # the phases that need something then wait for just that
+        workers = int(self.cfg.getdefaulted('DEFAULT', 'prefetch_workers', 0))
+        if workers <= 0:
+            return
+        self.prefetcher = prefetch.Prefetcher(workers)
+        downloads = phase.PhaseRecorder(self._get_phase_fn("Download"))
+        installs = phase.PhaseRecorder(self._get_phase_fn("Install"))
+        # The downloads are needed first (so they go first)
+        for c in component_order:
+            if not downloads.has_ran(c):
+                instances[c].prefetch(self.prefetcher)
+        for c in component_order:
+            if not installs.has_ran(c):
+                for url in instances[c].get_prefetch_urls():
+                    self.prefetcher.submit_url(url)
+
     def _run(self, persona, component_order, instances):
         self._write_rc_file()
+        self._prefetch(component_order, instances)
+        try:
+            self._run_phases(component_order, instances)
+        finally:
+            if self.prefetcher:
+                self.prefetcher.shutdown()
+                self.prefetcher = None
+
+    def _run_phases(self, component_order, instances):
         self._run_phase(
             PhaseFunctors(
                 start=lambda i: LOG.info('Downloading %s.', colorizer.quote(i.name)),
@@ -61,6 +176,7 @@ class InstallAction(base.Action):
             instances,
             "Download"
             )
+        self._log_changed_downloads(component_order, instances)
         self._run_phase(
             PhaseFunctors(
                 start=lambda i: LOG.info('Configuring %s.', colorizer.quote(i.name)),
@@ -81,6 +197,7 @@ class InstallAction(base.Action):
             instances,
             "Pre-install"
             )
+        self._install_packages(component_order, instances)
 
         def install_start(instance):
             subsystems = set(list(instance.subsystems))
@@ -101,6 +218,7 @@ class InstallAction(base.Action):
             instances,
             "Install"
             )
+        self._install_python_setups(component_order, instances)
         self._run_phase(
             PhaseFunctors(
                 start=lambda i: LOG.info('Post-installing %s.', colorizer.quote(i.name)),
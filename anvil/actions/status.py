@@ -14,18 +14,28 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
+import sys
+
 from anvil import colorizer
 from anvil import constants
 from anvil import log
+from anvil import pool
 
 from anvil.actions import base
 
-from anvil.actions.base import PhaseFunctors
+from anvil.runners import base as rbase
 
 LOG = log.getLogger(__name__)
 
 
 class StatusAction(base.Action):
+    def __init__(self, distro, cfg, root_dir, **kargs):
+        base.Action.__init__(self, distro, cfg, root_dir, **kargs)
+        self.as_json = kargs.get('json', False)
+        # Where the json goes (when ran from smithy everything else that
+        # would of gone to stdout then goes to stderr)
+        self.json_fh = kargs.get('json_fh') or sys.stdout
 
     @staticmethod
     def get_lookup_name():
@@ -35,8 +45,8 @@ class StatusAction(base.Action):
     def get_action_name():
         return 'status'
 
-    def _fetch_status(self, component):
-        return component.status()
+    def _fetch_status(self, component, snapshot):
+        return component.status(snapshot)
 
     def _quote_status(self, status):
         if status == constants.STATUS_UNKNOWN:
@@ -58,14 +68,27 @@ class StatusAction(base.Action):
         else:
             LOG.info("Status of %s is %s.", colorizer.quote(component.name), self._quote_status(result))
 
+    def _jsonable(self, result):
+        if isinstance(result, (set)):
+            return sorted(result)
+        return result
+
     def _run(self, persona, component_order, instances):
-        self._run_phase(
-            PhaseFunctors(
-                start=None,
-                run=self._fetch_status,
-                end=self._print_status,
-            ),
-            component_order,
-            instances,
-            None,
-            )
+        # Nothing here changes anything, so all of the components are looked
+        # at together (sharing one look at what is running)
+        snapshot = rbase.Snapshot()
+        futures = list()
+        max_workers = int(self.cfg.getdefaulted('DEFAULT', 'status_workers', 1))
+        with pool.WorkerPool(min(max_workers, len(component_order)), name='status') as workers:
+            for c in component_order:
+                futures.append((instances[c], workers.submit(self._fetch_status, instances[c], snapshot)))
+        results = dict()
+        for (component, fut) in futures:
+            result = fut.result()
+            if self.as_json:
+                results[component.name] = self._jsonable(result)
+            else:
+                self._print_status(component, result)
+        if self.as_json:
+            self.json_fh.write(json.dumps(results, indent=4, sort_keys=True) + "\n")
+            self.json_fh.flush()
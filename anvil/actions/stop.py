@@ -39,6 +39,13 @@ class StopAction(base.Action):
         components.reverse()
         return components
 
+    def _get_dependencies(self, component_order, instances):
+        # Components are processed in reverse, so anything that depends on a
+        # component must finish before that component is started on.
+        forward_order = list(reversed(component_order))
+        dependencies = super(StopAction, self)._get_dependencies(forward_order, instances)
+        return self._invert_dependencies(dependencies)
+
     def _run(self, persona, component_order, instances):
         self._run_phase(
             PhaseFunctors(
@@ -16,6 +16,8 @@
 
 from anvil import colorizer
 from anvil import log
+from anvil import packager
+from anvil import phase
 
 from anvil.actions import base
 
@@ -39,6 +41,27 @@ class UninstallAction(base.Action):
         components.reverse()
         return components
 
+    def _get_dependencies(self, component_order, instances):
+        # Components are processed in reverse, so anything that depends on a
+        # component must finish before that component is started on.
+        forward_order = list(reversed(component_order))
+        dependencies = super(UninstallAction, self)._get_dependencies(forward_order, instances)
+        return self._invert_dependencies(dependencies)
+
+    def _remove_packages(self, component_order, instances):
+        # Remove the distribution packages of the components still to be
+        # uninstalled in as few transactions as possible, the uninstall
+        # phase then finds them already removed.
+        phase_recorder = phase.PhaseRecorder(self._get_phase_fn("Uninstall"))
+        removals = list()
+        for c in component_order:
+            if not phase_recorder.has_ran(c):
+                removals.extend(instances[c].get_package_removals())
+        if removals:
+            LOG.info("Removing %s distribution packages for %s components.",
+                     colorizer.quote(len(removals)), colorizer.quote(len(component_order)))
+            packager.remove_batched(removals)
+
     def _run(self, persona, component_order, instances):
         self._run_phase(
             PhaseFunctors(
@@ -60,6 +83,7 @@ class UninstallAction(base.Action):
             instances,
             "Pre-uninstall",
             )
+        self._remove_packages(component_order, instances)
         self._run_phase(
             PhaseFunctors(
                 start=lambda i: LOG.info('Uninstalling %s.', colorizer.quote(i.name)),
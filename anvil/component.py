@@ -14,6 +14,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
+import hashlib
 import re
 import weakref
 
@@ -25,12 +27,26 @@ from anvil import importer
 from anvil import log as logging
 from anvil import packager
 from anvil import pip
+from anvil import pool
+from anvil import probes
 from anvil import shell as sh
+from anvil import teardown
 from anvil import trace as tr
 from anvil import utils
 
 LOG = logging.getLogger(__name__)
 
+# Files (in a python directory) that decide what setting it up does
+PYTHON_SETUP_FILES = ['setup.py', 'setup.cfg', 'requirements.txt',
+                      sh.joinpths('tools', 'pip-requires')]
+
+# What setting up a python directory outputs about the link it made
+EGG_LINK_MATCHER = re.compile(r"^Creating\s+(\S+\.egg-link)\b")
+
+# What setting up a python directory outputs about each entry it (or what it
+# depends on) added to the easy-install.pth file
+PTH_ENTRY_MATCHER = re.compile(r"^Installed\s+(\S+)\s*$")
+
 
 class ComponentBase(object):
     def __init__(self,
@@ -91,6 +107,13 @@ class ComponentBase(object):
             'start': tr.trace_fn(trace_dir, "start"),
         }
 
+    def _get_trace_options(self):
+        return {
+            'buffer_records': int(self.cfg.getdefaulted('DEFAULT', 'trace_buffer_records', 0)),
+            'buffer_ms': int(self.cfg.getdefaulted('DEFAULT', 'trace_buffer_ms', 0)),
+            'fsync': self.cfg.getboolean('DEFAULT', 'trace_fsync'),
+        }
+
     def known_subsystems(self):
         return set()
 
@@ -107,8 +130,19 @@ class ComponentBase(object):
 class PkgInstallComponent(ComponentBase):
     def __init__(self, *args, **kargs):
         ComponentBase.__init__(self, *args, **kargs)
-        self.tracewriter = tr.TraceWriter(self._get_trace_files()['install'], break_if_there=False)
-        self.packager_factory = packager.PackagerFactory(self.distro, self.distro.get_default_package_manager_cls())
+        self.tracewriter = tr.TraceWriter(self._get_trace_files()['install'], break_if_there=False,
+                                          **self._get_trace_options())
+        self.packager_factory = packager.PackagerFactory(self.distro,
+                                                         self.distro.get_default_package_manager_cls(),
+                                                         self.runner.package_registries)
+        # Whether downloading changed any of the checked out trees (this is
+        # unknown if nothing was downloaded during this run)
+        self.downloads_changed = None
+        # The download targets that were traced before being prefetched
+        self._traced_downloads = set()
+        # The packages that were traced before being installed (together
+        # with the ones of the other components)
+        self._traced_packages = set()
 
     def _get_download_locations(self):
         return list()
@@ -139,12 +173,28 @@ class PkgInstallComponent(ComponentBase):
                 branch = self.cfg.get(section, key)
             real_locations.append({
                 'branch': branch,
+                'options': self._get_download_options(info),
                 'target': target_directory,
                 'uri': uri,
             })
         return real_locations
 
+    def _get_download_options(self, info):
+        # Locations can have their own options, otherwise the ones the
+        # component has (from the distro or persona) are used
+        options = dict()
+        depth = info.get('depth', self.get_option('download-depth'))
+        if depth:
+            options['depth'] = int(depth)
+        if utils.make_bool(info.get('single_branch', self.get_option('download-single-branch', False))):
+            options['single_branch'] = True
+        sparse_paths = info.get('sparse_paths', self.get_option('download-sparse-paths'))
+        if sparse_paths:
+            options['sparse_paths'] = list(sparse_paths)
+        return options
+
     def download(self):
+        self.downloads_changed = False
         download_locs = self._get_real_download_locations()
         uris = [loc['uri'] for loc in download_locs]
         utils.log_iterable(uris, logger=LOG,
@@ -154,9 +204,11 @@ class PkgInstallComponent(ComponentBase):
             uri = info['uri']
             target_loc = info['target']
             branch = info['branch']
+            options = info['options']
             # Activate da download!
-            self.tracewriter.download_happened(target_loc, uri)
-            dirs_made = self._do_download(uri, target_loc, branch)
+            if target_loc not in self._traced_downloads:
+                self.tracewriter.download_happened(target_loc, uri, options)
+            dirs_made = self._do_download(uri, target_loc, branch, **options)
             # Here we ensure this is always added so that
             # if a keep old happens then this of course
             # won't be recreated, but if u uninstall without keeping old
@@ -167,8 +219,53 @@ class PkgInstallComponent(ComponentBase):
             self.tracewriter.dirs_made(*dirs_made)
         return len(download_locs)
 
-    def _do_download(self, uri, target_dir, branch):
-        return down.GitDownloader(self.distro, uri, target_dir, branch).download()
+    def _fetch(self, uri, target_dir, branch, **options):
+        downloader = down.GitDownloader(self.distro, uri, target_dir, branch,
+                                        mirrors=self.runner.git_mirrors,
+                                        update=self.cfg.getboolean('DEFAULT', 'git_update'),
+                                        **options)
+        return (downloader, downloader.download())
+
+    def _do_download(self, uri, target_dir, branch, **options):
+        fut = None
+        if self.runner.prefetcher:
+            fut = self.runner.prefetcher.take(('git', target_dir))
+        if fut:
+            LOG.debug("Waiting on the prefetch of %s into %s", uri, target_dir)
+            if fut.exception():
+                LOG.warn("Prefetching %s into %s failed (%s), trying again.",
+                         colorizer.quote(uri), colorizer.quote(target_dir), fut.exception())
+                fut = None
+        if fut:
+            (downloader, dirs_made) = fut.result()
+        else:
+            (downloader, dirs_made) = self._fetch(uri, target_dir, branch, **options)
+        if downloader.changed:
+            self.downloads_changed = True
+        return dirs_made
+
+    def get_prefetch_urls(self):
+        """
+        The urls (of things other than the downloads) that will be needed
+        while installing, which can be fetched ahead of time.
+        """
+        urls = list()
+        for p in self._get_packages():
+            src_rpm = p.get('source-rpm')
+            if src_rpm and src_rpm.find("://") != -1:
+                urls.append(src_rpm)
+        return urls
+
+    def prefetch(self, prefetcher):
+        for info in self._get_real_download_locations():
+            target_loc = info['target']
+            # Traced before anything gets cloned so that what an interrupted
+            # clone leaves behind still gets uninstalled
+            self.tracewriter.download_happened(target_loc, info['uri'], info['options'])
+            self.tracewriter.dirs_made(*[d for d in sh.explode_path(target_loc) if not sh.isdir(d)])
+            self._traced_downloads.add(target_loc)
+            prefetcher.submit(('git', target_loc), self._fetch, info['uri'],
+                              target_loc, info['branch'], **info['options'])
 
     def _get_param_map(self, config_fn):
         mp = ComponentBase._get_params(self)
@@ -183,6 +280,28 @@ class PkgInstallComponent(ComponentBase):
                 pkg_list.extend(values.get('packages') or [])
         return self._clear_pkg_dups(pkg_list)
 
+    def get_package_installs(self):
+        """
+        The (packager, package) pairs that install() will go through.
+        """
+        return [(self.packager_factory.get_packager_for(p), p) for p in self._get_packages()]
+
+    def get_pip_installs(self):
+        return list()
+
+    def _trace_package(self, pkg):
+        if pkg['name'] not in self._traced_packages:
+            self.tracewriter.package_installed(pkg)
+            self._traced_packages.add(pkg['name'])
+
+    def trace_installs(self):
+        """
+        Traces what install() will go through (before it gets installed with
+        what the other components need).
+        """
+        for p in self._get_packages():
+            self._trace_package(p)
+
     def install(self):
         LOG.debug('Preparing to install packages for: %r', self.name)
         pkgs = self._get_packages()
@@ -192,7 +311,7 @@ class PkgInstallComponent(ComponentBase):
                 header="Setting up %s distribution packages" % (len(pkg_names)))
             with utils.progress_bar('Installing', len(pkgs)) as p_bar:
                 for (i, p) in enumerate(pkgs):
-                    self.tracewriter.package_installed(p)
+                    self._trace_package(p)
                     self.packager_factory.get_packager_for(p).install(p)
                     p_bar.update(i + 1)
         return self.get_option('trace_dir')
@@ -277,7 +396,10 @@ class PkgInstallComponent(ComponentBase):
 class PythonInstallComponent(PkgInstallComponent):
     def __init__(self, *args, **kargs):
         PkgInstallComponent.__init__(self, *args, **kargs)
-        self.pip_factory = packager.PackagerFactory(self.distro, pip.Packager)
+        self.pip_factory = packager.PackagerFactory(self.distro, pip.Packager, self.runner.package_registries)
+        # The pips that were traced before being installed (together with
+        # the ones of the other components)
+        self._traced_pips = set()
 
     def _get_python_directories(self):
         py_dirs = {
@@ -293,17 +415,33 @@ class PythonInstallComponent(PkgInstallComponent):
                 pip_list.extend(values.get('pips') or [])
         return self._clear_pkg_dups(pip_list)
 
+    def get_pip_installs(self):
+        """
+        The (packager, pip) pairs that install() will go through.
+        """
+        return [(self.pip_factory.get_packager_for(p), p) for p in self._get_pips()]
+
+    def _trace_pip(self, pip):
+        if pip['name'] not in self._traced_pips:
+            self.tracewriter.pip_installed(pip)
+            self._traced_pips.add(pip['name'])
+
+    def trace_installs(self):
+        PkgInstallComponent.trace_installs(self)
+        for p in self._get_pips():
+            self._trace_pip(p)
+
     def _install_pips(self):
         pips = self._get_pips()
         if pips:
             pip_names = [p['name'] for p in pips]
             utils.log_iterable(pip_names, logger=LOG,
                 header="Setting up %s python packages" % (len(pip_names)))
-            with utils.progress_bar('Installing', len(pips)) as p_bar:
-                for (i, p) in enumerate(pips):
-                    self.tracewriter.pip_installed(p)
-                    self.pip_factory.get_packager_for(p).install(p)
-                    p_bar.update(i + 1)
+            for p in pips:
+                self._trace_pip(p)
+            # All of them get installed with one pip run (unless the action
+            # already did that for the whole persona)
+            packager.install_batched(self.get_pip_installs())
 
     def pre_install(self):
         PkgInstallComponent.pre_install(self)
@@ -317,32 +455,133 @@ class PythonInstallComponent(PkgInstallComponent):
         for p in pips:
             self.pip_factory.get_packager_for(p).post_install(p, self._get_param_map(None))
 
-    def _install_python_setups(self):
-        py_dirs = self._get_python_directories()
-        if py_dirs:
-            real_dirs = dict()
-            for (name, wkdir) in py_dirs.items():
-                real_dirs[name] = wkdir
-                if not real_dirs[name]:
-                    real_dirs[name] = self.get_option('app_dir')
-            utils.log_iterable(real_dirs.values(), logger=LOG,
-                header="Setting up %s python directories" % (len(real_dirs)))
-            setup_cmd = self.distro.get_command('python', 'setup')
-            for (name, working_dir) in real_dirs.items():
-                self.tracewriter.dirs_made(*sh.mkdirslist(working_dir))
-                self.tracewriter.py_installed(name, working_dir)
-                root_fn = sh.joinpths(self.get_option('trace_dir'), "%s.python.setup" % (name))
-                sh.execute(*setup_cmd,
-                           cwd=working_dir,
-                           run_as_root=True,
-                           stderr_fn='%s.stderr' % (root_fn),
-                           stdout_fn='%s.stdout' % (root_fn),
-                           trace_writer=self.tracewriter
-                           )
+    def _get_python_setups(self):
+        real_dirs = dict()
+        for (name, wkdir) in self._get_python_directories().items():
+            real_dirs[name] = wkdir
+            if not real_dirs[name]:
+                real_dirs[name] = self.get_option('app_dir')
+        return real_dirs
+
+    def _get_python_setup_fn(self, name):
+        return sh.joinpths(self.get_option('trace_dir'), "%s.python.setup" % (name))
+
+    def _get_python_fingerprint(self, working_dir):
+        # Code changes don't need the directory to be set up again (it is
+        # linked in), only changes to how it gets set up (or what it needs) do
+        hasher = hashlib.sha1()
+        hasher.update(" ".join(self.distro.get_command('python', 'setup')))
+        for fn in PYTHON_SETUP_FILES:
+            path = sh.joinpths(working_dir, fn)
+            if sh.isfile(path):
+                hasher.update(fn)
+                hasher.update(sh.load_file(path, quiet=True))
+        if sh.isdir(sh.joinpths(working_dir, '.git')):
+            cmd = list(self.distro.get_command('git', 'rev_parse')) + ['HEAD']
+            (stdout, _stderr) = sh.execute(*cmd, cwd=working_dir, check_exit_code=False)
+            hasher.update(stdout.strip())
+        return hasher.hexdigest()
+
+    def _get_python_setup_cmd(self, name, working_dir):
+        root_fn = self._get_python_setup_fn(name)
+        kwargs = {
+            'cwd': working_dir,
+            'run_as_root': True,
+            'stderr_fn': '%s.stderr' % (root_fn),
+            'stdout_fn': '%s.stdout' % (root_fn),
+            'trace_writer': self.tracewriter,
+            # What it output is only looked at in those files
+            'output_tail': True,
+        }
+        return (self.distro.get_command('python', 'setup'), kwargs)
+
+    def get_python_setups(self):
+        """
+        Traces the python directories of this component and returns the
+        (command, execute keyword arguments, when done functor) of the ones
+        that need to be set up (again), the functor records that one as set
+        up once its command has finished.
+        """
+        real_dirs = self._get_python_setups()
+        if not real_dirs:
+            return list()
+        trace_reader = tr.TraceReader(self.tracewriter.filename())
+        previous = dict()
+        if trace_reader.exists():
+            previous = trace_reader.py_fingerprints()
+        setups = list()
+        for (name, working_dir) in real_dirs.items():
+            self.tracewriter.dirs_made(*sh.mkdirslist(working_dir))
+            self.tracewriter.py_installed(name, working_dir)
+            fingerprint = self._get_python_fingerprint(working_dir)
+            if fingerprint == previous.get(working_dir):
+                LOG.info("Skipping setting up %s since it has not changed since it was last set up.",
+                         colorizer.quote(working_dir))
+                continue
+            self.tracewriter.py_setup(working_dir, None)
+            (cmd, kwargs) = self._get_python_setup_cmd(name, working_dir)
+            setups.append((cmd, kwargs, functools.partial(self.tracewriter.py_setup, working_dir, fingerprint)))
+        if setups:
+            utils.log_iterable([kwargs['cwd'] for (_cmd, kwargs, _done) in setups], logger=LOG,
+                header="Setting up %s python directories" % (len(setups)))
+        return setups
+
+    def _find_python_pth(self, installed):
+        # The pth file that lists what was installed is next to the link that
+        # setting up the directory said that it made
+        for line in installed:
+            mtch = EGG_LINK_MATCHER.match(line.strip())
+            if mtch:
+                return sh.joinpths(sh.dirname(mtch.group(1)), 'easy-install.pth')
+        return None
+
+    def repair_python_setups(self):
+        """
+        Puts back the entries (of the directories and of the eggs of what they
+        depend on) that setting up this components python directories added
+        to setuptools easy-install.pth file but that got lost, which happens
+        when directories are set up at the same time (since each setup
+        rewrites that whole file).
+        """
+        repaired = 0
+        for name in self._get_python_setups().keys():
+            out_fn = '%s.stdout' % (self._get_python_setup_fn(name))
+            if not sh.isfile(out_fn):
+                continue
+            output = sh.load_file(out_fn, quiet=True).splitlines()
+            pth_fn = self._find_python_pth(output)
+            if not pth_fn or not sh.isfile(pth_fn):
+                continue
+            wanted = list()
+            for line in output:
+                mtch = PTH_ENTRY_MATCHER.match(line.strip())
+                if mtch and mtch.group(1) not in wanted:
+                    wanted.append(mtch.group(1))
+            # Entries can be relative to where the pth file is
+            pth_dir = sh.dirname(pth_fn)
+            lines = sh.load_file(pth_fn, quiet=True).splitlines()
+            listed = [sh.abspth(sh.joinpths(pth_dir, line.strip())) for line in lines
+                      if line.strip() and not line.startswith(("import", "#"))]
+            missing = [path for path in wanted if sh.abspth(sh.joinpths(pth_dir, path)) not in listed]
+            if not missing:
+                continue
+            utils.log_iterable(missing, logger=LOG,
+                header="Putting back %s entries missing from %s" % (len(missing), pth_fn))
+            # Newer setuptools ends the file with a line that moves what it
+            # lists to the front of the path (so entries go before that)
+            at = len(lines)
+            if lines and lines[-1].startswith("import"):
+                at -= 1
+            lines[at:at] = missing
+            with sh.Rooted(True):
+                sh.write_file(pth_fn, utils.joinlinesep(*(lines + [''])))
+            repaired += len(missing)
+        return repaired
 
     def _python_install(self):
+        # The python directories are set up afterwards (together with the
+        # ones of the other components) by the action
         self._install_pips()
-        self._install_python_setups()
 
     def install(self):
         trace_dir = PkgInstallComponent.install(self)
@@ -354,7 +593,9 @@ class PkgUninstallComponent(ComponentBase):
     def __init__(self, *args, **kargs):
         ComponentBase.__init__(self, *args, **kargs)
         self.tracereader = tr.TraceReader(self._get_trace_files()['install'])
-        self.packager_factory = packager.PackagerFactory(self.distro, self.distro.get_default_package_manager_cls())
+        self.packager_factory = packager.PackagerFactory(self.distro,
+                                                         self.distro.get_default_package_manager_cls(),
+                                                         self.runner.package_registries)
 
     def unconfigure(self):
         self._unconfigure_files()
@@ -378,8 +619,7 @@ class PkgUninstallComponent(ComponentBase):
 
     def uninstall(self):
         self._uninstall_pkgs()
-        self._uninstall_touched_files()
-        self._uninstall_dirs()
+        self._uninstall_files_and_dirs()
         LOG.debug("Deleting install trace file %r", self.tracereader.filename())
         sh.unlink(self.tracereader.filename())
 
@@ -389,6 +629,18 @@ class PkgUninstallComponent(ComponentBase):
     def pre_uninstall(self):
         pass
 
+    def get_package_removals(self):
+        """
+        The (packager, package) pairs that uninstall() will go through.
+        """
+        if self.get_option('keep_old', False):
+            return []
+        try:
+            pkgs = self.tracereader.packages_installed()
+        except excp.NoTraceException:
+            return []
+        return [(self.packager_factory.get_packager_for(p), p) for p in pkgs]
+
     def _uninstall_pkgs(self):
         if self.get_option('keep_old', False):
             LOG.info('Keep-old flag set, not removing any packages.')
@@ -407,39 +659,33 @@ class PkgUninstallComponent(ComponentBase):
                 utils.log_iterable(which_removed, logger=LOG,
                     header="Actually removed %s packages" % (len(which_removed)))
 
-    def _uninstall_touched_files(self):
+    def _uninstall_files_and_dirs(self):
         files_touched = self.tracereader.files_touched()
-        if files_touched:
-            utils.log_iterable(files_touched, logger=LOG,
-                header="Removing %s touched files" % (len(files_touched)))
-            for fn in files_touched:
-                sh.unlink(fn, run_as_root=True)
-
-    def _uninstall_dirs(self):
-        dirs_made = self.tracereader.dirs_made()
-        if dirs_made:
-            dirs_made = [sh.abspth(d) for d in dirs_made]
-            if self.get_option('keep_old', False):
-                download_places = [path_location[0] for path_location in self.tracereader.download_locations()]
-                if download_places:
-                    utils.log_iterable(download_places, logger=LOG,
-                        header="Keeping %s download directories (and there children directories)" % (len(download_places)))
-                    for download_place in download_places:
-                        dirs_made = sh.remove_parents(download_place, dirs_made)
-            if dirs_made:
-                utils.log_iterable(dirs_made, logger=LOG,
-                    header="Removing %s created directories" % (len(dirs_made)))
-                for dir_name in dirs_made:
-                    if sh.isdir(dir_name):
-                        sh.deldir(dir_name, run_as_root=True)
-                    else:
-                        LOG.warn("No directory found at %s - skipping", colorizer.quote(dir_name, quote_color='red'))
+        dirs_made = [sh.abspth(d) for d in self.tracereader.dirs_made()]
+        download_places = list()
+        if dirs_made and self.get_option('keep_old', False):
+            download_places = [path_location[0] for path_location in self.tracereader.download_locations()]
+            if download_places:
+                utils.log_iterable(download_places, logger=LOG,
+                    header="Keeping %s download directories (and there children directories)" % (len(download_places)))
+        # Files in directories that will be removed go with them (and so do
+        # directories in those directories)
+        plan = teardown.Plan(dirs_made, files_touched, keep=download_places)
+        if plan.files:
+            utils.log_iterable(plan.files, logger=LOG,
+                header="Removing %s touched files" % (len(plan.files)))
+        if plan.roots:
+            utils.log_iterable(plan.roots, logger=LOG,
+                header="Removing %s created directories" % (len(plan.roots)))
+        if plan.files or plan.roots:
+            max_workers = int(self.cfg.getdefaulted('DEFAULT', 'teardown_workers', 1))
+            teardown.remove(plan, max_workers)
 
 
 class PythonUninstallComponent(PkgUninstallComponent):
     def __init__(self, *args, **kargs):
         PkgUninstallComponent.__init__(self, *args, **kargs)
-        self.pip_factory = packager.PackagerFactory(self.distro, pip.Packager)
+        self.pip_factory = packager.PackagerFactory(self.distro, pip.Packager, self.runner.package_registries)
 
     def uninstall(self):
         self._uninstall_python()
@@ -485,7 +731,8 @@ class PythonUninstallComponent(PkgUninstallComponent):
 class ProgramRuntime(ComponentBase):
     def __init__(self, *args, **kargs):
         ComponentBase.__init__(self, *args, **kargs)
-        self.tracewriter = tr.TraceWriter(self._get_trace_files()['start'], break_if_there=True)
+        self.tracewriter = tr.TraceWriter(self._get_trace_files()['start'], break_if_there=True,
+                                          **self._get_trace_options())
         self.tracereader = tr.TraceReader(self._get_trace_files()['start'])
 
     def _get_apps_to_start(self):
@@ -514,6 +761,28 @@ class ProgramRuntime(ComponentBase):
     def _fetch_run_type(self):
         return self.cfg.getdefaulted("DEFAULT", "run_type", 'anvil.runners.fork:ForkRunner')
 
+    def _get_probe_specs(self, option='probes', app_name=None):
+        specs = self.get_option(option) or []
+        if app_name is not None:
+            specs = [s for s in specs if s.get('app') == app_name]
+        return specs
+
+    def _wait_until_ready(self, what, option='probes', app_name=None, or_sleep=None):
+        """
+        Waits until the probes (declared in the given component option) for what
+        was started pass or, if there are no probes, sleeps for the given number
+        of seconds (if any).
+        """
+        specs = self._get_probe_specs(option, app_name)
+        if specs:
+            timeout = int(self.cfg.getdefaulted('DEFAULT', 'service_ready_timeout', 60))
+            found = [probes.from_spec(self.cfg, spec, timeout) for spec in specs]
+            LOG.info("Waiting for %s to be ready (checking %s probes).", colorizer.quote(what), len(found))
+            probes.wait_for(found, what)
+        elif or_sleep:
+            LOG.info("Waiting %s seconds so that %s can start up.", or_sleep, colorizer.quote(what))
+            sh.sleep(or_sleep)
+
     def configure(self):
         # Anything to configure for starting?
         apps_to_start = self._get_apps_to_start()
@@ -538,6 +807,37 @@ class ProgramRuntime(ComponentBase):
             am_configured += cfg_am
         return am_configured
 
+    def _get_start_waves(self, apps_to_start, together):
+        # Apps that the ones after them have to wait on (since they have probes
+        # or want some time to start up) end a wave, the apps in a wave get
+        # started together
+        waves = [[]]
+        for app_info in apps_to_start:
+            waves[-1].append(app_info)
+            if not together or self._get_probe_specs(app_name=app_info["name"]) or app_info.get('sleep_time'):
+                waves.append([])
+        return [wave for wave in waves if wave]
+
+    def _start_app(self, starter, run_type, app_info):
+        app_name = app_info["name"]
+        app_pth = app_info.get("path", app_name)
+        app_dir = app_info.get("app_dir", self.get_option('app_dir'))
+        # Adjust the program options now that we have real locations
+        program_opts = utils.param_replace_list(self._get_app_options(app_name), self._get_param_map(app_name))
+        # Start it with the given settings
+        LOG.debug("Starting %r using %r", app_name, run_type)
+        details_fn = starter.start(app_name, app_pth=app_pth, app_dir=app_dir, opts=program_opts)
+        LOG.info("Started %s details are in %s", colorizer.quote(app_name), colorizer.quote(details_fn))
+        return details_fn
+
+    def _wait_until_app_ready(self, app_info):
+        app_name = app_info["name"]
+        if self._get_probe_specs(app_name=app_name):
+            self._wait_until_ready(app_name, app_name=app_name)
+        elif app_info.get('sleep_time'):
+            LOG.info("%s requested a %s second sleep time, please wait...", colorizer.quote(app_name), app_info.get('sleep_time'))
+            sh.sleep(app_info.get('sleep_time'))
+
     def start(self):
         # Anything to start?
         am_started = 0
@@ -547,22 +847,33 @@ class ProgramRuntime(ComponentBase):
         # Select how we are going to start it
         run_type = self._fetch_run_type()
         starter = importer.import_entry_point(run_type)(self)
-        for app_info in apps_to_start:
-            app_name = app_info["name"]
-            app_pth = app_info.get("path", app_name)
-            app_dir = app_info.get("app_dir", self.get_option('app_dir'))
-            # Adjust the program options now that we have real locations
-            program_opts = utils.param_replace_list(self._get_app_options(app_name), self._get_param_map(app_name))
-            # Start it with the given settings
-            LOG.debug("Starting %r using %r", app_name, run_type)
-            details_fn = starter.start(app_name, app_pth=app_pth, app_dir=app_dir, opts=program_opts)
-            LOG.info("Started %s details are in %s", colorizer.quote(app_name), colorizer.quote(details_fn))
-            # This trace is used to locate details about what to stop
-            self.tracewriter.app_started(app_name, details_fn, run_type)
-            if app_info.get('sleep_time'):
-                LOG.info("%s requested a %s second sleep time, please wait...", colorizer.quote(app_name), app_info.get('sleep_time'))
-                sh.sleep(app_info.get('sleep_time'))
-            am_started += 1
+        max_workers = 1
+        if starter.parallel_start:
+            max_workers = int(self.cfg.getdefaulted('DEFAULT', 'app_start_workers', 1))
+        waves = self._get_start_waves(apps_to_start, max_workers > 1)
+        with pool.WorkerPool(max_workers, name='start') as workers:
+            for wave in waves:
+                failed = None
+                if len(wave) == 1:
+                    started = [(wave[0], self._start_app(starter, run_type, wave[0]))]
+                else:
+                    LOG.debug("Starting %s together.", ", ".join([app_info["name"] for app_info in wave]))
+                    futures = [(app_info, workers.submit(self._start_app, starter, run_type, app_info))
+                               for app_info in wave]
+                    started = list()
+                    for (app_info, fut) in futures:
+                        if fut.exception():
+                            failed = failed or fut
+                        else:
+                            started.append((app_info, fut.result()))
+                # This trace is used to locate details about what to stop (so
+                # what did start gets recorded, in order, even if others failed)
+                for (app_info, details_fn) in started:
+                    self.tracewriter.app_started(app_info["name"], details_fn, run_type)
+                    am_started += 1
+                if failed:
+                    failed.result()
+                self._wait_until_app_ready(wave[-1])
         return am_started
 
     def _locate_investigators(self, apps_started):
@@ -585,6 +896,18 @@ class ProgramRuntime(ComponentBase):
             to_investigate.append((app_name, investigator))
         return to_investigate
 
+    def _group_investigators(self, apps_started):
+        # Returns each investigator (in the order first needed) with the
+        # names of all the apps it should look into
+        grouped = list()
+        app_names = dict()
+        for (app_name, handler) in self._locate_investigators(apps_started):
+            if handler not in app_names:
+                app_names[handler] = list()
+                grouped.append((handler, app_names[handler]))
+            app_names[handler].append(app_name)
+        return grouped
+
     def stop(self):
         # Anything to stop??
         killed_am = 0
@@ -592,17 +915,17 @@ class ProgramRuntime(ComponentBase):
         if not apps_started:
             return killed_am
         self.pre_stop(apps_started)
-        to_kill = self._locate_investigators(apps_started)
-        for (app_name, handler) in to_kill:
-            handler.stop(app_name)
+        # Each handler gets to stop all of its apps at once
+        for (handler, app_names) in self._group_investigators(apps_started):
+            handler.stop_all(app_names)
             handler.unconfigure()
-            killed_am += 1
+            killed_am += len(app_names)
         self.post_stop(apps_started)
         if len(apps_started) == killed_am:
             sh.unlink(self.tracereader.filename())
         return killed_am
 
-    def _multi_status(self):
+    def _multi_status(self, snapshot=None):
         try:
             apps_started = self.tracereader.apps_started()
         except excp.NoTraceException:
@@ -610,11 +933,10 @@ class ProgramRuntime(ComponentBase):
         if not apps_started:
             return None
         else:
-            to_check = self._locate_investigators(apps_started)
             results = dict()
-            for (name, handler) in to_check:
+            for (handler, app_names) in self._group_investigators(apps_started):
                 try:
-                    results[name] = handler.status(name)
+                    results.update(handler.status_all(app_names, snapshot))
                 except AttributeError:
                     pass  # Not all handlers can implement this..
             return results
@@ -622,8 +944,8 @@ class ProgramRuntime(ComponentBase):
     def _status(self):
         return constants.STATUS_UNKNOWN
 
-    def status(self):
-        stat = self._multi_status()
+    def status(self, snapshot=None):
+        stat = self._multi_status(snapshot)
         if not stat:
             stat = self._status()
         if not stat or stat == constants.STATUS_UNKNOWN:
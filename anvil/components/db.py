@@ -169,8 +169,7 @@ class DBRuntime(comp.EmptyRuntime):
         if self._status() != constants.STATUS_STARTED:
             startcmd = self._get_run_actions('start', excp.StartException)
             sh.execute(*startcmd, run_as_root=True, check_exit_code=True)
-            LOG.info("Please wait %s seconds while it starts up." % self.wait_time)
-            sh.sleep(self.wait_time)
+            self._wait_until_ready(self.name, or_sleep=self.wait_time)
             return 1
         else:
             return 0
@@ -187,8 +186,7 @@ class DBRuntime(comp.EmptyRuntime):
         LOG.info("Restarting your database.")
         restartcmd = self._get_run_actions('restart', excp.RestartException)
         sh.execute(*restartcmd, run_as_root=True, check_exit_code=True)
-        LOG.info("Please wait %s seconds while it restarts." % self.wait_time)
-        sh.sleep(self.wait_time)
+        self._wait_until_ready(self.name, or_sleep=self.wait_time)
         return 1
 
     def _status(self):
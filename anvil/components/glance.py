@@ -80,6 +80,10 @@ class GlanceMixin(object):
         })
         return places
 
+    def _get_image_urls(self):
+        uris = self.cfg.getdefaulted('glance', 'image_urls', '').split(",")
+        return [u.strip() for u in uris if len(u.strip())]
+
 
 class GlanceUninstaller(GlanceMixin, comp.PythonUninstallComponent):
     def __init__(self, *args, **kargs):
@@ -90,6 +94,13 @@ class GlanceInstaller(GlanceMixin, comp.PythonInstallComponent):
     def __init__(self, *args, **kargs):
         comp.PythonInstallComponent.__init__(self, *args, **kargs)
 
+    def get_prefetch_urls(self):
+        urls = comp.PythonInstallComponent.get_prefetch_urls(self)
+        if self.get_option('load-images'):
+            # These get uploaded when glance is started
+            urls.extend(self._get_image_urls())
+        return urls
+
     def pre_install(self):
         comp.PythonInstallComponent.pre_install(self)
         if self.cfg.getboolean('glance', 'eliminate_pip_gits'):
@@ -226,16 +237,11 @@ class GlanceRuntime(GlanceMixin, comp.PythonRuntime):
     def _get_app_options(self, app):
         return APP_OPTIONS.get(app)
 
-    def _get_image_urls(self):
-        uris = self.cfg.getdefaulted('glance', 'image_urls', '').split(",")
-        return [u.strip() for u in uris if len(u.strip())]
-
     def post_start(self):
         comp.PythonRuntime.post_start(self)
         if self.do_upload:
             # Install any images that need activating...
-            LOG.info("Waiting %s seconds so that glance can start up before image install." % (self.wait_time))
-            sh.sleep(self.wait_time)
+            self._wait_until_ready(self.name, or_sleep=self.wait_time)
             params = {}
             params['glance'] = ghelper.get_shared_params(self.cfg)
             params['keystone'] = khelper.get_shared_params(self.cfg, 'glance')
@@ -186,8 +186,7 @@ class KeystoneRuntime(comp.PythonRuntime):
 
     def post_start(self):
         if not sh.isfile(self.init_fn):
-            LOG.info("Waiting %s seconds so that keystone can start up before running first time init." % (self.wait_time))
-            sh.sleep(self.wait_time)
+            self._wait_until_ready(self.name, or_sleep=self.wait_time)
             LOG.info("Running commands to initialize keystone.")
             LOG.debug("Initializing with %s", self.init_what)
             initial_cfg = dict()
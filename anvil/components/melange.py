@@ -149,8 +149,7 @@ class MelangeRuntime(comp.PythonRuntime):
     def post_start(self):
         comp.PythonRuntime.post_start(self)
         if self.get_option('create-cidr'):
-            LOG.info("Waiting %s seconds so that the melange server can start up before cidr range creation." % (self.wait_time))
-            sh.sleep(self.wait_time)
+            self._wait_until_ready(self.name, or_sleep=self.wait_time)
             mp = dict()
             mp['CIDR_RANGE'] = self.cfg.getdefaulted('melange', 'm_mac_range', DEF_CIDR_RANGE)
             utils.execute_template(*CIDR_CREATE_CMD, params=mp)
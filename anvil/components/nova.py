@@ -362,8 +362,7 @@ class NovaRuntime(NovaMixin, comp.PythonRuntime):
                     mp['TEST_FLOATING_POOL'] = self.cfg.getdefaulted('nova', 'test_floating_pool', 'test')
             else:
                 LOG.info("Not creating floating IPs (not supported by quantum server)")
-                LOG.info("Waiting %s seconds so that quantum can start up before running first time init." % (self.wait_time))
-                sh.sleep(self.wait_time)
+                self._wait_until_ready('quantum', option='quantum-probes', or_sleep=self.wait_time)
             # Anything to run??
             if cmds:
                 utils.execute_template(*cmds, params=mp)
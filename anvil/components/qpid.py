@@ -41,8 +41,7 @@ class QpidRuntime(comp.EmptyRuntime):
         if self._status() != constants.STATUS_STARTED:
             start_cmd = self.distro.get_command('qpid', 'start')
             sh.execute(*start_cmd, run_as_root=True, check_exit_code=True)
-            LOG.info("Please wait %s seconds while it starts up." % self.wait_time)
-            sh.sleep(self.wait_time)
+            self._wait_until_ready(self.name, or_sleep=self.wait_time)
             return 1
         else:
             return 0
@@ -59,8 +58,7 @@ class QpidRuntime(comp.EmptyRuntime):
         LOG.info("Restarting your qpid daemon.")
         restart_cmd = self.distro.get_command('qpid', 'restart')
         sh.execute(*restart_cmd, run_as_root=True, check_exit_code=True)
-        LOG.info("Please wait %s seconds while it restarts." % self.wait_time)
-        sh.sleep(self.wait_time)
+        self._wait_until_ready(self.name, or_sleep=self.wait_time)
         return 1
 
     def _status(self):
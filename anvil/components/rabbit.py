@@ -92,6 +92,7 @@ class RabbitRuntime(comp.EmptyRuntime):
     def start(self):
         if self._status() != constants.STATUS_STARTED:
             self._run_cmd(self.distro.get_command('rabbit-mq', 'start'))
+            self._wait_until_ready(self.name)
             return 1
         else:
             return 0
@@ -128,8 +129,7 @@ class RabbitRuntime(comp.EmptyRuntime):
     def restart(self):
         LOG.info("Restarting rabbit-mq.")
         self._run_cmd(self.distro.get_command('rabbit-mq', 'restart'))
-        LOG.info("Please wait %s seconds while it starts up." % (self.wait_time))
-        sh.sleep(self.wait_time)
+        self._wait_until_ready(self.name, or_sleep=self.wait_time)
         return 1
 
     def stop(self):
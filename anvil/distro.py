@@ -78,12 +78,14 @@ class Distro(object):
                 'No platform configuration data for %r (%s)' %
                 (plt, distname))
 
-    def __init__(self, name, distro_pattern, packager_name, commands, components):
+    def __init__(self, name, distro_pattern, packager_name, commands, components, command_timeouts=None):
         self.name = name
         self._distro_pattern = re.compile(distro_pattern, re.IGNORECASE)
         self._packager_name = packager_name
         self._commands = commands
         self._components = components
+        # Seconds that commands (by program name) may run for
+        self.command_timeouts = command_timeouts or {}
 
     def get_command_config(self, key, *more_keys, **kargs):
         """ Gets a end object for a given set of keys """
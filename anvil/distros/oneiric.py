@@ -65,6 +65,14 @@ class RabbitPackager(apt.AptPackager):
         self._execute_apt(cmd)
         return True
 
+    def _remove_batch(self, pkgs):
+        # Each removal needs the special handling below
+        return False
+
+    def _install_batch(self, pkgs):
+        # Each install needs the special handling below
+        return False
+
     def _install(self, pkg):
         # See: https://bugs.launchpad.net/ubuntu/+source/rabbitmq-server/+bug/878597
         # See: https://bugs.launchpad.net/ubuntu/+source/rabbitmq-server/+bug/878600
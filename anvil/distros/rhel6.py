@@ -163,20 +163,39 @@ class NovaInstaller(nova.NovaInstaller):
 
 class YumPackagerWithRelinks(yum.YumPackager):
 
+    def _remove_links(self, pkg):
+        options = pkg.get('packager_options', {})
+        links = options.get('links', [])
+        for entry in links:
+            tgt = entry['target']
+            if sh.islink(tgt):
+                sh.unlink(tgt)
+
     def _remove(self, pkg):
         response = yum.YumPackager._remove(self, pkg)
         if response:
-            options = pkg.get('packager_options', {})
-            links = options.get('links', [])
-            for entry in links:
-                src = entry['source']
-                tgt = entry['target']
-                if sh.islink(tgt):
-                    sh.unlink(tgt)
+            self._remove_links(pkg)
         return response
 
+    def _remove_batch(self, pkgs):
+        response = yum.YumPackager._remove_batch(self, pkgs)
+        if response:
+            for pkg in pkgs:
+                self._remove_links(pkg)
+        return response
+
+    def _install_batch(self, pkgs):
+        yum.YumPackager._install_batch(self, pkgs)
+        for pkg in pkgs:
+            self._install_links(pkg)
+        return True
+
     def _install(self, pkg):
         yum.YumPackager._install(self, pkg)
+        self._install_links(pkg)
+        return True
+
+    def _install_links(self, pkg):
         options = pkg.get('packager_options', {})
         links = options.get('links', [])
         for entry in links:
@@ -190,4 +209,3 @@ class YumPackagerWithRelinks(yum.YumPackager):
                 # This of course doesn't work when running from git
                 # like anvil does....
                 sh.symlink(src, tgt)
-        return True
@@ -16,20 +16,92 @@
 
 
 import contextlib
-import functools
+import glob
+import hashlib
+import httplib
+import json
+import os
+import re
+import shutil
+import socket
+import threading
+import time
 import urllib2
 
 import progressbar
 
 from anvil import colorizer
+from anvil import exceptions as excp
 from anvil import log as logging
+from anvil import pool
 from anvil import shell as sh
+from anvil import utils
 
 LOG = logging.getLogger(__name__)
 
 # Git master branch
 GIT_MASTER_BRANCH = "master"
 
+# Url downloads are read (and written) in pieces of this size
+BUFFER_SIZE = 1024 * 1024
+
+# Url downloads are only split into ranges (that are fetched at the same
+# time) when each range would be at least this big
+MIN_RANGE_SIZE = 8 * 1024 * 1024
+
+# How many times an interrupted url download is resumed before giving up
+RESUME_ATTEMPTS = 3
+
+# The cache (if any) that url downloads go through
+_CACHE = None
+
+# How many ranges url downloads are split into (when servers support that)
+_RANGES = 1
+
+
+def set_cache(cache):
+    global _CACHE
+    _CACHE = cache
+
+
+def get_cache():
+    return _CACHE
+
+
+def set_ranges(ranges):
+    global _RANGES
+    _RANGES = max(1, int(ranges))
+
+
+def get_ranges():
+    return _RANGES
+
+
+def _get_validators(headers):
+    validators = dict()
+    for (key, name) in [('etag', 'etag'), ('last_modified', 'last-modified'),
+                        ('length', 'content-length')]:
+        validators[key] = headers.get(name)
+    return validators
+
+
+def _open_new(fn, mode):
+    # Made as the user (waiting on any thread that has the process rooted)
+    # so that the user can reuse (and remove) what was downloaded later
+    with sh.Unrooted():
+        return open(fn, mode)
+
+
+def _digest_file(fn):
+    digest = hashlib.sha256()
+    with open(fn, 'rb') as fh:
+        while True:
+            data = fh.read(BUFFER_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
 
 class Downloader(object):
 
@@ -41,23 +113,181 @@ class Downloader(object):
         raise NotImplementedError()
 
 
+class GitMirrors(object):
+    """
+    Bare mirrors of git repositories (kept in a directory and found by the
+    uri they mirror) that new clones are made from, so that only what has
+    changed upstream needs to be fetched each time.
+    """
+
+    def __init__(self, distro, mirror_dir):
+        self.distro = distro
+        self.mirror_dir = mirror_dir
+        self._lock = threading.Lock()
+        self._locks = dict()
+
+    def _get_lock(self, uri):
+        with self._lock:
+            if uri not in self._locks:
+                self._locks[uri] = threading.Lock()
+            return self._locks[uri]
+
+    def get_location(self, uri):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", uri.rstrip("/").split("/")[-1])
+        if name.endswith('.git'):
+            name = name[0:-len('.git')]
+        name = "%s-%s.git" % (name or 'repo', hashlib.sha1(uri).hexdigest()[0:12])
+        return sh.joinpths(self.mirror_dir, name)
+
+    def update(self, uri):
+        """
+        Creates (or fetches what is new into) the mirror of the given uri,
+        returning where that mirror is.
+        """
+        where = self.get_location(uri)
+        with self._get_lock(uri):
+            if sh.isdir(where):
+                LOG.info("Fetching updates from %s into mirror %s.", colorizer.quote(uri), colorizer.quote(where))
+                cmd = list(self.distro.get_command('git', 'fetch'))
+                cmd += ['--prune']
+                try:
+                    sh.execute(*cmd, cwd=where)
+                except excp.ProcessExecutionError as e:
+                    LOG.warn("Could not fetch updates from %s, using what the mirror already has: %s",
+                             colorizer.quote(uri), e.description)
+            else:
+                LOG.info("Mirroring %s to %s.", colorizer.quote(uri), colorizer.quote(where))
+                sh.mkdirslist(self.mirror_dir)
+                # Clone to the side so that an interrupted clone won't be
+                # mistaken for a mirror later on
+                tmp_where = "%s.tmp" % (where)
+                sh.deldir(tmp_where)
+                cmd = list(self.distro.get_command('git', 'clone'))
+                cmd += ['--mirror', uri, tmp_where]
+                sh.execute(*cmd)
+                sh.move(tmp_where, where)
+        return where
+
+
 class GitDownloader(Downloader):
 
-    def __init__(self, distro, uri, store_where, branch):
+    def __init__(self, distro, uri, store_where, branch, mirrors=None, update=False,
+                 depth=None, single_branch=False, sparse_paths=None):
         Downloader.__init__(self, uri, store_where)
         self.branch = branch
         self.distro = distro
+        self.update = update
+        # Only this much history is fetched (if given)
+        self.depth = depth
+        # Only the branch being checked out is fetched (if true)
+        self.single_branch = single_branch
+        # Only these paths are checked out (if given)
+        self.sparse_paths = sparse_paths
+        # A mirror would have the full history, which shallow clones are
+        # trying to avoid downloading
+        if self.depth:
+            mirrors = None
+        self.mirrors = mirrors
+        # Whether downloading changed what is checked out (set by download)
+        self.changed = False
+
+    def _clone(self):
+        cmd = list(self.distro.get_command('git', 'clone'))
+        if self.depth:
+            cmd += ['--depth', self.depth]
+        if self.single_branch:
+            cmd += ['--single-branch']
+            if self.branch:
+                cmd += ['--branch', self.branch]
+        if self.sparse_paths:
+            cmd += ['--no-checkout']
+        if not self.mirrors:
+            cmd += [self.uri, self.store_where]
+            sh.execute(*cmd)
+        else:
+            # A local clone of the mirror (which hard links the objects it
+            # can) that then points back at the real uri for later fetches
+            cmd += [self.mirrors.update(self.uri), self.store_where]
+            sh.execute(*cmd)
+            cmd = list(self.distro.get_command('git', 'set_url'))
+            cmd += ['origin', self.uri]
+            sh.execute(*cmd, cwd=self.store_where)
+        if self.sparse_paths:
+            self._sparse_checkout()
+
+    def _sparse_checkout(self):
+        LOG.info("Only checking out %s paths in %s.", len(self.sparse_paths), colorizer.quote(self.store_where))
+        cmd = list(self.distro.get_command('git', 'config'))
+        cmd += ['core.sparseCheckout', 'true']
+        sh.execute(*cmd, cwd=self.store_where)
+        info_dir = sh.joinpths(self.store_where, '.git', 'info')
+        sh.mkdirslist(info_dir)
+        sh.write_file(sh.joinpths(info_dir, 'sparse-checkout'), utils.joinlinesep(*(list(self.sparse_paths) + [''])))
+        cmd = list(self.distro.get_command('git', 'read_tree'))
+        cmd += ['-mu', 'HEAD']
+        sh.execute(*cmd, cwd=self.store_where)
+
+    def _rev_parse(self, ref):
+        cmd = list(self.distro.get_command('git', 'rev_parse'))
+        cmd += ['--verify', '-q', ref]
+        (stdout, _stderr) = sh.execute(*cmd, cwd=self.store_where, check_exit_code=False)
+        return stdout.strip()
+
+    def _fetch(self):
+        cmd = list(self.distro.get_command('git', 'fetch'))
+        if self.depth:
+            cmd += ['--depth', self.depth]
+        if self.mirrors:
+            # Only what is new in the mirror gets copied over
+            cmd += [self.mirrors.update(self.uri),
+                    '+refs/heads/*:refs/remotes/origin/*',
+                    '+refs/tags/*:refs/tags/*']
+        else:
+            cmd += ['origin']
+        sh.execute(*cmd, cwd=self.store_where)
+
+    def _fast_forward(self):
+        branch = self.branch or GIT_MASTER_BRANCH
+        cmd = list(self.distro.get_command('git', 'checkout'))
+        cmd += [branch]
+        sh.execute(*cmd, cwd=self.store_where)
+        if not self._rev_parse("refs/remotes/origin/%s" % (branch)):
+            # Pinned to a tag or commit (which the checkout already moved to)
+            return
+        cmd = list(self.distro.get_command('git', 'merge'))
+        cmd += ['--ff-only', "origin/%s" % (branch)]
+        try:
+            sh.execute(*cmd, cwd=self.store_where)
+        except excp.ProcessExecutionError as e:
+            LOG.warn("Could not fast-forward %s to %s, leaving it as it is: %s",
+                     colorizer.quote(self.store_where), colorizer.quote("origin/%s" % (branch)), e.description)
+
+    def _update(self):
+        LOG.info("Existing directory located at %s, updating it from %s.",
+                 colorizer.quote(self.store_where), colorizer.quote(self.uri))
+        before = self._rev_parse('HEAD')
+        self._fetch()
+        self._fast_forward()
+        after = self._rev_parse('HEAD')
+        self.changed = (before != after)
+        if self.changed:
+            LOG.info("Updated %s from %s to %s.", colorizer.quote(self.store_where),
+                     colorizer.quote(before[0:8]), colorizer.quote(after[0:8]))
+        else:
+            LOG.info("Nothing new was found for %s.", colorizer.quote(self.store_where))
 
     def download(self):
         dirsmade = list()
         if sh.isdir(self.store_where):
+            if self.update:
+                self._update()
+                return dirsmade
             LOG.info("Existing directory located at %s, leaving it alone.", colorizer.quote(self.store_where))
         else:
             LOG.info("Downloading %s to %s.", colorizer.quote(self.uri), colorizer.quote(self.store_where))
             dirsmade.extend(sh.mkdirslist(self.store_where))
-            cmd = list(self.distro.get_command('git', 'clone'))
-            cmd += [self.uri, self.store_where]
-            sh.execute(*cmd)
+            self._clone()
+            self.changed = True
         if self.branch and self.branch != GIT_MASTER_BRANCH:
             LOG.info("Adjusting branch to %s.", colorizer.quote(self.branch))
             cmd = list(self.distro.get_command('git', 'checkout'))
@@ -66,12 +296,226 @@ class GitDownloader(Downloader):
         return dirsmade
 
 
+class DownloadCache(object):
+    """
+    A persistent cache of url downloads.
+
+    Downloaded contents are stored (once) by their sha256 in an objects
+    directory and an index maps each url to the content it last had (and
+    the etag, last-modified and content-length the server reported for it).
+    Urls are revalidated with a conditional request each time they are
+    asked for and only downloaded again if they have changed. The least
+    recently used contents are evicted when the cache grows too big.
+    """
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.objects_dir = sh.joinpths(cache_dir, 'objects')
+        self.index_fn = sh.joinpths(cache_dir, 'index.json')
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'fetched': 0,
+            'saved': 0,
+            'evicted': 0,
+        }
+        self._lock = threading.RLock()
+        self._url_locks = dict()
+        self._validated = set()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        if not sh.isdir(self.objects_dir):
+            sh.mkdirslist(self.objects_dir)
+        self._entries = dict()
+        if sh.isfile(self.index_fn):
+            try:
+                with open(self.index_fn, 'rb') as fh:
+                    self._entries = json.load(fh)
+            except (IOError, ValueError) as e:
+                LOG.warn("Ignoring unreadable download cache index %r: %s", self.index_fn, e)
+        return self._entries
+
+    def _save(self):
+        tmp_fn = "%s.tmp" % (self.index_fn)
+        with _open_new(tmp_fn, 'wb') as fh:
+            json.dump(self._entries, fh)
+        os.rename(tmp_fn, self.index_fn)
+
+    def _object_fn(self, digest):
+        return sh.joinpths(self.objects_dir, digest)
+
+    def _lookup(self, url):
+        with self._lock:
+            entry = self._load().get(url)
+            if entry and not sh.isfile(self._object_fn(entry['sha256'])):
+                del self._entries[url]
+                entry = None
+            return entry
+
+    def _still_valid(self, entry, validators):
+        # Only trust a server that told us enough to tell the contents apart
+        if not validators['etag'] and not validators['last_modified']:
+            return False
+        for key in ['etag', 'last_modified', 'length']:
+            if validators[key] and validators[key] != entry.get(key):
+                return False
+        return True
+
+    def _deliver(self, digest, store_where):
+        src_fn = self._object_fn(digest)
+        if sh.exists(store_where):
+            os.unlink(store_where)
+        with sh.Unrooted():
+            try:
+                os.link(src_fn, store_where)
+            except OSError:
+                shutil.copyfile(src_fn, store_where)
+
+    def _hit(self, url, entry, store_where):
+        LOG.info("Using cached download of %s.", colorizer.quote(url))
+        with self._lock:
+            entry['used'] = time.time()
+            self.stats['hits'] += 1
+            self.stats['saved'] += entry['size']
+            self._save()
+        self._deliver(entry['sha256'], store_where)
+        return (store_where, 0)
+
+    def _store(self, url, conn, downloader):
+        # Partial downloads are left behind (named after the url) so that
+        # they can be resumed if the download gets interrupted
+        partial_fn = self._object_fn("%s.partial" % (hashlib.sha256(url).hexdigest()))
+        fetched = downloader.fetch_into(conn, partial_fn)
+        size = os.path.getsize(partial_fn)
+        entry = _get_validators(conn.headers)
+        # Connections that get cut short just stop sending (without failing)
+        # so what was received has to be checked before it gets cached
+        if entry['length'] and entry['length'].isdigit() and int(entry['length']) != size:
+            sh.unlink(partial_fn)
+            raise IOError("Server only sent %s of %s bytes of %s" % (size, entry['length'], url))
+        digest = _digest_file(partial_fn)
+        os.rename(partial_fn, self._object_fn(digest))
+        entry.update({
+            'sha256': digest,
+            'size': size,
+            'used': time.time(),
+        })
+        with self._lock:
+            self._entries[url] = entry
+            self.stats['misses'] += 1
+            self.stats['fetched'] += fetched
+            self._evict(keep=url)
+            self._save()
+        self._deliver(digest, downloader.store_where)
+        return (downloader.store_where, fetched)
+
+    def _evict(self, keep):
+        sizes = dict()
+        for entry in self._entries.values():
+            sizes[entry['sha256']] = entry['size']
+        total = sum(sizes.values())
+        by_age = sorted(self._entries.items(), key=lambda item: item[1]['used'])
+        for (url, entry) in by_age:
+            if total <= self.max_size:
+                break
+            if url == keep:
+                continue
+            del self._entries[url]
+            digest = entry['sha256']
+            if digest not in [e['sha256'] for e in self._entries.values()]:
+                LOG.debug("Evicting %s (%s bytes) from the download cache.", url, entry['size'])
+                sh.unlink(self._object_fn(digest))
+                total -= sizes[digest]
+                self.stats['evicted'] += 1
+
+    def _get_url_lock(self, url):
+        with self._lock:
+            if url not in self._url_locks:
+                self._url_locks[url] = threading.Lock()
+            return self._url_locks[url]
+
+    def fetch(self, downloader):
+        url = downloader.uri
+        # Only one fetch of a url happens at a time (the others then find it
+        # in the cache, without checking it again during the same run)
+        with self._get_url_lock(url):
+            entry = self._lookup(url)
+            if entry and url in self._validated:
+                return self._hit(url, entry, downloader.store_where)
+            result = self._fetch(url, entry, downloader)
+            self._validated.add(url)
+            return result
+
+    def _fetch(self, url, entry, downloader):
+        headers = dict()
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            conn = downloader.open(headers)
+        except urllib2.HTTPError as e:
+            if e.code == 304 and entry:
+                return self._hit(url, entry, downloader.store_where)
+            raise
+        except (urllib2.URLError, socket.error) as e:
+            if not entry:
+                raise
+            LOG.warn("Could not revalidate %s (%s), using the cached download of it.", colorizer.quote(url), e)
+            return self._hit(url, entry, downloader.store_where)
+        with contextlib.closing(conn):
+            if entry and self._still_valid(entry, _get_validators(conn.headers)):
+                return self._hit(url, entry, downloader.store_where)
+            return self._store(url, conn, downloader)
+
+    def log_stats(self):
+        if not self.stats['hits'] and not self.stats['misses']:
+            return
+        LOG.info("Download cache at %s had %s hits and %s misses.", colorizer.quote(self.cache_dir),
+                 colorizer.quote(self.stats['hits']), colorizer.quote(self.stats['misses']))
+        LOG.info("It downloaded %s bytes, avoided downloading %s bytes and evicted %s entries.",
+                 colorizer.quote(self.stats['fetched']), colorizer.quote(self.stats['saved']),
+                 colorizer.quote(self.stats['evicted']))
+
+
+class _Progress(object):
+    """
+    Sums up how much (possibly many threads) have downloaded into a
+    single progress bar.
+    """
+
+    def __init__(self, bar, total):
+        self.bar = bar
+        self.total = total
+        self.done = 0
+        self._lock = threading.Lock()
+        if self.bar:
+            self.bar.start()
+
+    def add(self, amount):
+        with self._lock:
+            self.done += amount
+            if self.bar:
+                self.bar.update(min(self.done, self.total))
+
+    def finish(self):
+        if self.bar:
+            self.bar.finish()
+
+
 class UrlLibDownloader(Downloader):
 
     def __init__(self, uri, store_where, **kargs):
         Downloader.__init__(self, uri, store_where)
         self.quiet = kargs.get('quiet', False)
         self.timeout = kargs.get('timeout', 5)
+        self.cache = kargs.get('cache', get_cache())
+        self.ranges = max(1, int(kargs.get('ranges', get_ranges())))
 
     def _make_bar(self, size):
         widgets = [
@@ -82,26 +526,177 @@ class UrlLibDownloader(Downloader):
         ]
         return progressbar.ProgressBar(widgets=widgets, maxval=size)
 
-    def download(self):
-        LOG.info('Downloading using urllib2: %s to %s.', colorizer.quote(self.uri), colorizer.quote(self.store_where))
-        p_bar = None
+    def open(self, headers=None):
+        request = urllib2.Request(self.uri, headers=(headers or {}))
+        return urllib2.urlopen(request, timeout=self.timeout)
+
+    def _pipe(self, in_fh, out_fh, progress):
+        piped = [0]
+
+        def on_piped(bytes_piped):
+            progress.add(bytes_piped - piped[0])
+            piped[0] = bytes_piped
 
-        def update_bar(progress_bar, bytes_down):
-            if progress_bar:
-                progress_bar.update(bytes_down)
+        return sh.pipe_in_out(in_fh, out_fh, chunk_size=BUFFER_SIZE, chunk_cb=on_piped)
 
+    def _transfer(self, conn, fn):
+        bar = None
+        c_len = conn.headers.get('content-length')
+        if c_len is not None:
+            try:
+                c_len = int(c_len)
+                bar = self._make_bar(c_len)
+            except ValueError:
+                c_len = None
+        progress = _Progress(bar, c_len)
         try:
-            with contextlib.closing(urllib2.urlopen(self.uri, timeout=self.timeout)) as conn:
-                c_len = conn.headers.get('content-length')
-                if c_len is not None:
-                    try:
-                        p_bar = self._make_bar(int(c_len))
-                        p_bar.start()
-                    except ValueError:
-                        pass
-                with open(self.store_where, 'wb') as ofh:
-                    return (self.store_where, sh.pipe_in_out(conn, ofh,
-                                            chunk_cb=functools.partial(update_bar, p_bar)))
+            with _open_new(fn, 'wb') as ofh:
+                transferred = self._pipe(conn, ofh, progress)
         finally:
-            if p_bar:
-                p_bar.finish()
+            progress.finish()
+        if c_len is not None and transferred != c_len:
+            sh.unlink(fn)
+            raise IOError("Server only sent %s of %s bytes of %s" % (transferred, c_len, self.uri))
+        return transferred
+
+    def _plan_ranges(self, length):
+        count = max(1, min(self.ranges, length // MIN_RANGE_SIZE))
+        size = (length + count - 1) // count
+        ranges = list()
+        for start in range(0, length, size):
+            ranges.append([start, min(start + size, length) - 1])
+        return ranges
+
+    def _part_fn(self, fn, r):
+        return "%s.%s-%s.part" % (fn, r[0], r[1])
+
+    def _prepare_parts(self, fn, length, validators):
+        # The parts left behind by an earlier attempt can only be reused if
+        # they were split the same way and the contents have not changed.
+        ranges = self._plan_ranges(length)
+        state = {
+            'ranges': ranges,
+            'validators': validators,
+        }
+        state_fn = "%s.parts" % (fn)
+        old_state = None
+        if sh.isfile(state_fn):
+            try:
+                with open(state_fn, 'rb') as fh:
+                    old_state = json.load(fh)
+            except (IOError, ValueError):
+                pass
+        if old_state != state:
+            self._remove_parts(fn)
+            with _open_new(state_fn, 'wb') as fh:
+                json.dump(state, fh)
+        have = 0
+        for r in ranges:
+            part_fn = self._part_fn(fn, r)
+            if sh.isfile(part_fn):
+                have += os.path.getsize(part_fn)
+        if have:
+            LOG.info("Resuming download of %s (%s of %s bytes were already downloaded).",
+                     colorizer.quote(self.uri), have, length)
+        return (ranges, length - have)
+
+    def _fetch_range(self, fn, r, progress):
+        # Returns false if the server sent all of it (instead of the range)
+        (start, end) = r
+        part_fn = self._part_fn(fn, r)
+        have = 0
+        if sh.isfile(part_fn):
+            have = os.path.getsize(part_fn)
+        if start + have > end:
+            return True
+        headers = {
+            'Range': "bytes=%s-%s" % (start + have, end),
+        }
+        with contextlib.closing(self.open(headers)) as conn:
+            if conn.getcode() == 200:
+                return False
+            if conn.getcode() != 206:
+                raise IOError("Server did not send the range %s of %s" % (headers['Range'], self.uri))
+            with _open_new(part_fn, 'ab') as ofh:
+                self._pipe(conn, ofh, progress)
+        # Connections that get cut short just stop sending (without failing)
+        if os.path.getsize(part_fn) != end - start + 1:
+            raise IOError("Server only sent %s of %s bytes of %s" % (os.path.getsize(part_fn) - have,
+                                                                    end - start + 1 - have, headers['Range']))
+        return True
+
+    def _remove_parts(self, fn):
+        for part_fn in glob.glob("%s.*.part" % (fn)):
+            sh.unlink(part_fn)
+        sh.unlink("%s.parts" % (fn))
+
+    def _join_parts(self, fn, ranges):
+        if len(ranges) == 1:
+            os.rename(self._part_fn(fn, ranges[0]), fn)
+        else:
+            with _open_new(fn, 'wb') as ofh:
+                for r in ranges:
+                    part_fn = self._part_fn(fn, r)
+                    with open(part_fn, 'rb') as ifh:
+                        sh.pipe_in_out(ifh, ofh, chunk_size=BUFFER_SIZE)
+                    os.unlink(part_fn)
+        os.unlink("%s.parts" % (fn))
+
+    def _ranged_transfer(self, fn, length, validators):
+        (ranges, remaining) = self._prepare_parts(fn, length, validators)
+        if len(ranges) > 1:
+            LOG.debug("Fetching %s in %s ranges at the same time.", self.uri, len(ranges))
+        progress = _Progress(self._make_bar(max(1, remaining)), remaining)
+        attempt = 0
+        ranged = True
+        try:
+            while True:
+                try:
+                    if len(ranges) == 1:
+                        ranged = self._fetch_range(fn, ranges[0], progress)
+                    else:
+                        with pool.WorkerPool(len(ranges), name='download') as workers:
+                            futs = [workers.submit(self._fetch_range, fn, r, progress) for r in ranges]
+                            for fut in futs:
+                                fut.exception()
+                        ranged = all([fut.result() for fut in futs])
+                    break
+                except (IOError, httplib.HTTPException) as e:
+                    attempt += 1
+                    if attempt > RESUME_ATTEMPTS:
+                        raise
+                    LOG.warn("Download of %s was interrupted (%s), resuming it (attempt %s of %s).",
+                             colorizer.quote(self.uri), e, attempt, RESUME_ATTEMPTS)
+        finally:
+            progress.finish()
+        if not ranged:
+            # Servers that say they support ranges do not always do so
+            LOG.debug("Server did not send ranges of %s, fetching all of it instead.", self.uri)
+            self._remove_parts(fn)
+            with contextlib.closing(self.open()) as conn:
+                return self._transfer(conn, fn)
+        self._join_parts(fn, ranges)
+        return progress.done
+
+    def fetch_into(self, conn, fn):
+        """
+        Downloads what the connection (to the url) is for into the given file,
+        returning how many bytes had to be downloaded.
+
+        When the server supports ranges the contents are fetched in pieces
+        (that are resumed if they get interrupted) instead.
+        """
+        length = conn.headers.get('content-length') or ''
+        ranged = conn.headers.get('accept-ranges') == 'bytes'
+        if not ranged or not length.isdigit() or not int(length):
+            return self._transfer(conn, fn)
+        # The ranges will be fetched using their own connections
+        conn.close()
+        return self._ranged_transfer(fn, int(length), _get_validators(conn.headers))
+
+    def download(self):
+        LOG.info('Downloading using urllib2: %s to %s.', colorizer.quote(self.uri), colorizer.quote(self.store_where))
+        if self.cache:
+            return self.cache.fetch(self)
+        with contextlib.closing(self.open()) as conn:
+            return (self.store_where, self.fetch_into(conn, self.store_where))
@@ -84,3 +84,14 @@ class ProcessExecutionError(IOError):
                                             self.exit_code, self.stdout,
                                             self.stderr))
         IOError.__init__(self, message)
+
+
+class ProcessTimeoutError(ProcessExecutionError):
+    def __init__(self, timeout, stdout=None, stderr=None,
+                 exit_code=None, cmd=None):
+        # What the command output before it was killed is kept
+        self.timeout = timeout
+        description = 'Command did not finish within %s seconds.' % (timeout)
+        ProcessExecutionError.__init__(self, stdout=stdout, stderr=stderr,
+                                       exit_code=exit_code, cmd=cmd,
+                                       description=description)
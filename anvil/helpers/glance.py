@@ -18,12 +18,16 @@ import contextlib
 import os
 import re
 import tarfile
+import tempfile
+import threading
+import time
 import urlparse
 
 from anvil import colorizer
 from anvil import downloader as down
 from anvil import importer
 from anvil import log
+from anvil import pool
 from anvil import shell as sh
 from anvil import utils
 
@@ -230,9 +234,15 @@ class Unpacker(object):
 
 
 class Registry(object):
+    """
+    Knows which images glance has (listing them only once and then keeping
+    track of what gets created).
+    """
 
     def __init__(self, client):
         self.client = client
+        self.lock = threading.Lock()
+        self.names = None
 
     def _extract_names(self):
         names = dict()
@@ -242,8 +252,24 @@ class Registry(object):
             names[name] = image.id
         return names
 
+    def _get_names(self):
+        with self.lock:
+            if self.names is None:
+                self.names = self._extract_names()
+                LOG.debug("Glance has %s images.", len(self.names))
+            return self.names
+
+    def add(self, name, image_id):
+        with self.lock:
+            if self.names is not None:
+                self.names[name] = image_id
+
+    def which_exist(self, names):
+        known = self._get_names()
+        return set([name for name in names if name in known])
+
     def __contains__(self, name):
-        names = self._extract_names()
+        names = self._get_names()
         if name in names:
             return True
         else:
@@ -252,9 +278,11 @@ class Registry(object):
 
 class Image(object):
 
-    def __init__(self, client, url):
+    def __init__(self, client, url, registry=None):
         self.client = client
-        self.registry = Registry(client)
+        if registry is None:
+            registry = Registry(client)
+        self.registry = registry
         self.url = url
         self.parsed_url = urlparse.urlparse(url)
 
@@ -263,57 +291,56 @@ class Image(object):
         if name in self.registry:
             raise IOError("Image named %s already exists." % (name))
 
+    def _upload(self, name, piece, properties=None):
+        self._check_name(name)
+        args = dict()
+        args['name'] = name
+        if properties:
+            args['properties'] = properties
+        args['container_format'] = piece['container_format']
+        args['disk_format'] = piece['disk_format']
+        LOG.info("Please wait installing...")
+        with open(piece['file_name'], 'r') as fh:
+            resource = self.client.images.create(data=fh, **args)
+        self.registry.add(name, resource.id)
+        return resource.id
+
+    def upload_kernel(self, image_name, kernel):
+        kernel_image_name = "%s-vmlinuz" % (image_name)
+        LOG.info('Adding kernel %s to glance.', colorizer.quote(kernel_image_name))
+        return self._upload(kernel_image_name, kernel)
+
+    def upload_ramdisk(self, image_name, initrd):
+        ram_image_name = "%s-initrd" % (image_name)
+        LOG.info('Adding ramdisk %s to glance.', colorizer.quote(ram_image_name))
+        return self._upload(ram_image_name, initrd)
+
+    def upload_root(self, image_name, location, kernel_id='', initrd_id=''):
+        # The root is uploaded last since it refers to the kernel + ramdisk
+        LOG.info('Adding image %s to glance.', colorizer.quote(image_name))
+        properties = dict()
+        if kernel_id:
+            properties['kernel_id'] = kernel_id
+        if initrd_id:
+            properties['ramdisk_id'] = initrd_id
+        return self._upload(image_name, location, properties)
+
     def _register(self, image_name, location):
 
         # Upload the kernel, if we have one
         kernel = location.pop('kernel', None)
         kernel_id = ''
         if kernel:
-            kernel_image_name = "%s-vmlinuz" % (image_name)
-            self._check_name(kernel_image_name)
-            LOG.info('Adding kernel %s to glance.', colorizer.quote(kernel_image_name))
-            LOG.info("Please wait installing...")
-            with open(kernel['file_name'], 'r') as fh:
-                resource = self.client.images.create(data=fh,
-                    container_format=kernel['container_format'],
-                    disk_format=kernel['disk_format'],
-                    name=kernel_image_name)
-                kernel_id = resource.id
+            kernel_id = self.upload_kernel(image_name, kernel)
 
         # Upload the ramdisk, if we have one
         initrd = location.pop('ramdisk', None)
         initrd_id = ''
         if initrd:
-            ram_image_name = "%s-initrd" % (image_name)
-            self._check_name(ram_image_name)
-            LOG.info('Adding ramdisk %s to glance.', colorizer.quote(ram_image_name))
-            LOG.info("Please wait installing...")
-            with open(initrd['file_name'], 'r') as fh:
-                resource = self.client.images.create(data=fh,
-                    container_format=initrd['container_format'],
-                    disk_format=initrd['disk_format'],
-                    name=ram_image_name)
-                initrd_id = resource.id
+            initrd_id = self.upload_ramdisk(image_name, initrd)
 
         # Upload the root, we must have one...
-        LOG.info('Adding image %s to glance.', colorizer.quote(image_name))
-        self._check_name(image_name)
-        args = dict()
-        args['name'] = image_name
-        if kernel_id or initrd_id:
-            args['properties'] = dict()
-            if kernel_id:
-                args['properties']['kernel_id'] = kernel_id
-            if initrd_id:
-                args['properties']['ramdisk_id'] = initrd_id
-        args['container_format'] = location['container_format']
-        args['disk_format'] = location['disk_format']
-        LOG.info("Please wait installing...")
-        with open(location['file_name'], 'r') as fh:
-            resource = self.client.images.create(data=fh, **args)
-            img_id = resource.id
-
-        return img_id
+        return self.upload_root(image_name, location, kernel_id, initrd_id)
 
     def _generate_img_name(self, url_fn):
         name = url_fn
@@ -327,26 +354,69 @@ class Image(object):
     def _is_url_local(self):
         return (sh.exists(self.url) or (self.parsed_url.scheme == '' and self.parsed_url.netloc == ''))
 
-    def install(self):
+    def get_name(self):
         url_fn = self._extract_url_fn()
         if not url_fn:
             raise IOError("Can not determine file name from url: %r" % (self.url))
+        return self._generate_img_name(url_fn)
+
+    def fetch(self, tdir):
+        """
+        Downloads the image into the given directory (if it is not local),
+        returning where it is and how many bytes were downloaded.
+        """
+        url_fn = self._extract_url_fn()
+        if not url_fn:
+            raise IOError("Can not determine file name from url: %r" % (self.url))
+        if self._is_url_local():
+            return (self.url, 0)
+        (fetched_fn, bytes_down) = down.UrlLibDownloader(self.url, sh.joinpths(tdir, url_fn)).download()
+        LOG.debug("For url %s we downloaded %s bytes to %s", self.url, bytes_down, fetched_fn)
+        return (fetched_fn, bytes_down)
+
+    def unpack(self, fetched_fn, tdir):
+        return Unpacker().unpack(self._extract_url_fn(), fetched_fn, tdir)
+
+    def install(self):
+        tgt_image_name = self.get_name()
         with utils.tempdir() as tdir:
-            if not self._is_url_local():
-                (fetched_fn, bytes_down) = down.UrlLibDownloader(self.url, sh.joinpths(tdir, url_fn)).download()
-                LOG.debug("For url %s we downloaded %s bytes to %s", self.url, bytes_down, fetched_fn)
-            else:
-                fetched_fn = self.url
-            unpack_info = Unpacker().unpack(url_fn, fetched_fn, tdir)
-            tgt_image_name = self._generate_img_name(url_fn)
+            (fetched_fn, _bytes_down) = self.fetch(tdir)
+            unpack_info = self.unpack(fetched_fn, tdir)
             img_id = self._register(tgt_image_name, unpack_info)
             return (tgt_image_name, img_id)
 
 
+class _ImageJob(object):
+    """
+    Tracks an image as it goes through the download, extract and upload stages.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self.name = image.get_name()
+        self.tdir = tempfile.mkdtemp()
+        self.location = None
+        self.failed = False
+        self.pieces = list()
+        self.ids = dict()
+        self.timings = dict()
+        self.started_at = time.time()
+
+    def cleanup(self):
+        if self.tdir:
+            sh.deldir(self.tdir)
+            self.tdir = None
+
+
 class UploadService:
 
-    def __init__(self, params):
+    def __init__(self, params, download_workers=2, extract_workers=1, upload_workers=3):
         self.params = params
+        # Each stage gets its own (bounded) set of workers so that (for
+        # example) one image can download while another one uploads.
+        self.download_workers = download_workers
+        self.extract_workers = extract_workers
+        self.upload_workers = upload_workers
 
     def _get_token(self, kclient_v2):
         LOG.info("Getting your keystone token so that image uploads may proceed.")
@@ -357,6 +427,125 @@ class UploadService:
             auth_url=params['endpoints']['public']['uri'])
         return client.auth_token
 
+    def _timed(self, job, stage, functor, *args):
+        started_at = time.time()
+        try:
+            return functor(*args)
+        finally:
+            job.timings[stage] = time.time() - started_at
+
+    def _log_timings(self, job):
+        stages = list()
+        for stage in ['download', 'extract', 'kernel', 'ramdisk', 'root']:
+            if stage in job.timings:
+                stages.append("%s %.2fs" % (stage, job.timings[stage]))
+        LOG.info("Image %s took %.2f seconds (%s).", colorizer.quote(job.name),
+                 time.time() - job.started_at, ", ".join(stages))
+
+    def _pipeline(self, client, urls, failures):
+        """
+        Downloads, extracts and uploads the images at the given urls with each
+        of those being a separate stage with its own workers (the kernel and
+        ramdisk of an image are uploaded at the same time).
+        """
+        am_installed = 0
+        bytes_down = 0
+        started_at = time.time()
+        jobs = list()
+        running = dict()
+        waiter = pool.Waiter()
+        pools = {
+            'download': pool.WorkerPool(self.download_workers, name='image-download'),
+            'extract': pool.WorkerPool(self.extract_workers, name='image-extract'),
+            'upload': pool.WorkerPool(self.upload_workers, name='image-upload'),
+        }
+
+        def submit(job, stage, functor, *args):
+            if stage in pools:
+                workers = pools[stage]
+            else:
+                workers = pools['upload']
+            fut = workers.submit(self._timed, job, stage, functor, *args)
+            running[waiter.watch(fut)] = (job, stage)
+
+        def upload_root(job):
+            submit(job, 'root', job.image.upload_root, job.name, job.location,
+                   job.ids.get('kernel', ''), job.ids.get('ramdisk', ''))
+
+        try:
+            # Glance is only asked which images it has once (and that is kept
+            # up to date as images get uploaded)
+            registry = Registry(client)
+            images = list()
+            for url in urls:
+                try:
+                    image = Image(client, url, registry)
+                    images.append((image.get_name(), image))
+                except IOError as e:
+                    LOG.exception('Installing %r failed due to: %s', url, e)
+            try:
+                existing = registry.which_exist([name for (name, _image) in images])
+            except failures as e:
+                LOG.exception('Finding the images glance already has failed due to: %s', e)
+                return am_installed
+            for (name, image) in images:
+                if name in existing:
+                    LOG.info("Skipping %r since an image named %s already exists in glance.", image.url, colorizer.quote(name))
+                    continue
+                if name in [j.name for j in jobs]:
+                    # Uploading it twice at the same time could make duplicates
+                    LOG.warn("Skipping %r since an image named %s is already being installed.", image.url, colorizer.quote(name))
+                    continue
+                job = _ImageJob(image)
+                jobs.append(job)
+                submit(job, 'download', job.image.fetch, job.tdir)
+            while waiter.pending:
+                fut = waiter.next_done()
+                (job, stage) = running.pop(fut)
+                try:
+                    result = fut.result()
+                except failures as e:
+                    LOG.exception('Installing %r failed due to: %s', job.image.url, e)
+                    job.failed = True
+                if not job.failed:
+                    if stage == 'download':
+                        (fetched_fn, job_bytes_down) = result
+                        bytes_down += job_bytes_down
+                        submit(job, 'extract', job.image.unpack, fetched_fn, job.tdir)
+                    elif stage == 'extract':
+                        job.location = result
+                        kernel = job.location.pop('kernel', None)
+                        if kernel:
+                            job.pieces.append('kernel')
+                            submit(job, 'kernel', job.image.upload_kernel, job.name, kernel)
+                        initrd = job.location.pop('ramdisk', None)
+                        if initrd:
+                            job.pieces.append('ramdisk')
+                            submit(job, 'ramdisk', job.image.upload_ramdisk, job.name, initrd)
+                        if not job.pieces:
+                            upload_root(job)
+                    elif stage in ['kernel', 'ramdisk']:
+                        job.ids[stage] = result
+                        if len(job.ids) == len(job.pieces):
+                            upload_root(job)
+                    else:
+                        LOG.info("Installed image named %s with image id %s.", colorizer.quote(job.name), colorizer.quote(result))
+                        self._log_timings(job)
+                        am_installed += 1
+                if job not in [j for (j, _stage) in running.values()]:
+                    job.cleanup()
+        finally:
+            # The workers may still be using the jobs temporary directories
+            # so they have to be done before those get cleaned up
+            for workers in pools.values():
+                workers.shutdown(wait=True)
+            for job in jobs:
+                job.cleanup()
+        taken = max(0.001, time.time() - started_at)
+        LOG.info("Installed %s of %s images in %.2f seconds (%.2f images per minute, %.2f KB/s downloaded).",
+                 am_installed, len(urls), taken, am_installed * 60.0 / taken, bytes_down / 1024.0 / taken)
+        return am_installed
+
     def install(self, urls):
         am_installed = 0
         try:
@@ -378,16 +567,10 @@ class UploadService:
                 return am_installed
             utils.log_iterable(urls, logger=LOG,
                                 header="Attempting to download+extract+upload %s images" % len(urls))
-            for url in urls:
-                try:
-                    (name, img_id) = Image(client, url).install()
-                    LOG.info("Installed image named %s with image id %s.", colorizer.quote(name), colorizer.quote(img_id))
-                    am_installed += 1
-                except (IOError,
-                        tarfile.TarError,
-                        gexceptions.ClientException,
-                        kexceptions.ClientException) as e:
-                    LOG.exception('Installing %r failed due to: %s', url, e)
+            am_installed = self._pipeline(client, urls, (IOError,
+                                                         tarfile.TarError,
+                                                         gexceptions.ClientException,
+                                                         kexceptions.ClientException))
         return am_installed
 
 
@@ -94,8 +94,24 @@ def parse():
                           default=True,
                           help="do not prompt the user for passwords",
                           )
+    base_group.add_option("-j", "--jobs",
+        action="store",
+        type="int",
+        dest="jobs",
+        default=1,
+        metavar="JOBS",
+        help=("number of components to work on at once when they do not "
+              "depend on each other (default: %default)"))
     parser.add_option_group(base_group)
 
+    status_group = OptionGroup(parser, "Status specific options")
+    status_group.add_option("--json",
+        action="store_true",
+        dest="json",
+        help="output the status of the components as json (default: %default)",
+        default=False)
+    parser.add_option_group(status_group)
+
     # Uninstall and stop options
     stop_un_group = OptionGroup(parser, "Uninstall & stop specific options")
     stop_un_group.add_option("-n", "--no-force",
@@ -121,6 +137,8 @@ def parse():
     output['action'] = options.action or ""
     output['force'] = not options.force
     output['keep_old'] = options.keep_old
+    output['jobs'] = options.jobs
+    output['json'] = options.json
     output['extras'] = args
     output['config_fn'] = options.config_fn
     output['persona_fn'] = options.persona_fn
@@ -15,20 +15,151 @@
 #    under the License.
 
 import abc
+import fnmatch
+import threading
 
 from anvil import colorizer
+from anvil import exceptions as excp
 from anvil import importer
 from anvil import log as logging
 from anvil import utils
 
 LOG = logging.getLogger(__name__)
 
+# Package managers (and pip) do not play nicely when many of them are
+# running at once, so components running concurrently take turns.
+TRANSACTION_LOCK = threading.RLock()
+
+
+def _first_of_each_name(pkgs):
+    seen = set()
+    firsts = list()
+    for p in pkgs:
+        if p['name'] not in seen:
+            seen.add(p['name'])
+            firsts.append(p)
+    return firsts
+
+
+def same_version(version, other_version):
+    # So that 1.5 and 1.5.0 are seen as being the same version
+    def trimmed(v):
+        pieces = list(utils.versionize(v).version)
+        while pieces and pieces[-1] == 0:
+            pieces.pop()
+        return pieces
+    return trimmed(version) == trimmed(other_version)
+
+
+def find_conflicts(entries):
+    """
+    Returns the names of the packages that the given (packager, package) pairs
+    ask for different versions of (and the versions that were asked for).
+    """
+    wanted = dict()
+    for (_pkgr, pkg) in entries:
+        version = pkg.get('version')
+        if version is None:
+            continue
+        versions = wanted.setdefault(pkg['name'], list())
+        if not [v for v in versions if same_version(v, version)]:
+            versions.append(version)
+    conflicts = dict()
+    for (name, versions) in wanted.items():
+        if len(versions) > 1:
+            conflicts[name] = versions
+    return conflicts
+
+
+def _batch_by_packager(entries):
+    # Packagers of the same kind can do each others work, so group the
+    # (packager, package) pairs by the packagers class.
+    batches = list()
+    for (pkgr, pkg) in entries:
+        for (lead, batch) in batches:
+            if type(lead) is type(pkgr):
+                batch.append((pkgr, pkg))
+                break
+        else:
+            batches.append((pkgr, [(pkgr, pkg)]))
+    return batches
+
+
+def install_batched(entries):
+    """
+    Installs the given (packager, package) pairs using as few package manager
+    transactions as possible, noting the installs in each packagers registry.
+    """
+    for (lead, batch) in _batch_by_packager(entries):
+        pending = [(pkgr, pkg) for (pkgr, pkg) in batch if pkgr._needs_install(pkg)]
+        if not pending:
+            continue
+        # A scratch registry is used so that each registry only ends up
+        # noting the packages that were requested through it.
+        batcher = type(lead)(lead.distro, PackageRegistry())
+        installed = batcher.install_batch([pkg for (_pkgr, pkg) in pending])
+        versions = dict((p['name'], p.get('version')) for p in installed)
+        for (pkgr, pkg) in pending:
+            name = pkg['name']
+            if name in versions and same_version(versions[name], pkg.get('version')):
+                pkgr._note_installed(pkg)
+
+
+def remove_batched(entries):
+    """
+    Removes the given (packager, package) pairs using as few package manager
+    transactions as possible, noting the removals in each packagers registry.
+    """
+    for (lead, batch) in _batch_by_packager(entries):
+        pending = list()
+        for (pkgr, pkg) in batch:
+            if pkg.get('removable', True) and pkg['name'] not in pkgr.registry.removed:
+                pending.append((pkgr, pkg))
+        if not pending:
+            continue
+        batcher = type(lead)(lead.distro, PackageRegistry())
+        removed = batcher.remove_batch([pkg for (_pkgr, pkg) in pending])
+        names = set([p['name'] for p in removed])
+        for (pkgr, pkg) in pending:
+            if pkg['name'] in names:
+                pkgr._note_removed(pkg)
+
 
 class PackageRegistry(object):
 
-    def __init__(self):
+    def __init__(self, present=None):
         self.installed = dict()
         self.removed = dict()
+        # What the system had installed before we started (name -> versions)
+        self.present = dict()
+        for (name, version) in (present or []):
+            self.present.setdefault(name, set()).add(version)
+
+    def is_present(self, name, version):
+        for present_version in self.present.get(name, []):
+            if present_version == version or fnmatch.fnmatchcase(present_version, version):
+                return True
+        return False
+
+
+class PackageRegistries(object):
+    """
+    Package registries (one per type of packager) that can be shared by many
+    packager factories, so that what one component installs (or removes) is
+    known to the others.
+    """
+
+    def __init__(self):
+        self.registries = dict()
+        self.lock = threading.Lock()
+
+    def get(self, packager_cls):
+        with self.lock:
+            if packager_cls not in self.registries:
+                present = packager_cls.list_installed()
+                LOG.debug("Found %s packages already installed for packager %s", len(present), packager_cls)
+                self.registries[packager_cls] = PackageRegistry(present)
+            return self.registries[packager_cls]
 
 
 class Packager(object):
@@ -39,15 +170,18 @@ class Packager(object):
         self.distro = distro
         self.registry = registry
 
-    def install(self, pkg):
+    def _needs_install(self, pkg):
         name = pkg['name']
         version = pkg.get('version')
-        skip_install = False
-        if name in self.registry.installed:
+        if name not in self.registry.installed:
+            if version and self.registry.is_present(name, version):
+                LOG.debug("Skipping install of %r since v(%s) is already on the system.", name, version)
+                return False
+        else:
             existing_version = self.registry.installed[name]
             if version == existing_version:
                 LOG.debug("Skipping install of %r since it already happened.", name)
-                skip_install = True
+                return False
             else:
                 if existing_version is not None:
                     if utils.versionize(existing_version) < utils.versionize(version):
@@ -59,28 +193,103 @@ class Packager(object):
                 else:
                     LOG.warn(("A request has come in for a 'potentially' different version of %s v(%s),"
                         " when a unspecified version was previously installed!"), colorizer.quote(name), version)
-        if not skip_install:
-            self._install(pkg)
-            LOG.debug("Noting that %r - v(%s) was installed.", name, (version or "??"))
-            self.registry.installed[name] = version
-            if name in self.registry.removed:
-                del(self.registry.removed[name])
+        return True
+
+    def _note_installed(self, pkg):
+        name = pkg['name']
+        version = pkg.get('version')
+        LOG.debug("Noting that %r - v(%s) was installed.", name, (version or "??"))
+        self.registry.installed[name] = version
+        if name in self.registry.removed:
+            del(self.registry.removed[name])
+
+    def _note_removed(self, pkg):
+        name = pkg['name']
+        LOG.debug("Noting that %r was removed.", name)
+        self.registry.removed[name] = True
+        if name in self.registry.installed:
+            del(self.registry.installed[name])
+        if name in self.registry.present:
+            del(self.registry.present[name])
+
+    @classmethod
+    def list_installed(cls):
+        """
+        Returns (name, version) pairs of what the system already has installed.
+        """
+        return []
+
+    def install(self, pkg):
+        with TRANSACTION_LOCK:
+            if self._needs_install(pkg):
+                self._install(pkg)
+                self._note_installed(pkg)
 
     def remove(self, pkg):
         removable = pkg.get('removable', True)
         if not removable:
             return False
         name = pkg['name']
-        if name in self.registry.removed:
-            LOG.debug("Skipping removal of %r since it already happened.", name)
-        else:
-            self._remove(pkg)
-            LOG.debug("Noting that %r was removed.", name)
-            self.registry.removed[name] = True
-            if name in self.registry.installed:
-                del(self.registry.installed[name])
+        with TRANSACTION_LOCK:
+            if name in self.registry.removed:
+                LOG.debug("Skipping removal of %r since it already happened.", name)
+            else:
+                self._remove(pkg)
+                self._note_removed(pkg)
         return True
 
+    def install_batch(self, pkgs):
+        """
+        Installs the given packages using a single package manager transaction
+        (if this packager supports that), falling back to installing them one at
+        a time if that transaction fails. Returns the packages that are now
+        installed (only the first of any packages with the same name is used).
+        """
+        wanted = _first_of_each_name(pkgs)
+        pending = [p for p in wanted if self._needs_install(p)]
+        batched = False
+        if len(pending) > 1:
+            pkg_names = [p['name'] for p in pending]
+            utils.log_iterable(pkg_names, logger=LOG,
+                header="Installing %s packages in one transaction" % (len(pkg_names)))
+            try:
+                with TRANSACTION_LOCK:
+                    batched = self._install_batch(pending)
+            except excp.ProcessExecutionError as e:
+                LOG.warn("Batched install of %s packages failed, installing them one at a time instead: %s", len(pending), e)
+        for p in pending:
+            if not batched:
+                with TRANSACTION_LOCK:
+                    self._install(p)
+            self._note_installed(p)
+        return wanted
+
+    def remove_batch(self, pkgs):
+        """
+        Removes the given packages using a single package manager transaction
+        (if this packager supports that), falling back to removing them one at
+        a time if that transaction fails. Returns the packages that were
+        removable (the same ones that remove() would return true for).
+        """
+        removable = _first_of_each_name([p for p in pkgs if p.get('removable', True)])
+        pending = [p for p in removable if p['name'] not in self.registry.removed]
+        batched = False
+        if len(pending) > 1:
+            pkg_names = [p['name'] for p in pending]
+            utils.log_iterable(pkg_names, logger=LOG,
+                header="Removing %s packages in one transaction" % (len(pkg_names)))
+            try:
+                with TRANSACTION_LOCK:
+                    batched = self._remove_batch(pending)
+            except excp.ProcessExecutionError as e:
+                LOG.warn("Batched removal of %s packages failed, removing them one at a time instead: %s", len(pending), e)
+        for p in pending:
+            if not batched:
+                with TRANSACTION_LOCK:
+                    self._remove(p)
+            self._note_removed(p)
+        return removable
+
     def pre_install(self, pkg, params=None):
         cmds = pkg.get('pre-install')
         if cmds:
@@ -93,6 +302,14 @@ class Packager(object):
             LOG.info("Running post-install commands for package %s.", colorizer.quote(pkg['name']))
             utils.execute_template(*cmds, params=params)
 
+    def _install_batch(self, pkgs):
+        # Packagers that can install many packages at once override this
+        # and return true when they have done so.
+        return False
+
+    def _remove_batch(self, pkgs):
+        return False
+
     @abc.abstractmethod
     def _remove(self, pkg):
         pass
@@ -106,15 +323,17 @@ class PackagerFactory(object):
 
     PACKAGER_KEY_NAME = 'packager_name'
 
-    def __init__(self, distro, default_packager_cls):
+    def __init__(self, distro, default_packager_cls, registries=None):
         self.default_packager = None
         self.default_packager_cls = default_packager_cls
         self.distro = distro
         self.fetched_packagers = dict()
-        self.registry = PackageRegistry()
+        if registries is None:
+            registries = PackageRegistries()
+        self.registries = registries
 
     def _construct_pkger(self, cls):
-        return cls(self.distro, self.registry)
+        return cls(self.distro, self.registries.get(cls))
 
     def _get_default_pkgr(self):
         if not self.default_packager:
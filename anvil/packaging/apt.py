@@ -15,6 +15,7 @@
 #    under the License.
 
 
+from anvil import exceptions as excp
 from anvil import log as logging
 from anvil import packager as pack
 from anvil import shell as sh
@@ -28,6 +29,9 @@ APT_REMOVE = ["remove", "-y"]
 APT_INSTALL = ["install", "-y"]
 APT_AUTOREMOVE = ['autoremove', '-y']
 
+# What dpkg knows about (the status is the last 3 words of each line)
+DPKG_QUERY_INSTALLED = ['dpkg-query', '-W', '-f', '${Package} ${Version} ${Status}\\n']
+
 # Should we use remove or purge?
 APT_DO_REMOVE = APT_PURGE
 
@@ -41,6 +45,20 @@ VERSION_TEMPL = "%s=%s"
 
 class AptPackager(pack.Packager):
 
+    @classmethod
+    def list_installed(cls):
+        try:
+            (out_str, _err_str) = sh.execute(*DPKG_QUERY_INSTALLED)
+        except excp.ProcessExecutionError as e:
+            LOG.warn("Unable to determine which packages are already installed: %s", e)
+            return []
+        installed = list()
+        for line in out_str.splitlines():
+            pieces = line.split()
+            if len(pieces) == 5 and pieces[-1] == 'installed':
+                installed.append((pieces[0], pieces[1]))
+        return installed
+
     def _format_pkg_name(self, name, version):
         if version:
             return VERSION_TEMPL % (name, version)
@@ -67,3 +85,16 @@ class AptPackager(pack.Packager):
         pkg_full = self._format_pkg_name(name, pkg.get("version"))
         cmd = APT_INSTALL + [pkg_full]
         self._execute_apt(cmd)
+
+    def _install_batch(self, pkgs):
+        pkg_fulls = [self._format_pkg_name(p['name'], p.get("version")) for p in pkgs]
+        cmd = APT_INSTALL + pkg_fulls
+        self._execute_apt(cmd)
+        return True
+
+    def _remove_batch(self, pkgs):
+        pkg_fulls = [self._format_pkg_name(p['name'], p.get("version")) for p in pkgs]
+        cmd = APT_DO_REMOVE + pkg_fulls
+        self._execute_apt(cmd)
+        self._execute_apt(APT_AUTOREMOVE)
+        return True
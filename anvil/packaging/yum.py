@@ -17,6 +17,7 @@
 import os
 
 from anvil import downloader
+from anvil import exceptions as excp
 from anvil import log as logging
 from anvil import packager as pack
 from anvil import shell as sh
@@ -33,12 +34,29 @@ YUM_REMOVE = ['erase', '-y', "-t"]
 
 YUM_LIST_INSTALLED = ['list', 'installed', '-q']
 
+# What rpm knows is installed (one name and version-release per line)
+RPM_QUERY_INSTALLED = ['rpm', '-qa', '--queryformat', '%{NAME} %{VERSION}-%{RELEASE}\\n']
+
 # Yum separates its pkg names and versions with a dash
 VERSION_TEMPL = "%s-%s"
 
 
 class YumPackager(pack.Packager):
 
+    @classmethod
+    def list_installed(cls):
+        try:
+            (out_str, _err_str) = sh.execute(*RPM_QUERY_INSTALLED)
+        except excp.ProcessExecutionError as e:
+            LOG.warn("Unable to determine which rpms are already installed: %s", e)
+            return []
+        installed = list()
+        for line in out_str.splitlines():
+            pieces = line.split()
+            if len(pieces) == 2:
+                installed.append((pieces[0], pieces[1]))
+        return installed
+
     def _format_pkg_name(self, name, version):
         if version:
             return VERSION_TEMPL % (name, version)
@@ -110,29 +128,31 @@ class YumPackager(pack.Packager):
         self._execute_yum(cmd)
         return True
 
+    def _execute_all(self, pkgs, cmd, src_rpm_functor, special_functor):
+        # Source rpms and special packages are dealt with one at a time and
+        # the rest of the packages with one yum run
+        pkg_fulls = list()
+        for pkg in pkgs:
+            source_rpm = pkg.get("source-rpm")
+            if source_rpm:
+                src_rpm_functor(source_rpm)
+            name = pkg['name']
+            if not special_functor(name, pkg):
+                pkg_fulls.append(self._format_pkg_name(name, pkg.get("version")))
+        if pkg_fulls:
+            self._execute_yum(cmd + pkg_fulls)
+
     def _install(self, pkg):
-        name = pkg['name']
-
-        source_rpm = pkg.get("source-rpm")
-        if source_rpm:
-            self._install_src_rpm(source_rpm)
-            
-        if self._install_special(name, pkg):
-            return
-        else:
-            pkg_full = self._format_pkg_name(name, pkg.get("version"))
-            cmd = YUM_INSTALL + [pkg_full]
-            self._execute_yum(cmd)
+        self._execute_all([pkg], YUM_INSTALL, self._install_src_rpm, self._install_special)
+
+    def _install_batch(self, pkgs):
+        self._execute_all(pkgs, YUM_INSTALL, self._install_src_rpm, self._install_special)
+        return True
+
+    def _remove_batch(self, pkgs):
+        self._execute_all(pkgs, YUM_REMOVE, self._remove_src_rpm, self._remove_special)
+        return True
 
     def _remove(self, pkg):
-        source_rpm = pkg.get("source-rpm")
-        if source_rpm:
-            self._remove_src_rpm(source_rpm)
-            
-        name = pkg['name']
-        if self._remove_special(name, pkg):
-            return True
-        pkg_full = self._format_pkg_name(name, pkg.get("version"))
-        cmd = YUM_REMOVE + [pkg_full]
-        self._execute_yum(cmd)
+        self._execute_all([pkg], YUM_REMOVE, self._remove_src_rpm, self._remove_special)
         return True
@@ -20,6 +20,7 @@ from anvil import shell as sh
 from anvil import utils
 
 import json
+import threading
 
 from contextlib import contextmanager
 
@@ -29,6 +30,7 @@ LOG = logging.getLogger(__name__)
 class PhaseRecorder(object):
     def __init__(self, fn):
         self.fn = fn
+        self.lock = threading.Lock()
 
     @contextmanager
     def mark(self, phasename):
@@ -38,7 +40,8 @@ class PhaseRecorder(object):
         yield phasename
         LOG.debug("Marking the completion of phase %r in file %r", phasename, self.fn)
         lines = [json.dumps(contents), '']
-        sh.append_file(self.fn, utils.joinlinesep(*lines))
+        with self.lock:
+            sh.append_file(self.fn, utils.joinlinesep(*lines))
 
     def has_ran(self, phasename):
         phases = self.list_phases()
@@ -14,31 +14,197 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import distutils.util
+import re
+import sys
+import threading
 
+from anvil import exceptions as excp
 from anvil import log as logging
 from anvil import shell as sh
 from anvil import packager as pack
+from anvil import utils
 
 LOG = logging.getLogger(__name__)
 
 PIP_UNINSTALL_CMD_OPTS = ['-y', '-q']
 PIP_INSTALL_CMD_OPTS = ['-q']
+PIP_WHEEL_CMD_OPTS = ['-q']
+
+# Wheel file names are name-version(-build)-python-abi-platform.whl
+WHEEL_MATCHER = re.compile(r"^(?P<name>[^-]+)-(?P<version>[^-]+)(-\d[^-]*)?-"
+                           r"(?P<python>[^-]+)-(?P<abi>[^-]+)-(?P<platform>[^-]+)\.whl$")
+
+# The wheelhouse pips get installed from (if any)
+WHEELHOUSE = None
+
+
+def set_wheelhouse(wheelhouse):
+    global WHEELHOUSE
+    WHEELHOUSE = wheelhouse
+
+
+def get_wheelhouse():
+    return WHEELHOUSE
+
+
+def make_requirement(name, version):
+    if version is None:
+        return "%s" % (name)
+    return "%s==%s" % (name, version)
+
+
+def _normalize_name(name):
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+
+def get_tags():
+    """
+    Returns the (python, abi, platform) tags of the wheels that are built by
+    (and can be installed into) this interpreter.
+    """
+    python = "cp%s%s" % (sys.version_info[0], sys.version_info[1])
+    abi = python + "m"
+    if sys.maxunicode > 0xffff:
+        abi += "u"
+    platform = distutils.util.get_platform().replace("-", "_").replace(".", "_")
+    return (python, abi, platform)
+
+
+class Wheelhouse(object):
+    """
+    A directory of wheels that pips get built into (once) and are then
+    installed from (without going to the index again). What a wheel is
+    for (name, version and interpreter abi) is kept in its file name.
+    """
+
+    def __init__(self, pip_cmd, wheel_dir):
+        self.pip_cmd = pip_cmd
+        self.wheel_dir = wheel_dir
+        self.tags = get_tags()
+        self._lock = threading.Lock()
+
+    def _usable(self, mtch):
+        (python, abi, platform) = self.tags
+        pythons = mtch.group('python').split(".")
+        if python not in pythons and not [p for p in pythons if python.startswith(p.replace("py", "cp"))]:
+            return False
+        if mtch.group('abi') not in (abi, 'none'):
+            return False
+        return mtch.group('platform') in (platform, 'any')
+
+    def _built(self):
+        # Returns the versions (by name) that there are usable wheels for
+        built = dict()
+        if not sh.isdir(self.wheel_dir):
+            return built
+        for fn in sh.listdir(self.wheel_dir):
+            mtch = WHEEL_MATCHER.match(fn)
+            if mtch and self._usable(mtch):
+                built.setdefault(_normalize_name(mtch.group('name')), list()).append(mtch.group('version'))
+        return built
+
+    def _has(self, pip, built):
+        versions = built.get(_normalize_name(pip['name']))
+        if not versions:
+            return False
+        if pip.get('version') is None:
+            return True
+        return len([v for v in versions if pack.same_version(v, pip['version'])]) > 0
+
+    def _rounds(self, pips):
+        # A single pip run can only be asked for one version of each pip
+        rounds = list()
+        for p in pips:
+            for r in rounds:
+                if not [q for q in r if q['name'] == p['name']]:
+                    r.append(p)
+                    break
+            else:
+                rounds.append([p])
+        return rounds
+
+    def _build(self, pips):
+        with utils.tempdir() as tdir:
+            req_fn = sh.joinpths(tdir, 'requirements.txt')
+            req_lines = [make_requirement(p['name'], p.get('version')) for p in pips]
+            sh.write_file(req_fn, "\n".join(req_lines) + "\n", quiet=True)
+            cmd = [self.pip_cmd, 'wheel'] + PIP_WHEEL_CMD_OPTS
+            cmd += ['--wheel-dir', self.wheel_dir, '--find-links', self.wheel_dir, '-r', req_fn]
+            sh.execute(*cmd)
+
+    def build(self, pips):
+        """
+        Builds wheels for the pips that there are no wheels for yet, returning
+        whether there are wheels for all of them now.
+        """
+        with self._lock:
+            built = self._built()
+            missing = list()
+            for p in pips:
+                if not self._has(p, built) and p not in missing:
+                    missing.append(p)
+            if not missing:
+                return True
+            sh.mkdirslist(self.wheel_dir)
+            utils.log_iterable([make_requirement(p['name'], p.get('version')) for p in missing], logger=LOG,
+                header="Building %s wheels into %s" % (len(missing), self.wheel_dir))
+            try:
+                for r in self._rounds(missing):
+                    self._build(r)
+            except excp.ProcessExecutionError as e:
+                LOG.warn("Building wheels failed (the index will be used for what was not built): %s", e)
+            built = self._built()
+            return len([p for p in pips if not self._has(p, built)]) == 0
+
+    def get_install_options(self, pips):
+        """
+        Returns the pip options that install the given pips from the
+        wheelhouse (and only from it when all of them have been built).
+        """
+        if sh.DRYRUN_MODE:
+            return []
+        if self.build(pips):
+            return ['--no-index', '--find-links', self.wheel_dir]
+        return ['--find-links', self.wheel_dir]
 
 
 class Packager(pack.Packager):
 
     def _make_pip_name(self, name, version):
-        if version is None:
-            return "%s" % (name)
-        return "%s==%s" % (name, version)
+        return make_requirement(name, version)
 
     def _get_pip_command(self):
         return self.distro.get_command_config('pip')
 
+    def _get_wheel_options(self, pips):
+        if WHEELHOUSE is None:
+            return []
+        return WHEELHOUSE.get_install_options(pips)
+
+    def _install_batch(self, pips):
+        # Pips that need their own options get installed on their own, the
+        # others all go into one requirements file so that a single pip run
+        # resolves (and fetches) them together
+        plain = [p for p in pips if not p.get('options')]
+        if plain:
+            with utils.tempdir() as tdir:
+                req_fn = sh.joinpths(tdir, 'requirements.txt')
+                req_lines = [self._make_pip_name(p['name'], p.get('version')) for p in plain]
+                sh.write_file(req_fn, "\n".join(req_lines) + "\n", quiet=True)
+                real_cmd = [self._get_pip_command()] + ['install'] + PIP_INSTALL_CMD_OPTS
+                real_cmd += self._get_wheel_options(plain) + ['-r', req_fn]
+                LOG.audit("Installing %s python packages using pip command %s" % (len(req_lines), real_cmd))
+                sh.execute(*real_cmd, run_as_root=True)
+        for p in pips:
+            if p.get('options'):
+                self._install(p)
+        return True
+
     def _install(self, pip):
         root_cmd = self._get_pip_command()
         name_full = self._make_pip_name(pip['name'], pip.get('version'))
-        real_cmd = [root_cmd] + ['install'] + PIP_INSTALL_CMD_OPTS
+        real_cmd = [root_cmd] + ['install'] + PIP_INSTALL_CMD_OPTS + self._get_wheel_options([pip])
         options = pip.get('options')
         if options:
             if not isinstance(options, (list, tuple)):
@@ -0,0 +1,180 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (C) 2012 Yahoo! Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import Queue
+import sys
+import threading
+
+from anvil import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# How often blocked waiters wake up (so that they can still be interrupted)
+WAIT_POLL = 0.1
+
+
+class Future(object):
+    """
+    The (eventual) result of a callable submitted to a worker pool.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = list()
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        return self._done.isSet()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = list()
+        for functor in callbacks:
+            functor(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def add_done_callback(self, functor):
+        with self._lock:
+            if not self._done.isSet():
+                self._callbacks.append(functor)
+                return
+        functor(self)
+
+    def wait(self, timeout=None):
+        while not self._done.isSet():
+            if timeout is not None:
+                self._done.wait(timeout)
+                break
+            self._done.wait(WAIT_POLL)
+        return self._done.isSet()
+
+    def exception(self):
+        self.wait()
+        if self._exc_info:
+            return self._exc_info[1]
+        return None
+
+    def result(self, timeout=None):
+        if not self.wait(timeout):
+            raise RuntimeError("Result not ready after waiting %s seconds" % (timeout))
+        if self._exc_info:
+            (exc_type, exc_value, exc_tb) = self._exc_info
+            raise exc_type, exc_value, exc_tb
+        return self._result
+
+
+class WorkerPool(object):
+    """
+    A simple bounded pool of daemon threads that run submitted callables.
+
+    Threads are only created as work arrives (up to the max number of workers).
+    """
+
+    def __init__(self, max_workers, name='worker'):
+        self.max_workers = max(1, int(max_workers))
+        self.name = name
+        self._work = Queue.Queue()
+        self._threads = list()
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def _run(self):
+        while True:
+            item = self._work.get()
+            if item is None:
+                break
+            (future, functor, args, kwargs) = item
+            try:
+                future.set_result(functor(*args, **kwargs))
+            except BaseException:
+                # Even exits (and interrupts) are handed to the waiters (so
+                # that they are not left waiting forever)
+                future.set_exception(sys.exc_info())
+
+    def _maybe_spawn(self):
+        if len(self._threads) >= self.max_workers:
+            return
+        t_name = "%s-%s" % (self.name, len(self._threads) + 1)
+        thread = threading.Thread(target=self._run, name=t_name)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+        LOG.debug("Started worker thread %r", t_name)
+
+    def submit(self, functor, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Can not submit work to a shutdown pool")
+            self._maybe_spawn()
+            self._work.put((future, functor, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            for _i in range(len(self._threads)):
+                self._work.put(None)
+        if wait:
+            for thread in self._threads:
+                # Joined a bit at a time (so that the wait can be interrupted)
+                while thread.isAlive():
+                    thread.join(WAIT_POLL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.shutdown(wait=True)
+
+
+class Waiter(object):
+    """
+    Collects futures as they complete (in completion order).
+    """
+
+    def __init__(self):
+        self._finished = Queue.Queue()
+        self.pending = 0
+
+    def watch(self, future):
+        self.pending += 1
+        future.add_done_callback(self._finished.put)
+        return future
+
+    def next_done(self):
+        if self.pending <= 0:
+            raise RuntimeError("No futures are being waited on")
+        while True:
+            try:
+                future = self._finished.get(True, WAIT_POLL)
+                self.pending -= 1
+                return future
+            except Queue.Empty:
+                pass
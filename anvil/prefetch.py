@@ -0,0 +1,82 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (C) 2012 Yahoo! Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+from anvil import colorizer
+from anvil import downloader as down
+from anvil import log as logging
+from anvil import pool
+from anvil import shell as sh
+from anvil import utils
+
+LOG = logging.getLogger(__name__)
+
+
+def _fetch_url(url):
+    # This only warms up the download cache, whoever needs the url later
+    # gets it from there (or waits on this if it is still being fetched),
+    # what it makes is made as the user even while other threads are rooted
+    with utils.tempdir() as tdir:
+        fn = sh.joinpths(tdir, sh.basename(url) or 'download')
+        (_fn, bytes_down) = down.UrlLibDownloader(url, fn).download()
+        return bytes_down
+
+
+class Prefetcher(object):
+    """
+    Fetches (in the background) what the later phases of an action will
+    need, each piece of work is known by a key that those phases use to
+    get at (and wait on) its result.
+    """
+
+    def __init__(self, max_workers):
+        self._workers = pool.WorkerPool(max_workers, name='prefetch')
+        self._futures = dict()
+        self._lock = threading.Lock()
+
+    def submit(self, key, functor, *args, **kwargs):
+        with self._lock:
+            if key not in self._futures:
+                LOG.debug("Prefetching %s", key)
+                self._futures[key] = self._workers.submit(functor, *args, **kwargs)
+            return self._futures[key]
+
+    def submit_url(self, url):
+        if not down.get_cache():
+            # Nowhere to keep it until it gets used...
+            LOG.debug("Not prefetching %s since url downloads are not being cached.", url)
+            return None
+        return self.submit(('url', url), _fetch_url, url)
+
+    def take(self, key):
+        """
+        Returns the future of what was prefetched for the key (or none if
+        nothing was), which is then no longer tracked by the prefetcher.
+        """
+        with self._lock:
+            return self._futures.pop(key, None)
+
+    def shutdown(self):
+        self._workers.shutdown(wait=True)
+        with self._lock:
+            futures = self._futures
+            self._futures = dict()
+        for (key, fut) in futures.items():
+            # Whoever needed this will have tried again (and failed if it
+            # really could not be fetched)
+            if fut.exception():
+                LOG.warn("Prefetching %s failed: %s", colorizer.quote(key[-1]), fut.exception())
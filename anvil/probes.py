@@ -0,0 +1,197 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (C) 2012 Yahoo! Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import httplib
+import shlex
+import socket
+import time
+import urllib2
+
+from anvil import cfg
+from anvil import colorizer
+from anvil import exceptions as excp
+from anvil import log as logging
+from anvil import shell as sh
+
+from anvil.helpers import glance as ghelper
+from anvil.helpers import keystone as khelper
+from anvil.helpers import quantum as qhelper
+
+LOG = logging.getLogger(__name__)
+
+# Seconds between checks of a probe that is not passing yet (this doubles
+# after each check, up to the max)
+INITIAL_DELAY = 0.25
+MAX_DELAY = 5.0
+
+# Seconds a single check of a probe may take
+CHECK_TIMEOUT = 5.0
+
+# Services whose endpoints http probes can refer to
+ENDPOINT_LOOKUPS = {
+    'glance': ghelper.get_shared_params,
+    'keystone': khelper.get_shared_params,
+    'quantum': qhelper.get_shared_params,
+}
+
+
+class Probe(object):
+    def __init__(self, timeout):
+        # How long (in seconds) this probe may take to pass
+        self.timeout = timeout
+
+    def check(self):
+        raise NotImplementedError()
+
+
+class TcpProbe(Probe):
+    def __init__(self, timeout, host, port):
+        Probe.__init__(self, timeout)
+        self.host = host
+        self.port = int(port)
+
+    def check(self):
+        try:
+            sock = socket.create_connection((self.host, self.port), CHECK_TIMEOUT)
+            sock.close()
+            return True
+        except (socket.error, socket.timeout):
+            return False
+
+    def __str__(self):
+        return "tcp %s:%s" % (self.host, self.port)
+
+
+class HttpProbe(Probe):
+    def __init__(self, timeout, url):
+        Probe.__init__(self, timeout)
+        self.url = url
+
+    def check(self):
+        try:
+            urllib2.urlopen(self.url, timeout=CHECK_TIMEOUT).close()
+            return True
+        except urllib2.HTTPError as e:
+            # Something is answering (even if it doesn't like the request)
+            return e.code < 500
+        except (urllib2.URLError, httplib.HTTPException, socket.error, socket.timeout):
+            return False
+
+    def __str__(self):
+        return "http %s" % (self.url)
+
+
+class PidProbe(Probe):
+    def __init__(self, timeout, pid_file):
+        Probe.__init__(self, timeout)
+        self.pid_file = pid_file
+
+    def check(self):
+        if not sh.isfile(self.pid_file):
+            return False
+        try:
+            pid = int(sh.load_file(self.pid_file).strip())
+        except (ValueError, IOError):
+            return False
+        return sh.is_running(pid)
+
+    def __str__(self):
+        return "pid %s" % (self.pid_file)
+
+
+class CommandProbe(Probe):
+    def __init__(self, timeout, cmd, run_as_root=False):
+        Probe.__init__(self, timeout)
+        self.cmd = shlex.split(cmd)
+        self.run_as_root = run_as_root
+
+    def check(self):
+        try:
+            sh.execute(*self.cmd, run_as_root=self.run_as_root, check_exit_code=True)
+            return True
+        except excp.ProcessExecutionError:
+            return False
+
+    def __str__(self):
+        return "command %s" % (" ".join(self.cmd))
+
+
+def _resolve(config, value):
+    # Allow values to reference the configuration like $(section:option) does
+    if isinstance(value, basestring):
+        return cfg.SUB_MATCH.sub(lambda m: config.getdefaulted(m.group(1), m.group(2), ''), value)
+    return value
+
+
+def _endpoint_url(config, service, endpoint):
+    if service not in ENDPOINT_LOOKUPS:
+        raise excp.ConfigException("Unknown service %r for a http probe" % (service))
+    endpoints = ENDPOINT_LOOKUPS[service](config)['endpoints']
+    if endpoint not in endpoints:
+        raise excp.ConfigException("Unknown %s endpoint %r for a http probe" % (service, endpoint))
+    return endpoints[endpoint]['uri']
+
+
+def from_spec(config, spec, default_timeout):
+    """
+    Creates a probe from a (distro yaml) specification of it, for example:
+
+        type: tcp
+        host: $(db:sql_host)
+        port: $(db:port)
+    """
+    spec = dict((k, _resolve(config, v)) for (k, v) in spec.items())
+    kind = spec.get('type')
+    timeout = float(spec.get('timeout') or default_timeout)
+    if kind == 'tcp':
+        return TcpProbe(timeout, spec.get('host') or config.get('host', 'ip'), spec['port'])
+    elif kind == 'http':
+        url = spec.get('url')
+        if not url:
+            url = _endpoint_url(config, spec['service'], spec.get('endpoint', 'admin'))
+        return HttpProbe(timeout, url)
+    elif kind == 'pid':
+        return PidProbe(timeout, spec['pid_file'])
+    elif kind == 'command':
+        return CommandProbe(timeout, spec['cmd'], run_as_root=spec.get('run_as_root', False))
+    raise excp.ConfigException("Unknown probe type %r in %s" % (kind, spec))
+
+
+def wait_for(probes, what):
+    """
+    Checks the probes until they have all passed (checking less often the
+    longer that takes), raising a StartException if any of them has not
+    passed within its timeout. Returns how many seconds that took.
+    """
+    started_at = time.time()
+    if sh.DRYRUN_MODE:
+        LOG.audit("Not really waiting for %s to be ready", what)
+        return 0
+    pending = list(probes)
+    delay = INITIAL_DELAY
+    while True:
+        pending = [p for p in pending if not p.check()]
+        waited = time.time() - started_at
+        if not pending:
+            LOG.info("%s was ready after %.2f seconds.", colorizer.quote(what), waited)
+            return waited
+        expired = [p for p in pending if waited >= p.timeout]
+        if expired:
+            msg = "%s was not ready after %.2f seconds (waiting on %s)" % (what, waited, ", ".join([str(p) for p in expired]))
+            raise excp.StartException(msg)
+        LOG.debug("Waiting on %s for %s", ", ".join([str(p) for p in pending]), what)
+        time.sleep(min(delay, min([p.timeout for p in pending]) - waited))
+        delay = min(delay * 2, MAX_DELAY)
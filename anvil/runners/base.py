@@ -15,14 +15,35 @@
 #    under the License.
 
 import abc
+import threading
 import weakref
 
 from anvil import constants
 
 
+class Snapshot(object):
+    """
+    What runners looked at to find out what is running, this is gathered once
+    (per key) and then shared by all of the apps whose status is checked.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._taken = dict()
+
+    def get(self, key, functor):
+        with self._lock:
+            if key not in self._taken:
+                self._taken[key] = functor()
+            return self._taken[key]
+
+
 class Runner(object):
     __meta__ = abc.ABCMeta
 
+    # Whether apps can be started at the same time (by different threads)
+    parallel_start = False
+
     def __init__(self, runtime):
         self.runtime = weakref.proxy(runtime)
 
@@ -44,6 +65,20 @@ class Runner(object):
         # Stops the given app
         pass
 
+    def stop_all(self, app_names):
+        # Stops all the given apps (runners that can should stop them
+        # together instead of one after the other)
+        for app_name in app_names:
+            self.stop(app_name)
+
     def status(self, app_name):
         # Attempt to give the status of a app
         return constants.STATUS_UNKNOWN
+
+    def status_all(self, app_names, snapshot=None):
+        # Gives the status of all the given apps (runners that can should look
+        # up what is running once, sharing that using the snapshot)
+        statuses = dict()
+        for app_name in app_names:
+            statuses[app_name] = self.status(app_name)
+        return statuses
@@ -37,37 +37,56 @@ FORK_TEMPL = "%s.fork"
 
 
 class ForkRunner(base.Runner):
+    parallel_start = True
+
     def __init__(self, runtime):
         base.Runner.__init__(self, runtime)
 
     def stop(self, app_name):
+        self.stop_all([app_name])
+
+    def _get_grace(self):
+        return float(self.runtime.cfg.getdefaulted('DEFAULT', 'stop_grace_seconds', sh.STOP_GRACE))
+
+    def _clean(self, app_name):
+        trace_dir = self.runtime.get_option('trace_dir')
+        fn_name = FORK_TEMPL % (app_name)
+        (pid_file, stderr_fn, stdout_fn) = self._form_file_names(fn_name)
+        LOG.debug("Removing pid file %s" % (pid_file))
+        sh.unlink(pid_file)
+        LOG.debug("Removing stderr file %r" % (stderr_fn))
+        sh.unlink(stderr_fn)
+        LOG.debug("Removing stdout file %r" % (stdout_fn))
+        sh.unlink(stdout_fn)
+        trace_fn = tr.trace_fn(trace_dir, fn_name)
+        if sh.isfile(trace_fn):
+            LOG.debug("Removing %r trace file %r" % (app_name, trace_fn))
+            sh.unlink(trace_fn)
+
+    def stop_all(self, app_names):
         trace_dir = self.runtime.get_option('trace_dir')
         if not sh.isdir(trace_dir):
-            msg = "No trace directory found from which to stop: %s" % (app_name)
+            msg = "No trace directory found from which to stop: %s" % (", ".join(app_names))
             raise excp.StopException(msg)
         with sh.Rooted(True):
-            fn_name = FORK_TEMPL % (app_name)
-            (pid_file, stderr_fn, stdout_fn) = self._form_file_names(fn_name)
-            pid = self._extract_pid(pid_file)
-            if not pid:
-                msg = "Could not extract a valid pid from %s" % (pid_file)
-                raise excp.StopException(msg)
-            (killed, attempts) = sh.kill(pid)
-            # Trash the files if it worked
-            if killed:
-                LOG.debug("Killed pid %s after %s attempts." % (pid, attempts))
-                LOG.debug("Removing pid file %s" % (pid_file))
-                sh.unlink(pid_file)
-                LOG.debug("Removing stderr file %r" % (stderr_fn))
-                sh.unlink(stderr_fn)
-                LOG.debug("Removing stdout file %r" % (stdout_fn))
-                sh.unlink(stdout_fn)
-                trace_fn = tr.trace_fn(trace_dir, fn_name)
-                if sh.isfile(trace_fn):
-                    LOG.debug("Removing %r trace file %r" % (app_name, trace_fn))
-                    sh.unlink(trace_fn)
-            else:
-                msg = "Could not stop %r after %s attempts" % (app_name, attempts)
+            pids = dict()
+            for app_name in app_names:
+                (pid_file, _stderr_fn, _stdout_fn) = self._form_file_names(FORK_TEMPL % (app_name))
+                pid = self._extract_pid(pid_file)
+                if not pid:
+                    msg = "Could not extract a valid pid from %s" % (pid_file)
+                    raise excp.StopException(msg)
+                pids[app_name] = pid
+            # Stop them all at once (and then wait on them together)
+            alive = sh.kill_all(pids.values(), self._get_grace())
+            for (app_name, pid) in pids.items():
+                if pid not in alive:
+                    LOG.debug("Stopped %r (pid %s)." % (app_name, pid))
+                    # Trash the files since it worked
+                    self._clean(app_name)
+            if alive:
+                stuck = [app_name for (app_name, pid) in pids.items() if pid in alive]
+                msg = "Could not stop %s" % (", ".join(stuck))
                 raise excp.StopException(msg)
 
     def _extract_pid(self, filename):
@@ -80,15 +99,24 @@ class ForkRunner(base.Runner):
             return None
 
     def status(self, app_name):
+        return self.status_all([app_name])[app_name]
+
+    def status_all(self, app_names, snapshot=None):
+        statuses = dict()
+        for app_name in app_names:
+            statuses[app_name] = constants.STATUS_UNKNOWN
         trace_dir = self.runtime.get_option('trace_dir')
         if not sh.isdir(trace_dir):
-            return constants.STATUS_UNKNOWN
-        (pid_file, stderr_fn, stdout_fn) = self._form_file_names(FORK_TEMPL % (app_name))
-        pid = self._extract_pid(pid_file)
-        if pid and sh.is_running(pid):
-            return constants.STATUS_STARTED
-        else:
-            return constants.STATUS_UNKNOWN
+            return statuses
+        if snapshot is None:
+            snapshot = base.Snapshot()
+        running = snapshot.get('pids', sh.running_pids)
+        for app_name in app_names:
+            (pid_file, _stderr_fn, _stdout_fn) = self._form_file_names(FORK_TEMPL % (app_name))
+            pid = self._extract_pid(pid_file)
+            if pid and (sh.DRYRUN_MODE or pid in running):
+                statuses[app_name] = constants.STATUS_STARTED
+        return statuses
 
     def _form_file_names(self, file_name):
         trace_dir = self.runtime.get_option('trace_dir')
@@ -19,6 +19,7 @@ import re
 import tempfile
 import weakref
 
+from anvil import constants
 from anvil import date
 from anvil import exceptions as excp
 from anvil import log as logging
@@ -86,6 +87,24 @@ class ScreenRunner(base.Runner):
             raise excp.StopException(msg)
         return session_id
 
+    def status_all(self, app_names, snapshot=None):
+        # Screen can only tell us if the session an app was started in is
+        # still around (not if the app in its window is)
+        if snapshot is None:
+            snapshot = base.Snapshot()
+        sessions = snapshot.get('screen-sessions', self._active_sessions)
+        statuses = dict()
+        for app_name in app_names:
+            statuses[app_name] = constants.STATUS_UNKNOWN
+            trace_fn = tr.trace_fn(self.runtime.get_option('trace_dir'), SCREEN_TEMPL % (app_name))
+            try:
+                session_id = self._find_session(app_name, trace_fn)
+            except (excp.NoTraceException, excp.StopException):
+                continue
+            if session_id in sessions:
+                statuses[app_name] = constants.STATUS_STARTED
+        return statuses
+
     def _do_stop(self, app_name, session_id):
         mp = dict()
         mp['SESSION_NAME'] = session_id
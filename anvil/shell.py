@@ -14,6 +14,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import errno
 import fileinput
 import getpass
@@ -21,15 +22,17 @@ import grp
 import os
 import pwd
 import resource
+import select
 import shutil
 import signal
 import subprocess
-import sys
+import threading
 import time
 
 from anvil import env
 from anvil import exceptions as excp
 from anvil import log as logging
+from anvil import pool
 
 LOG = logging.getLogger(__name__)
 
@@ -55,6 +58,44 @@ BOOL2STR = {
     False: 'false',
 }
 
+# What running a command through an executor results in
+ExecuteResult = collections.namedtuple('ExecuteResult', ['cmd', 'stdout', 'stderr', 'elapsed'])
+
+# Seconds commands that have timed out are given to exit after being asked
+# to (after that they are killed)
+TIMEOUT_GRACE = 5
+
+# Seconds that commands (by program name) may run before being stopped
+_TIMEOUTS = dict()
+
+# The process groups of the commands (on any thread) that are running in
+# their own process group (which interrupts from the terminal don't reach)
+_GROUPS = set()
+_GROUPS_LOCK = threading.Lock()
+
+# What to close up to (when what is open can't be listed) if there is no
+# limit on open files
+MAXFD = 2048
+
+# Seconds processes are given to exit after being asked to (before they
+# are killed) when stopping them
+STOP_GRACE = 5
+
+# Seconds processes are given to go away after being killed
+KILL_WAIT = 5
+
+# Seconds between checks of whether signalled processes have exited (this
+# doubles after each check, up to the max)
+KILL_POLL_INITIAL = 0.001
+KILL_POLL_MAX = 0.1
+
+# How much is read from a running command's pipes at once
+PIPE_CHUNK = 64 * 1024
+
+# How much of the end of a command's output (that is being streamed to a
+# file) is kept around for logging and errors when only the end is wanted
+OUTPUT_TAIL = 64 * 1024
+
 
 def set_dryrun(val):
     global DRYRUN_MODE
@@ -66,6 +107,92 @@ def set_dryrun(val):
         DRYRUN_MODE = False
 
 
+def set_timeouts(timeouts):
+    global _TIMEOUTS
+    _TIMEOUTS = dict(timeouts or {})
+
+
+def get_timeout(program):
+    timeout = _TIMEOUTS.get(os.path.basename(program))
+    if timeout:
+        return float(timeout)
+    return None
+
+
+# Root mode is process wide (its a euid switch) so when multiple threads are
+# using it we track how many contexts want it and only drop back to user mode
+# when the last of them is done.
+ROOT_LOCK = threading.RLock()
+ROOT_STATE = {
+    'engaged': False,
+    'refs': 0,
+}
+
+# The modes threads can be in (files made in root mode are owned by root)
+ROOT_MODE = 'root'
+USER_MODE = 'user'
+
+
+class _ModeLock(object):
+    """
+    Lets any number of threads be in the same mode at once but never lets
+    threads be in different modes at the same time (so that files made as
+    the user on one thread are not made while another thread has switched
+    the whole process to root).
+
+    A thread that is already in a mode stays in it (whatever it asks for)
+    until it is done with all of what it asked for. Once a thread is waiting
+    for the other mode, threads that newly ask for the current mode wait
+    behind it (so that neither mode can keep the other out forever).
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._mode = None
+        self._holders = 0
+        self._waiting = {
+            ROOT_MODE: 0,
+            USER_MODE: 0,
+        }
+        self._local = threading.local()
+
+    def _must_wait(self, mode):
+        if self._mode is None:
+            return False
+        if self._mode != mode:
+            return True
+        for (other_mode, waiting) in self._waiting.items():
+            if other_mode != mode and waiting:
+                return True
+        return False
+
+    def acquire(self, mode):
+        depth = getattr(self._local, 'depth', 0)
+        if not depth:
+            with self._cond:
+                self._waiting[mode] += 1
+                try:
+                    while self._must_wait(mode):
+                        self._cond.wait()
+                finally:
+                    self._waiting[mode] -= 1
+                self._mode = mode
+                self._holders += 1
+        self._local.depth = depth + 1
+
+    def release(self):
+        self._local.depth -= 1
+        if not self._local.depth:
+            with self._cond:
+                self._holders -= 1
+                if not self._holders:
+                    self._mode = None
+                    self._cond.notify_all()
+
+
+MODE_LOCK = _ModeLock()
+
+
 #root context guard
 class Rooted(object):
     def __init__(self, run_as_root):
@@ -73,26 +200,235 @@ class Rooted(object):
         self.engaged = False
 
     def __enter__(self):
-        if self.root_mode and not got_root():
-            LOG.debug("Engaging root mode")
-            root_mode()
-            self.engaged = True
+        if self.root_mode:
+            MODE_LOCK.acquire(ROOT_MODE)
+            try:
+                with ROOT_LOCK:
+                    if ROOT_STATE['refs'] == 0 and not got_root():
+                        LOG.debug("Engaging root mode")
+                        root_mode()
+                        ROOT_STATE['engaged'] = True
+                    ROOT_STATE['refs'] += 1
+                    self.engaged = True
+            except:
+                MODE_LOCK.release()
+                raise
         return self.engaged
 
     def __exit__(self, type, value, traceback):
         if self.root_mode and self.engaged:
-            user_mode()
-            LOG.debug("Disengaging root mode")
-            self.engaged = False
+            try:
+                with ROOT_LOCK:
+                    ROOT_STATE['refs'] -= 1
+                    if ROOT_STATE['refs'] == 0 and ROOT_STATE['engaged']:
+                        user_mode()
+                        LOG.debug("Disengaging root mode")
+                        ROOT_STATE['engaged'] = False
+            finally:
+                self.engaged = False
+                MODE_LOCK.release()
+
+
+#user context guard (for making files that the user should own)
+class Unrooted(object):
+    def __enter__(self):
+        MODE_LOCK.acquire(USER_MODE)
+
+    def __exit__(self, type, value, traceback):
+        MODE_LOCK.release()
+
+
+class _Capture(object):
+    """
+    Gathers all of what a command outputs.
+    """
+
+    def __init__(self):
+        self.chunks = list()
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def close(self):
+        pass
+
+    def getvalue(self):
+        return "".join(self.chunks)
+
+
+class _FileCapture(object):
+    """
+    Writes what a command outputs to a file as it arrives (so that it can
+    be followed while the command runs) keeping all of it (or when given a
+    limit only the end of it) around.
+    """
+
+    def __init__(self, fn, limit=None):
+        # Opened in root mode (which commands running as root already have,
+        # waiting for them to finish to get into user mode would make them
+        # run one at a time) and then given to the user
+        with Rooted(True):
+            self.fh = open(fn, 'wb', 0)
+            (user_uid, user_gid) = get_suids()
+            if got_root() and user_uid is not None and user_gid is not None:
+                os.chown(fn, user_uid, user_gid)
+        self.limit = limit
+        self.chunks = collections.deque()
+        self.size = 0
+
+    def write(self, data):
+        self.fh.write(data)
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.limit and self.chunks and self.size - len(self.chunks[0]) >= self.limit:
+            self.size -= len(self.chunks.popleft())
+
+    def close(self):
+        self.fh.close()
+
+    def getvalue(self):
+        value = "".join(self.chunks)
+        if self.limit:
+            value = value[-self.limit:]
+        return value
+
+
+class _Expirer(object):
+    """
+    Stops a command (and whatever else is in its process group) that runs
+    for too long, asking it to exit before killing it.
+    """
+
+    def __init__(self, pid, timeout, grace=None):
+        self.pid = pid
+        self.timeout = timeout
+        self.grace = grace
+        if self.grace is None:
+            self.grace = TIMEOUT_GRACE
+        self.expired = False
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="expirer-%s" % (pid))
+        self._thread.daemon = True
+
+    def _signal(self, sig):
+        try:
+            os.killpg(self.pid, sig)
+        except OSError:
+            pass
+
+    def _run(self):
+        self._done.wait(self.timeout)
+        if self._done.isSet():
+            return
+        self.expired = True
+        LOG.warn("Command with pid %s did not finish within %s seconds, stopping it.", self.pid, self.timeout)
+        self._signal(signal.SIGTERM)
+        self._done.wait(self.grace)
+        if not self._done.isSet():
+            self._signal(signal.SIGKILL)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+
+
+def _interrupt_groups():
+    with _GROUPS_LOCK:
+        groups = list(_GROUPS)
+    for pgid in groups:
+        try:
+            os.killpg(pgid, signal.SIGINT)
+        except OSError:
+            pass
+
+
+def _on_interrupt(signum, frame):
+    _interrupt_groups()
+    raise KeyboardInterrupt()
+
+
+def handle_interrupts():
+    """
+    Makes interrupting this process also interrupt the commands that are
+    running in their own process group (on whichever thread runs them), must
+    be called from the main thread.
+    """
+    signal.signal(signal.SIGINT, _on_interrupt)
+
+
+def _stream(obj, process_input, captures):
+    """
+    Like communicate() but hands what the process outputs to the captures
+    as it arrives instead of buffering all of it until the process exits.
+    """
+    poller = select.poll()
+    readers = dict()
+    for (fh, capture) in zip([obj.stdout, obj.stderr], captures):
+        if fh:
+            readers[fh.fileno()] = (fh, capture)
+            poller.register(fh, select.POLLIN | select.POLLPRI)
+    stdin_fd = None
+    pending = ''
+    if obj.stdin:
+        if process_input:
+            stdin_fd = obj.stdin.fileno()
+            pending = str(process_input)
+            poller.register(obj.stdin, select.POLLOUT)
+        else:
+            obj.stdin.close()
+    while readers or stdin_fd is not None:
+        try:
+            events = poller.poll()
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for (fd, event) in events:
+            if fd == stdin_fd:
+                # Only this much is sure to be writable without blocking
+                try:
+                    pending = pending[os.write(fd, pending[0:select.PIPE_BUF]):]
+                except OSError as e:
+                    if e.errno != errno.EPIPE:
+                        raise
+                    pending = ''
+                if not pending or event & (select.POLLERR | select.POLLHUP):
+                    poller.unregister(fd)
+                    obj.stdin.close()
+                    stdin_fd = None
+            elif fd in readers:
+                (fh, capture) = readers[fd]
+                data = os.read(fd, PIPE_CHUNK)
+                if data:
+                    capture.write(data)
+                else:
+                    poller.unregister(fd)
+                    fh.close()
+                    del readers[fd]
+    obj.wait()
+    return tuple([c.getvalue() for c in captures])
 
 
 def execute(*cmd, **kwargs):
+    """
+    Runs the command returning what it output (to stdout and stderr).
+
+    When given a stdout_fn (or stderr_fn) that output is also written to that
+    file as it arrives, callers that only need the file can pass output_tail
+    to have only the last OUTPUT_TAIL bytes of it returned (so that large
+    outputs don't pile up in memory).
+    """
     process_input = kwargs.pop('process_input', None)
     check_exit_code = kwargs.pop('check_exit_code', [0])
     cwd = kwargs.pop('cwd', None)
     env_overrides = kwargs.pop('env_overrides', None)
     close_stdin = kwargs.pop('close_stdin', False)
     ignore_exit_code = kwargs.pop('ignore_exit_code', False)
+    timeout = kwargs.pop('timeout', None)
+    output_tail = kwargs.pop('output_tail', False)
 
     if isinstance(check_exit_code, bool):
         ignore_exit_code = not check_exit_code
@@ -114,6 +450,10 @@ def execute(*cmd, **kwargs):
     if shell:
         execute_cmd = str_cmd.strip()
 
+    # Use the default for the program being ran (if there is one)
+    if timeout is None and str_cmd.strip():
+        timeout = get_timeout(str_cmd.split()[0])
+
     if not shell:
         LOG.audit('Running cmd: %r' % (execute_cmd))
     else:
@@ -171,8 +511,44 @@ def execute(*cmd, **kwargs):
     else:
         LOG.audit("Running as (user=%s, group=%s)", ROOT_USER_UID, ROOT_USER_UID)
 
+    def grouper_functor(functor):
+        def doit():
+            # In its own process group so that it (and whatever it starts)
+            # can be stopped together if it takes too long
+            os.setpgid(0, 0)
+            if functor:
+                functor()
+        return doit
+
+    preexec = demoter
+    if timeout:
+        LOG.audit("With a timeout of %s seconds", timeout)
+        preexec = grouper_functor(demoter)
+
+    # Output that goes to files is streamed there while the command runs
+    # (instead of being gathered up until it finishes) so that it can be
+    # followed
+    trace_writer = kwargs.get('trace_writer')
+    stdout_fn = kwargs.get('stdout_fn')
+    stderr_fn = kwargs.get('stderr_fn')
+    captures = None
+    if (stdout_fn or stderr_fn) and not DRYRUN_MODE:
+        captures = list()
+        for fn in [stdout_fn, stderr_fn]:
+            if fn:
+                LOG.audit("Streaming output to file %r", fn)
+                limit = None
+                if output_tail:
+                    limit = OUTPUT_TAIL
+                captures.append(_FileCapture(fn, limit))
+                if trace_writer:
+                    trace_writer.file_touched(fn)
+            else:
+                captures.append(_Capture())
+
     rc = None
     result = None
+    expirer = None
     with Rooted(run_as_root):
         if DRYRUN_MODE:
             rc = DRY_RC
@@ -186,15 +562,38 @@ def execute(*cmd, **kwargs):
                                        close_fds=close_file_descriptors,
                                        cwd=cwd,
                                        shell=shell,
-                                       preexec_fn=demoter,
+                                       preexec_fn=preexec,
                                        env=process_env)
-                if process_input is not None:
-                    result = obj.communicate(str(process_input))
-                else:
-                    result = obj.communicate()
+                if timeout:
+                    with _GROUPS_LOCK:
+                        _GROUPS.add(obj.pid)
+                    expirer = _Expirer(obj.pid, timeout)
+                    expirer.start()
+                try:
+                    if captures:
+                        result = _stream(obj, process_input, captures)
+                    elif process_input is not None:
+                        result = obj.communicate(str(process_input))
+                    else:
+                        result = obj.communicate()
+                except KeyboardInterrupt:
+                    # Being in their own process groups the commands did not
+                    # get the interrupt, so pass it on (to them and what they
+                    # started), even to the ones other threads are running
+                    _interrupt_groups()
+                    raise
+                finally:
+                    if timeout:
+                        with _GROUPS_LOCK:
+                            _GROUPS.discard(obj.pid)
             except OSError as e:
                 raise excp.ProcessExecutionError(description="%s: [%s, %s]" % (e, e.errno, e.strerror),
                                                  cmd=str_cmd)
+            finally:
+                if expirer:
+                    expirer.stop()
+                for c in (captures or []):
+                    c.close()
             if (stdin_fh != subprocess.PIPE
                 and obj.stdin and close_stdin):
                 obj.stdin.close()
@@ -210,6 +609,10 @@ def execute(*cmd, **kwargs):
     if stderr is None:
         stderr = ''
 
+    if expirer and expirer.expired:
+        raise excp.ProcessTimeoutError(timeout, exit_code=rc, stdout=stdout,
+                                       stderr=stderr, cmd=str_cmd)
+
     if (not ignore_exit_code) and (rc not in check_exit_code):
         raise excp.ProcessExecutionError(exit_code=rc, stdout=stdout,
                                          stderr=stderr, cmd=str_cmd)
@@ -222,20 +625,69 @@ def execute(*cmd, **kwargs):
         LOG.debug("Received stdout: %s" % (stdout))
         LOG.debug("Received stderr: %s" % (stderr))
         # See if a requested storage place was given for stderr/stdout
-        trace_writer = kwargs.get('trace_writer')
-        stdout_fn = kwargs.get('stdout_fn')
-        if stdout_fn:
-            write_file(stdout_fn, stdout)
-            if trace_writer:
-                trace_writer.file_touched(stdout_fn)
-        stderr_fn = kwargs.get('stderr_fn')
-        if stderr_fn:
-            write_file(stderr_fn, stderr)
-            if trace_writer:
-                trace_writer.file_touched(stderr_fn)
+        # (and it did not already get streamed there)
+        if not captures:
+            if stdout_fn:
+                write_file(stdout_fn, stdout)
+                if trace_writer:
+                    trace_writer.file_touched(stdout_fn)
+            if stderr_fn:
+                write_file(stderr_fn, stderr)
+                if trace_writer:
+                    trace_writer.file_touched(stderr_fn)
         return (stdout, stderr)
 
 
+def _timed_execute(cmd, kwargs):
+    started_at = time.time()
+    (stdout, stderr) = execute(*cmd, **kwargs)
+    return ExecuteResult(cmd, stdout, stderr, time.time() - started_at)
+
+
+class Executor(object):
+    """
+    Runs commands (using execute and the same keyword arguments) on a
+    bounded number of threads, each submitted command gets a future for
+    its execute result (and how long it took).
+    """
+
+    def __init__(self, max_workers):
+        self._workers = pool.WorkerPool(max_workers, name='execute')
+
+    def submit(self, *cmd, **kwargs):
+        return self._workers.submit(_timed_execute, cmd, kwargs)
+
+    def shutdown(self, wait=True):
+        self._workers.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.shutdown(wait=True)
+
+
+def execute_many(cmds, max_workers=4, **kwargs):
+    """
+    Runs the commands at the same time (using at most the given number of
+    threads) returning their results in the order the commands were given.
+
+    Each command is either a list or a (list, dict) pair where the dict has
+    keyword arguments for just that command (that override the ones given
+    here for all of them). If any command fails the first failure (in that
+    order) is raised once all of them have finished.
+    """
+    futures = list()
+    with Executor(max_workers) as executor:
+        for cmd in cmds:
+            cmd_kwargs = dict(kwargs)
+            if isinstance(cmd, tuple):
+                (cmd, extra_kwargs) = cmd
+                cmd_kwargs.update(extra_kwargs)
+            futures.append(executor.submit(*cmd, **cmd_kwargs))
+    return [f.result() for f in futures]
+
+
 def abspth(path):
     if not path:
         path = ROOT_PATH
@@ -388,26 +840,100 @@ def _array_begins_with(haystack, needle):
     return True
 
 
-def kill(pid, max_try=4, wait_time=1, sig=signal.SIGKILL):
-    if not is_running(pid) or DRYRUN_MODE:
-        return (True, 0)
-    killed = False
-    attempts = 0
-    for i in range(0, max_try):
+def _is_alive(pid):
+    try:
+        # Reap it if its one of ours (so that it doesn't linger as a zombie)
+        (wpid, _status) = os.waitpid(pid, os.WNOHANG)
+        if wpid == pid:
+            return False
+    except OSError:
+        pass
+    try:
+        with open("/proc/%s/stat" % (pid), 'r') as fh:
+            # The state comes right after the (parenthesized) program name
+            return fh.read().rsplit(")", 1)[1].split()[0] != 'Z'
+    except (IOError, IndexError):
+        pass
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+
+def _signal_all(pids, sig):
+    for pid in pids:
         try:
-            LOG.debug("Attempting to kill pid %s" % (pid))
-            attempts += 1
             os.kill(pid, sig)
-            LOG.debug("Sleeping for %s seconds before next attempt to kill pid %s" % (wait_time, pid))
-            sleep(wait_time)
         except OSError as e:
-            if e.errno == errno.ESRCH:
-                killed = True
-                break
-            else:
-                LOG.debug("Sleeping for %s seconds before next attempt to kill pid %s" % (wait_time, pid))
-                sleep(wait_time)
-    return (killed, attempts)
+            if e.errno != errno.ESRCH:
+                raise
+
+
+def _wait_all(pids, timeout):
+    # Returns which of them are still alive after waiting (for at most the
+    # timeout) for them to exit
+    alive = [pid for pid in pids if _is_alive(pid)]
+    deadline = time.time() + timeout
+    delay = KILL_POLL_INITIAL
+    while alive and time.time() < deadline:
+        time.sleep(max(0, min(delay, deadline - time.time())))
+        delay = min(delay * 2, KILL_POLL_MAX)
+        alive = [pid for pid in alive if _is_alive(pid)]
+    return alive
+
+
+def kill_all(pids, grace=STOP_GRACE):
+    """
+    Asks all of the processes to exit (with SIGTERM) giving them the grace
+    period (in seconds) to do so before killing them (with SIGKILL),
+    returning which of them could not be stopped.
+    """
+    if DRYRUN_MODE:
+        return []
+    alive = [pid for pid in pids if _is_alive(pid)]
+    if not alive:
+        return []
+    LOG.debug("Asking pids %s to exit", alive)
+    _signal_all(alive, signal.SIGTERM)
+    alive = _wait_all(alive, grace)
+    if alive:
+        LOG.debug("Killing pids %s since they did not exit within %s seconds", alive, grace)
+        _signal_all(alive, signal.SIGKILL)
+        alive = _wait_all(alive, KILL_WAIT)
+    return alive
+
+
+def kill(pid, grace=STOP_GRACE):
+    return not kill_all([pid], grace)
+
+
+def _redirect_fd(path, fd, flags):
+    new_fd = os.open(path, flags, 0644)
+    if new_fd != fd:
+        os.dup2(new_fd, fd)
+        os.close(new_fd)
+
+
+def _close_fds(lowest):
+    # Only close what is actually open (the limit on open files can be huge)
+    try:
+        fds = [int(fd) for fd in os.listdir("/proc/self/fd")]
+    except (OSError, ValueError):
+        fds = None
+    if fds is None:
+        (_soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY:
+            hard = MAXFD
+        os.closerange(lowest, hard)
+        return
+    for fd in fds:
+        if fd >= lowest:
+            try:
+                os.close(fd)
+            except OSError:
+                # Not open anymore (ie the one used to list them), thats ok
+                pass
 
 
 def fork(program, app_dir, pid_fn, stdout_fn, stderr_fn, *args):
@@ -428,24 +954,12 @@ def fork(program, app_dir, pid_fn, stdout_fn, stderr_fn, *args):
             # Move to where application should be
             if app_dir:
                 os.chdir(app_dir)
-            # Close other fds (or try)
-            (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
-            mkfd = hard
-            if mkfd == resource.RLIM_INFINITY:
-                mkfd = 2048  # Is this defined anywhere??
-            for fd in range(0, mkfd):
-                try:
-                    os.close(fd)
-                except OSError:
-                    # Not open, thats ok
-                    pass
-            # Now adjust stderr and stdout
-            if stdout_fn:
-                stdoh = open(stdout_fn, "w")
-                os.dup2(stdoh.fileno(), sys.stdout.fileno())
-            if stderr_fn:
-                stdeh = open(stderr_fn, "w")
-                os.dup2(stdeh.fileno(), sys.stderr.fileno())
+            # Point stdin at nothing and stdout/stderr at their files, then
+            # get rid of everything else that was inherited
+            _redirect_fd(os.devnull, 0, os.O_RDONLY)
+            _redirect_fd(stdout_fn or os.devnull, 1, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            _redirect_fd(stderr_fn or os.devnull, 2, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            _close_fds(3)
             # Now exec...
             # Note: The arguments to the child process should
             # start with the name of the command being run
@@ -463,6 +977,18 @@ def fork(program, app_dir, pid_fn, stdout_fn, stderr_fn, *args):
             os._exit(0)
 
 
+def running_pids():
+    """
+    Returns the pids of everything that is running (from a single look at
+    /proc).
+    """
+    pids = set()
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            pids.add(int(entry))
+    return pids
+
+
 def is_running(pid):
     if DRYRUN_MODE:
         return True
@@ -488,10 +1014,11 @@ def mkdirslist(path):
     LOG.debug("Determining potential paths to create for target path %r" % (path))
     dirs_possible = _explode_form_path(path)
     dirs_made = list()
-    for check_path in dirs_possible:
-        if not isdir(check_path):
-            mkdir(check_path, False)
-            dirs_made.append(check_path)
+    with Unrooted():
+        for check_path in dirs_possible:
+            if not isdir(check_path):
+                mkdir(check_path, False)
+                dirs_made.append(check_path)
     return dirs_made
 
 
@@ -500,10 +1027,11 @@ def append_file(fn, text, flush=True, quiet=False):
         LOG.audit("Appending to file %r (%d bytes) (flush=%s)", fn, len(text), BOOL2STR.get(flush))
         LOG.audit(">> %s" % (text))
     if not DRYRUN_MODE:
-        with open(fn, "a") as f:
-            f.write(text)
-            if flush:
-                f.flush()
+        with Unrooted():
+            with open(fn, "a") as f:
+                f.write(text)
+                if flush:
+                    f.flush()
     return fn
 
 
@@ -512,10 +1040,11 @@ def write_file(fn, text, flush=True, quiet=False):
         LOG.audit("Writing to file %r (%d bytes) (flush=%s)", fn, len(text), BOOL2STR.get(flush))
         LOG.audit("> %s" % (text))
     if not DRYRUN_MODE:
-        with open(fn, "w") as f:
-            f.write(text)
-            if flush:
-                f.flush()
+        with Unrooted():
+            with open(fn, "w") as f:
+                f.write(text)
+                if flush:
+                    f.flush()
     return fn
 
 
@@ -524,8 +1053,9 @@ def touch_file(fn, die_if_there=True, quiet=False, file_size=0):
         if not quiet:
             LOG.audit("Touching and truncating file %r (truncate size=%s)", fn, file_size)
         if not DRYRUN_MODE:
-            with open(fn, "w") as f:
-                f.truncate(file_size)
+            with Unrooted():
+                with open(fn, "w") as f:
+                    f.truncate(file_size)
     else:
         if die_if_there:
             msg = "Can not touch & truncate file %r since it already exists" % (fn)
@@ -533,6 +1063,16 @@ def touch_file(fn, die_if_there=True, quiet=False, file_size=0):
     return fn
 
 
+def stream_lines(fn, quiet=False):
+    # Like load_file + splitlines but without loading the whole file at once
+    if not quiet:
+        LOG.audit("Streaming lines from file %r", fn)
+    if not DRYRUN_MODE:
+        with open(fn, "r") as f:
+            for line in f:
+                yield line.rstrip("\r\n")
+
+
 def load_file(fn, quiet=False):
     if not quiet:
         LOG.audit("Loading data from file %r", fn)
@@ -550,11 +1090,13 @@ def mkdir(path, recurse=True):
         if recurse:
             LOG.audit("Recursively creating directory %r" % (path))
             if not DRYRUN_MODE:
-                os.makedirs(path)
+                with Unrooted():
+                    os.makedirs(path)
         else:
             LOG.audit("Creating directory %r" % (path))
             if not DRYRUN_MODE:
-                os.mkdir(path)
+                with Unrooted():
+                    os.mkdir(path)
     return path
 
 
@@ -718,14 +1260,16 @@ def unlink(path, ignore_errors=True, run_as_root=False):
 def copy(src, dst):
     LOG.audit("Copying: %r => %r" % (src, dst))
     if not DRYRUN_MODE:
-        shutil.copy(src, dst)
+        with Unrooted():
+            shutil.copy(src, dst)
     return dst
 
 
 def move(src, dst):
     LOG.audit("Moving: %r => %r" % (src, dst))
     if not DRYRUN_MODE:
-        shutil.move(src, dst)
+        with Unrooted():
+            shutil.move(src, dst)
     return dst
 
 
@@ -752,11 +1296,12 @@ def copy_replace_file(fsrc, fdst, linemap):
     files = mkdirslist(dirname(fdst))
     LOG.audit("Copying and replacing file: %r => %r" % (fsrc, fdst))
     if not DRYRUN_MODE:
-        with open(fdst, 'w') as fh:
-            for line in fileinput.input(fsrc):
-                for (k, v) in linemap.items():
-                    line = line.replace(k, v)
-                fh.write(line)
+        with Unrooted():
+            with open(fdst, 'w') as fh:
+                for line in fileinput.input(fsrc):
+                    for (k, v) in linemap.items():
+                        line = line.replace(k, v)
+                    fh.write(line)
     return files
 
 
@@ -0,0 +1,141 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (C) 2012 Yahoo! Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from anvil import colorizer
+from anvil import log as logging
+from anvil import pool
+from anvil import shell as sh
+
+LOG = logging.getLogger(__name__)
+
+
+class _Node(object):
+    def __init__(self):
+        self.children = dict()
+        # Whether this path was asked to be removed (or kept)
+        self.remove = False
+        self.keep = False
+        # Whether this path (or a path under it) is being kept
+        self.holds_kept = False
+        # Whether this path is removed (with all that is under it)
+        self.removed = False
+
+
+class PathTrie(object):
+    """
+    Paths (broken up into their pieces) so that what is under (or over) a
+    path can be found without comparing it against all the others.
+    """
+
+    def __init__(self):
+        self.root = _Node()
+
+    def _pieces(self, path):
+        return [p for p in sh.abspth(path).split(sh.ROOT_PATH) if p]
+
+    def add(self, path):
+        node = self.root
+        for piece in self._pieces(path):
+            node = node.children.setdefault(piece, _Node())
+        return node
+
+    def find(self, path):
+        """
+        Returns the nodes along the path (stopping early if it is not all
+        there).
+        """
+        nodes = list()
+        node = self.root
+        for piece in self._pieces(path):
+            node = node.children.get(piece)
+            if node is None:
+                break
+            nodes.append(node)
+        return nodes
+
+
+class Plan(object):
+    """
+    What to remove (the fewest directory trees and the files not in them)
+    to get rid of the given directories and files, while keeping the given
+    places (and the directories over them) around, directories that were
+    made under a kept place are still removed.
+    """
+
+    def __init__(self, dirs, files, keep=None):
+        self.trie = PathTrie()
+        for d in dirs:
+            self.trie.add(d).remove = True
+        for k in (keep or []):
+            self.trie.add(k).keep = True
+        self._mark_kept(self.trie.root)
+        self.roots = list()
+        self._find_roots(self.trie.root, sh.ROOT_PATH)
+        self.files = list()
+        for fn in files:
+            if not [node for node in self.trie.find(fn) if node.removed]:
+                self.files.append(fn)
+
+    def _mark_kept(self, node):
+        holds_kept = node.keep
+        for child in node.children.values():
+            if self._mark_kept(child):
+                holds_kept = True
+        node.holds_kept = holds_kept
+        return holds_kept
+
+    def _find_roots(self, node, path):
+        if node.remove and not node.holds_kept and path != sh.ROOT_PATH:
+            node.removed = True
+            self.roots.append(path)
+            return
+        for (piece, child) in sorted(node.children.items()):
+            self._find_roots(child, sh.joinpths(path, piece))
+
+
+def remove(plan, max_workers=1):
+    """
+    Removes what the plan says to (as root) using at most the given number of
+    threads, directory trees are split up by their subdirectories so that
+    big trees are also removed by many threads.
+    """
+    with sh.Rooted(True):
+        for fn in plan.files:
+            sh.unlink(fn)
+        roots = list()
+        for path in plan.roots:
+            if sh.islink(path):
+                # Only the link goes (not what it points at)
+                sh.unlink(path)
+            elif sh.isdir(path):
+                roots.append(path)
+            else:
+                LOG.warn("No directory found at %s - skipping", colorizer.quote(path, quote_color='red'))
+        with pool.WorkerPool(max_workers, name='teardown') as workers:
+            futures = list()
+            for path in roots:
+                for name in sh.listdir(path):
+                    sub_path = sh.joinpths(path, name)
+                    if sh.isdir(sub_path) and not sh.islink(sub_path):
+                        futures.append(workers.submit(sh.deldir, sub_path))
+            # Make sure all of them are done (and raise the first failure)
+            # before getting rid of what is left of the trees
+            for fut in futures:
+                fut.result()
+            futures = [workers.submit(sh.deldir, path) for path in roots]
+            for fut in futures:
+                fut.result()
+    return len(roots)
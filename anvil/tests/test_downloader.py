@@ -0,0 +1,222 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (C) 2012 Yahoo! Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import BaseHTTPServer
+import glob
+import os
+import re
+import shutil
+import socket
+import SocketServer
+import tempfile
+import threading
+import unittest
+
+from anvil import downloader as down
+
+RANGE_MATCHER = re.compile(r"^bytes=(\d+)-(\d+)$")
+
+
+class _StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves data (with ranges of it if ranges is true, unless it ignores them)
+    and sends only the first cut_at bytes of the next cuts responses (like a
+    connection that drops part way through would).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, data):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _StubHandler)
+        self.data = data
+        self.etag = '"v1"'
+        self.ranges = True
+        self.ignore_ranges = False
+        self.cuts = 0
+        self.cut_at = 0
+        self.requests = list()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%s/image.img" % (self.server_address[1])
+
+    def take_cut(self):
+        with self.lock:
+            if self.cuts > 0:
+                self.cuts -= 1
+                return True
+            return False
+
+
+class _StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        data = self.server.data
+        requested = self.headers.get('range')
+        with self.server.lock:
+            self.server.requests.append(requested)
+        match = None
+        if requested and self.server.ranges and not self.server.ignore_ranges:
+            match = RANGE_MATCHER.match(requested)
+        if match:
+            (start, end) = (int(match.group(1)), int(match.group(2)))
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', "bytes %s-%s/%s" % (start, end, len(data)))
+        else:
+            body = data
+            self.send_response(200)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.take_cut():
+            body = body[0:self.server.cut_at]
+        try:
+            self.wfile.write(body)
+        except socket.error:
+            # The downloader closes the first connection when it will be
+            # fetching ranges (on their own connections) instead
+            pass
+
+
+class TestUrlLibDownloader(unittest.TestCase):
+
+    def setUp(self):
+        self.data = "".join([chr(i % 251) for i in range(0, 64 * 1024 + 17)])
+        self.server = _StubServer(self.data)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.tdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tdir, 'image.img')
+        self.min_range_size = down.MIN_RANGE_SIZE
+        down.MIN_RANGE_SIZE = 1024
+
+    def tearDown(self):
+        down.MIN_RANGE_SIZE = self.min_range_size
+        self.server.shutdown()
+        self.server_thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.tdir)
+
+    def _download(self, ranges):
+        downloader = down.UrlLibDownloader(self.server.url, self.fn, cache=None, ranges=ranges)
+        return downloader.download()
+
+    def _cut_everything(self, cut_at):
+        self.server.cuts = 1000
+        self.server.cut_at = cut_at
+
+    def _ranges_asked(self):
+        return [r for r in self.server.requests if r]
+
+    def _contents(self):
+        with open(self.fn, 'rb') as fh:
+            return fh.read()
+
+    def _leftovers(self):
+        return sorted(glob.glob("%s.*" % (self.fn)))
+
+    def test_chunked_ranges(self):
+        (fn, amount) = self._download(4)
+        self.assertEqual(self.fn, fn)
+        self.assertEqual(len(self.data), amount)
+        self.assertEqual(self.data, self._contents())
+        self.assertEqual([], self._leftovers())
+        # One full request (that gets closed) and then one for each range
+        self.assertEqual(5, len(self.server.requests))
+        asked = sorted(self._ranges_asked(), key=lambda r: int(RANGE_MATCHER.match(r).group(1)))
+        self.assertEqual(['bytes=0-16388', 'bytes=16389-32777',
+                          'bytes=32778-49166', 'bytes=49167-65552'], asked)
+
+    def test_single_range(self):
+        (_fn, amount) = self._download(1)
+        self.assertEqual(len(self.data), amount)
+        self.assertEqual(self.data, self._contents())
+        self.assertEqual(["bytes=0-%s" % (len(self.data) - 1)], self._ranges_asked())
+
+    def test_resume_cut_short(self):
+        # The first range only gets this far before it gets cut off
+        self.server.cuts = 2
+        self.server.cut_at = 1000
+        (_fn, amount) = self._download(1)
+        self.assertEqual(self.data, self._contents())
+        self.assertEqual([], self._leftovers())
+        end = len(self.data) - 1
+        self.assertEqual(["bytes=0-%s" % (end), "bytes=1000-%s" % (end)], self._ranges_asked())
+        self.assertEqual(len(self.data), amount)
+
+    def test_resume_later(self):
+        # Cut short more times than are resumed in one go
+        self._cut_everything(100)
+        self.assertRaises(IOError, self._download, 4)
+        self.assertTrue(len(self._leftovers()) > 1)
+        self.server.cuts = 0
+        self.server.requests = list()
+        (_fn, amount) = self._download(4)
+        self.assertEqual(self.data, self._contents())
+        self.assertEqual([], self._leftovers())
+        # Only what the earlier download did not get is fetched
+        self.assertTrue(amount < len(self.data))
+        for r in self._ranges_asked():
+            self.assertNotEqual('0', RANGE_MATCHER.match(r).group(1))
+
+    def test_changed_restarts(self):
+        self._cut_everything(100)
+        self.assertRaises(IOError, self._download, 1)
+        self.server.cuts = 0
+        self.server.requests = list()
+        self.server.data = self.data[::-1]
+        self.server.etag = '"v2"'
+        (_fn, amount) = self._download(1)
+        self.assertEqual(self.data[::-1], self._contents())
+        self.assertEqual(len(self.data), amount)
+        self.assertEqual(["bytes=0-%s" % (len(self.data) - 1)], self._ranges_asked())
+
+    def test_ranges_ignored(self):
+        # Says it does ranges but then sends everything
+        self.server.ignore_ranges = True
+        (_fn, amount) = self._download(4)
+        self.assertEqual(len(self.data), amount)
+        self.assertEqual(self.data, self._contents())
+        self.assertEqual([], self._leftovers())
+        self.assertEqual(None, self.server.requests[-1])
+
+    def test_no_ranges(self):
+        self.server.ranges = False
+        (_fn, amount) = self._download(4)
+        self.assertEqual(len(self.data), amount)
+        self.assertEqual(self.data, self._contents())
+        self.assertEqual([None], self.server.requests)
+
+    def test_no_ranges_cut_short(self):
+        self.server.ranges = False
+        self.server.cuts = 1
+        self.server.cut_at = 100
+        self.assertRaises(IOError, self._download, 4)
+        self.assertFalse(os.path.exists(self.fn))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (C) 2012 Yahoo! Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from anvil import downloader as down
+
+# What the distros (in conf/distros) run for these
+GIT_COMMANDS = {
+    'checkout': 'git checkout',
+    'clone': 'git clone',
+    'config': 'git config',
+    'fetch': 'git fetch',
+    'merge': 'git merge',
+    'read_tree': 'git read-tree',
+    'rev_parse': 'git rev-parse',
+    'set_url': 'git remote set-url',
+}
+
+
+class _Distro(object):
+
+    def get_command(self, key, *more_keys, **kargs):
+        assert key == 'git' and len(more_keys) == 1
+        return shlex.split(GIT_COMMANDS[more_keys[0]])
+
+
+def _git(where, *args):
+    env = dict(os.environ)
+    env.update({
+        'GIT_AUTHOR_NAME': 'anvil',
+        'GIT_AUTHOR_EMAIL': 'anvil@localhost',
+        'GIT_COMMITTER_NAME': 'anvil',
+        'GIT_COMMITTER_EMAIL': 'anvil@localhost',
+    })
+    proc = subprocess.Popen(['git'] + list(args), cwd=where, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (stdout, stderr) = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError("git %s failed: %s" % (" ".join(args), stderr))
+    return stdout.strip()
+
+
+def _read(fn):
+    with open(fn, 'rb') as fh:
+        return fh.read()
+
+
+class TestGitMirrors(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.upstream = os.path.join(self.tdir, 'upstream', 'nova.git')
+        os.makedirs(self.upstream)
+        _git(self.upstream, 'init', '-q')
+        _git(self.upstream, 'symbolic-ref', 'HEAD', 'refs/heads/master')
+        self._commit('README', 'first')
+        _git(self.upstream, 'branch', 'stable')
+        self.uri = "file://%s" % (self.upstream)
+        self.distro = _Distro()
+        self.mirror_dir = os.path.join(self.tdir, 'mirrors')
+        self.mirrors = down.GitMirrors(self.distro, self.mirror_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def _commit(self, fn, contents):
+        with open(os.path.join(self.upstream, fn), 'wb') as fh:
+            fh.write(contents)
+        _git(self.upstream, 'add', fn)
+        _git(self.upstream, 'commit', '-q', '-m', "Changed %s" % (fn))
+        return _git(self.upstream, 'rev-parse', 'HEAD')
+
+    def _downloader(self, store_where, **kwargs):
+        return down.GitDownloader(self.distro, self.uri, store_where, kwargs.pop('branch', 'master'),
+                                  mirrors=self.mirrors, **kwargs)
+
+    def test_location(self):
+        where = self.mirrors.get_location(self.uri)
+        self.assertEqual(self.mirror_dir, os.path.dirname(where))
+        self.assertTrue(os.path.basename(where).startswith('nova-'))
+        self.assertTrue(where.endswith('.git'))
+        # Repositories with the same name (from different places) get their own mirror
+        other = self.mirrors.get_location("file://%s/nova.git" % (self.tdir))
+        self.assertNotEqual(where, other)
+        self.assertEqual(where, self.mirrors.get_location(self.uri))
+
+    def test_mirror_made(self):
+        where = self.mirrors.update(self.uri)
+        self.assertEqual(self.mirrors.get_location(self.uri), where)
+        self.assertEqual([os.path.basename(where)], os.listdir(self.mirror_dir))
+        self.assertEqual('true', _git(where, 'config', 'core.bare'))
+        self.assertEqual(_git(self.upstream, 'rev-parse', 'master'), _git(where, 'rev-parse', 'master'))
+        self.assertEqual(_git(self.upstream, 'rev-parse', 'stable'), _git(where, 'rev-parse', 'stable'))
+
+    def test_mirror_updated(self):
+        where = self.mirrors.update(self.uri)
+        head = self._commit('README', 'second')
+        _git(self.upstream, 'branch', 'newer')
+        self.assertEqual(where, self.mirrors.update(self.uri))
+        self.assertEqual(head, _git(where, 'rev-parse', 'master'))
+        self.assertEqual(head, _git(where, 'rev-parse', 'newer'))
+
+    def test_mirror_kept_when_upstream_gone(self):
+        where = self.mirrors.update(self.uri)
+        head = _git(where, 'rev-parse', 'master')
+        shutil.rmtree(self.upstream)
+        self.assertEqual(where, self.mirrors.update(self.uri))
+        self.assertEqual(head, _git(where, 'rev-parse', 'master'))
+
+    def test_clone_from_mirror(self):
+        store_where = os.path.join(self.tdir, 'app', 'nova')
+        downloader = self._downloader(store_where)
+        dirs_made = downloader.download()
+        self.assertTrue(store_where in dirs_made)
+        self.assertTrue(downloader.changed)
+        self.assertEqual('first', _read(os.path.join(store_where, 'README')))
+        self.assertTrue(os.path.isdir(self.mirrors.get_location(self.uri)))
+        # Later fetches go to the real place (and not the mirror)
+        self.assertEqual(self.uri, _git(store_where, 'config', 'remote.origin.url'))
+
+    def test_clone_branch(self):
+        self._commit('README', 'second')
+        store_where = os.path.join(self.tdir, 'app', 'nova')
+        self._downloader(store_where, branch='stable').download()
+        self.assertEqual('first', _read(os.path.join(store_where, 'README')))
+        self.assertEqual('stable', _git(store_where, 'rev-parse', '--abbrev-ref', 'HEAD'))
+
+    def test_update_through_mirror(self):
+        store_where = os.path.join(self.tdir, 'app', 'nova')
+        self._downloader(store_where).download()
+        head = self._commit('README', 'second')
+        downloader = self._downloader(store_where, update=True)
+        self.assertEqual([], downloader.download())
+        self.assertTrue(downloader.changed)
+        self.assertEqual('second', _read(os.path.join(store_where, 'README')))
+        self.assertEqual(head, _git(self.mirrors.get_location(self.uri), 'rev-parse', 'master'))
+        downloader = self._downloader(store_where, update=True)
+        downloader.download()
+        self.assertFalse(downloader.changed)
+
+    def test_shallow_skips_mirror(self):
+        self._commit('README', 'second')
+        store_where = os.path.join(self.tdir, 'app', 'nova')
+        self._downloader(store_where, depth='1').download()
+        self.assertEqual('second', _read(os.path.join(store_where, 'README')))
+        self.assertEqual('1', _git(store_where, 'rev-list', '--count', 'HEAD'))
+        self.assertFalse(os.path.exists(self.mirror_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (C) 2012 Yahoo! Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import BaseHTTPServer
+import contextlib
+import json
+import StringIO
+import tarfile
+import threading
+import unittest
+import urllib2
+
+from anvil.helpers import glance
+
+
+def _make_tarball(pieces):
+    buf = StringIO.StringIO()
+    with contextlib.closing(tarfile.open(fileobj=buf, mode='w:gz')) as tfh:
+        for (name, contents) in pieces:
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            tfh.addfile(info, StringIO.StringIO(contents))
+    return buf.getvalue()
+
+
+class _StubGlance(BaseHTTPServer.HTTPServer):
+    """
+    Serves image files (from files) and enough of the glance v1 api to list
+    and create images (that are kept in images).
+    """
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _StubHandler)
+        self.files = dict()
+        self.images = list()
+        self.lists = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%s" % (self.server_address[1])
+
+
+class _StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/v1/images':
+            with self.server.lock:
+                self.server.lists += 1
+                images = [dict(name=i['name'], id=i['id']) for i in self.server.images]
+            self._reply(200, json.dumps({'images': images}))
+        elif self.path in self.server.files:
+            self._reply(200, self.server.files[self.path], 'application/octet-stream')
+        else:
+            self._reply(404, '')
+
+    def do_POST(self):
+        if self.path != '/v1/images':
+            self._reply(404, '')
+            return
+        data = self.rfile.read(int(self.headers['content-length']))
+        meta = json.loads(self.headers['x-image-meta'])
+        with self.server.lock:
+            meta['id'] = "img-%s" % (len(self.server.images) + 1)
+            meta['size'] = len(data)
+            self.server.images.append(meta)
+        self._reply(201, json.dumps({'image': meta}))
+
+
+class _Resource(object):
+
+    def __init__(self, **kwargs):
+        for (k, v) in kwargs.items():
+            setattr(self, k, v)
+
+
+class _Images(object):
+
+    def __init__(self, url):
+        self.url = url
+
+    def list(self):
+        with contextlib.closing(urllib2.urlopen("%s/v1/images" % (self.url))) as conn:
+            return [_Resource(**i) for i in json.loads(conn.read())['images']]
+
+    def create(self, data, **kwargs):
+        request = urllib2.Request("%s/v1/images" % (self.url), data=data.read(),
+                                  headers={'x-image-meta': json.dumps(kwargs)})
+        with contextlib.closing(urllib2.urlopen(request)) as conn:
+            return _Resource(**json.loads(conn.read())['image'])
+
+
+class _Client(object):
+    """
+    Just the parts of the glance client that the uploads use.
+    """
+
+    def __init__(self, url):
+        self.images = _Images(url)
+
+
+class TestUploadService(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _StubGlance()
+        self.server.files['/cirros.tar.gz'] = _make_tarball([
+            ('cirros/cirros-vmlinuz', 'k' * 1024),
+            ('cirros/cirros-initrd', 'r' * 2048),
+            ('cirros/cirros.img', 'i' * 4096),
+        ])
+        self.server.files['/other.img'] = 'o' * 512
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.client = _Client(self.server.url)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server_thread.join()
+        self.server.server_close()
+
+    def _install(self, paths):
+        service = glance.UploadService({})
+        urls = ["%s%s" % (self.server.url, p) for p in paths]
+        return service._pipeline(self.client, urls, (IOError, tarfile.TarError))
+
+    def _images(self):
+        return dict([(i['name'], i) for i in self.server.images])
+
+    def test_root_refers_to_kernel_and_ramdisk(self):
+        self.assertEqual(1, self._install(['/cirros.tar.gz']))
+        images = self._images()
+        self.assertEqual(['cirros', 'cirros-initrd', 'cirros-vmlinuz'], sorted(images.keys()))
+        self.assertEqual(1024, images['cirros-vmlinuz']['size'])
+        self.assertEqual('aki', images['cirros-vmlinuz']['disk_format'])
+        self.assertEqual(2048, images['cirros-initrd']['size'])
+        self.assertEqual('ari', images['cirros-initrd']['disk_format'])
+        root = images['cirros']
+        self.assertEqual(4096, root['size'])
+        self.assertEqual('ami', root['disk_format'])
+        self.assertEqual({
+            'kernel_id': images['cirros-vmlinuz']['id'],
+            'ramdisk_id': images['cirros-initrd']['id'],
+        }, root['properties'])
+
+    def test_many_images(self):
+        self.assertEqual(2, self._install(['/cirros.tar.gz', '/other.img']))
+        images = self._images()
+        self.assertEqual(['cirros', 'cirros-initrd', 'cirros-vmlinuz', 'other'], sorted(images.keys()))
+        self.assertEqual('raw', images['other']['disk_format'])
+        self.assertEqual('bare', images['other']['container_format'])
+        self.assertEqual(512, images['other']['size'])
+        # Glance only gets asked what it has once
+        self.assertEqual(1, self.server.lists)
+
+    def test_existing_skipped(self):
+        self.server.images.append({'name': 'cirros', 'id': 'img-old'})
+        self.assertEqual(1, self._install(['/cirros.tar.gz', '/other.img']))
+        self.assertEqual(['cirros', 'other'], sorted(self._images().keys()))
+
+    def test_same_name_installed_once(self):
+        self.assertEqual(1, self._install(['/other.img', '/other.img']))
+        self.assertEqual(['other'], sorted(self._images().keys()))
+
+    def test_failed_download(self):
+        self.assertEqual(1, self._install(['/missing.img', '/other.img']))
+        self.assertEqual(['other'], sorted(self._images().keys()))
+
+    def test_bad_tarball(self):
+        self.server.files['/broken.tar.gz'] = _make_tarball([('README', 'nothing here')])
+        self.assertEqual(1, self._install(['/broken.tar.gz', '/other.img']))
+        self.assertEqual(['other'], sorted(self._images().keys()))
+
+
+if __name__ == '__main__':
+    unittest.main()
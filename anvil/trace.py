@@ -14,13 +14,20 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import atexit
 import json
 import os
+import threading
+import time
+import weakref
 
 from anvil import date
 from anvil import exceptions as excp
+from anvil import log as logging
 from anvil import shell as sh
 
+LOG = logging.getLogger(__name__)
+
 # Trace per line output format and file extension formats
 TRACE_FMT = ("%s - %s" + os.linesep)
 TRACE_EXT = ".trace"
@@ -34,25 +41,149 @@ FILE_TOUCHED = "FILE_TOUCHED"
 PIP_INSTALL = 'PIP_INSTALL'
 PKG_INSTALL = "PKG_INSTALL"
 PYTHON_INSTALL = "PYTHON_INSTALL"
+PYTHON_SETUP = "PYTHON_SETUP"
 SYMLINK_MAKE = "SYMLINK_MAKE"
 
 
+# Trace writers that are buffering records or keeping their files open (so
+# they can be flushed and closed together)
+_BUFFERED = weakref.WeakValueDictionary()
+_BUFFERED_LOCK = threading.Lock()
+_AGER = None
+_AGER_STOP = threading.Event()
+
+# How often (in seconds) buffered records are checked to see if they are too old
+AGE_POLL = 0.1
+
+
 def trace_fn(root_dir, name):
     return sh.joinpths(root_dir, name + TRACE_EXT)
 
 
+def flush_all():
+    """
+    Writes out what all the buffering trace writers have buffered (and
+    closes their files until they next have something to write out).
+    """
+    with _BUFFERED_LOCK:
+        writers = _BUFFERED.values()
+    for writer in writers:
+        writer.close()
+
+
+def _flush_aged():
+    while not _AGER_STOP.isSet():
+        _AGER_STOP.wait(AGE_POLL)
+        with _BUFFERED_LOCK:
+            writers = _BUFFERED.values()
+        for writer in writers:
+            # Keep on going (for the other writers and later records)
+            try:
+                writer.flush_if_needed()
+            except Exception:
+                LOG.exception("Failed writing out the buffered records of trace %r", writer.filename())
+
+
+def _watch(writer):
+    global _AGER
+    with _BUFFERED_LOCK:
+        _BUFFERED[id(writer)] = writer
+        if writer.buffer_ms > 0 and _AGER is None:
+            _AGER = threading.Thread(target=_flush_aged, name='trace-flusher')
+            _AGER.daemon = True
+            _AGER.start()
+
+
+def _at_exit():
+    # The flusher is stopped first (so that it is not still flushing while
+    # the interpreter goes away)
+    _AGER_STOP.set()
+    if _AGER is not None:
+        _AGER.join()
+    flush_all()
+
+
+# Whatever happens try to leave usable traces behind
+atexit.register(_at_exit)
+
+
 class TraceWriter(object):
 
-    def __init__(self, trace_filename, break_if_there=True):
+    def __init__(self, trace_filename, break_if_there=True,
+                 buffer_records=0, buffer_ms=0, fsync=False):
         self.trace_fn = trace_filename
         self.started = False
         self.break_if_there = break_if_there
+        # When buffering, records are written out when this many have been
+        # buffered, when the oldest is this old, or when flushed (which
+        # happens at the end of each phase, even if it failed).
+        self.buffer_records = max(0, int(buffer_records or 0))
+        self.buffer_ms = max(0, int(buffer_ms or 0))
+        # Whether to make sure what was written out is on disk
+        self.fsync = fsync
+        self.lock = threading.RLock()
+        self.buffer = list()
+        self.buffered_since = None
+        self.fh = None
+        if self.buffer_records > 0 or self.fsync:
+            _watch(self)
 
     def trace(self, cmd, action=None):
         if action is None:
             action = date.rcf8222date()
         if cmd is not None:
-            sh.append_file(self.trace_fn, TRACE_FMT % (cmd, action))
+            record = TRACE_FMT % (cmd, action)
+            if self.buffer_records <= 0 and not self.fsync:
+                sh.append_file(self.trace_fn, record)
+            else:
+                with self.lock:
+                    if not self.buffer:
+                        self.buffered_since = time.time()
+                    self.buffer.append(record)
+                    self.flush_if_needed()
+
+    def flush_if_needed(self):
+        with self.lock:
+            if self._should_flush():
+                self.flush()
+
+    def _should_flush(self):
+        if not self.buffer:
+            return False
+        if len(self.buffer) >= self.buffer_records:
+            return True
+        if self.buffer_ms > 0:
+            if (time.time() - self.buffered_since) * 1000 >= self.buffer_ms:
+                return True
+        return False
+
+    def _write(self, records):
+        if sh.DRYRUN_MODE:
+            return
+        if self.fh is None:
+            with sh.Unrooted():
+                self.fh = open(self.trace_fn, "a")
+        self.fh.write("".join(records))
+        self.fh.flush()
+        if self.fsync:
+            os.fsync(self.fh.fileno())
+
+    def flush(self):
+        with self.lock:
+            if not self.buffer:
+                return
+            records = self.buffer
+            self.buffer = list()
+            self.buffered_since = None
+            LOG.audit("Appending %s buffered records to trace %r", len(records), self.trace_fn)
+            self._write(records)
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
 
     def filename(self):
         return self.trace_fn
@@ -73,6 +204,15 @@ class TraceWriter(object):
         what['where'] = where
         self.trace(PYTHON_INSTALL, json.dumps(what))
 
+    def py_setup(self, where, fingerprint):
+        # What the python directory looked like when it was (last) set up,
+        # none when it is being set up (again)
+        self._start()
+        what = dict()
+        what['where'] = where
+        what['fingerprint'] = fingerprint
+        self.trace(PYTHON_SETUP, json.dumps(what))
+
     def cfg_file_written(self, fn):
         self._start()
         self.trace(CFG_WRITING_FILE, fn)
@@ -81,11 +221,13 @@ class TraceWriter(object):
         self._start()
         self.trace(SYMLINK_MAKE, link)
 
-    def download_happened(self, tgt, uri):
+    def download_happened(self, tgt, uri, options=None):
         self._start()
         what = dict()
         what['target'] = tgt
         what['from'] = uri
+        if options:
+            what['options'] = options
         self.trace(DOWNLOADED, json.dumps(what))
 
     def pip_installed(self, pip_info):
@@ -118,30 +260,52 @@ class TraceReader(object):
 
     def __init__(self, trace_filename):
         self.trace_fn = trace_filename
-        self.contents = None
+        # Trace actions by the trace command they are for
+        self.index = None
+        # Decoded json trace actions by the trace command they are for
+        self.decoded = dict()
 
     def filename(self):
         return self.trace_fn
 
-    def _parse(self):
+    def _records(self):
         fn = self.trace_fn
         if not sh.isfile(fn):
             msg = "No trace found at filename %s" % (fn)
             raise excp.NoTraceException(msg)
-        contents = sh.load_file(fn)
-        lines = contents.splitlines()
-        accum = list()
-        for line in lines:
+        for line in sh.stream_lines(fn):
             ep = self._split_line(line)
-            if ep is None:
-                continue
-            accum.append(tuple(ep))
-        return accum
+            if ep is not None:
+                yield ep
+
+    def _parse(self):
+        index = dict()
+        for (cmd, action) in self._records():
+            index.setdefault(cmd, list()).append(action)
+        self.index = index
 
     def read(self):
-        if self.contents is None:
-            self.contents = self._parse()
-        return self.contents
+        """
+        Returns the (command, action) records of the trace in the order they
+        were written (the trace is read again for this, only the index of
+        them is kept around).
+        """
+        return list(self._records())
+
+    def _actions(self, cmd):
+        if self.index is None:
+            self._parse()
+        return [action for action in self.index.get(cmd, []) if len(action)]
+
+    def _decode(self, cmd):
+        if cmd not in self.decoded:
+            entries = list()
+            for action in self._actions(cmd):
+                entry = json.loads(action)
+                if type(entry) is dict:
+                    entries.append(entry)
+            self.decoded[cmd] = entries
+        return self.decoded[cmd]
 
     def _split_line(self, line):
         pieces = line.split("-", 1)
@@ -156,33 +320,27 @@ class TraceReader(object):
         return sh.exists(self.trace_fn)
 
     def apps_started(self):
-        lines = self.read()
         apps = list()
-        for (cmd, action) in lines:
-            if cmd == AP_STARTED and len(action):
-                entry = json.loads(action)
-                if type(entry) is dict:
-                    apps.append((entry.get('name'), entry.get('trace_fn'), entry.get('how')))
+        for entry in self._decode(AP_STARTED):
+            apps.append((entry.get('name'), entry.get('trace_fn'), entry.get('how')))
         return apps
 
     def py_listing(self):
-        lines = self.read()
         py_entries = list()
-        for (cmd, action) in lines:
-            if cmd == PYTHON_INSTALL and len(action):
-                entry = json.loads(action)
-                if type(entry) is dict:
-                    py_entries.append((entry.get("name"), entry.get("where")))
+        for entry in self._decode(PYTHON_INSTALL):
+            py_entries.append((entry.get("name"), entry.get("where")))
         return py_entries
 
+    def py_fingerprints(self):
+        fingerprints = dict()
+        for entry in self._decode(PYTHON_SETUP):
+            fingerprints[entry.get('where')] = entry.get('fingerprint')
+        return fingerprints
+
     def download_locations(self):
-        lines = self.read()
         locations = list()
-        for (cmd, action) in lines:
-            if cmd == DOWNLOADED and len(action):
-                entry = json.loads(action)
-                if type(entry) is dict:
-                    locations.append((entry.get('target'), entry.get('uri')))
+        for entry in self._decode(DOWNLOADED):
+            locations.append((entry.get('target'), entry.get('uri')))
         return locations
 
     def _sort_paths(self, pths):
@@ -193,61 +351,21 @@ class TraceReader(object):
         return pths
 
     def files_touched(self):
-        lines = self.read()
-        files = list()
-        for (cmd, action) in lines:
-            if cmd == FILE_TOUCHED and len(action):
-                files.append(action)
-        return self._sort_paths(files)
+        return self._sort_paths(self._actions(FILE_TOUCHED))
 
     def dirs_made(self):
-        lines = self.read()
-        dirs = list()
-        for (cmd, action) in lines:
-            if cmd == DIR_MADE and len(action):
-                dirs.append(action)
-        return self._sort_paths(dirs)
+        return self._sort_paths(self._actions(DIR_MADE))
 
     def symlinks_made(self):
-        lines = self.read()
-        links = list()
-        for (cmd, action) in lines:
-            if cmd == SYMLINK_MAKE and len(action):
-                links.append(action)
-        return links
+        return self._actions(SYMLINK_MAKE)
 
     def files_configured(self):
-        lines = self.read()
-        files = list()
-        for (cmd, action) in lines:
-            if cmd == CFG_WRITING_FILE and len(action):
-                files.append(action)
-        files = list(set(files))
+        files = list(set(self._actions(CFG_WRITING_FILE)))
         files.sort()
         return files
 
     def pips_installed(self):
-        lines = self.read()
-        pips_installed = list()
-        pip_list = list()
-        for (cmd, action) in lines:
-            if cmd == PIP_INSTALL and len(action):
-                pip_list.append(action)
-        for pip_data in pip_list:
-            pip_info_full = json.loads(pip_data)
-            if type(pip_info_full) is dict:
-                pips_installed.append(pip_info_full)
-        return pips_installed
+        return list(self._decode(PIP_INSTALL))
 
     def packages_installed(self):
-        lines = self.read()
-        pkgs_installed = list()
-        pkg_list = list()
-        for (cmd, action) in lines:
-            if cmd == PKG_INSTALL and len(action):
-                pkg_list.append(action)
-        for pkg_data in pkg_list:
-            pkg_info = json.loads(pkg_data)
-            if type(pkg_info) is dict:
-                pkgs_installed.append(pkg_info)
-        return pkgs_installed
+        return list(self._decode(PKG_INSTALL))
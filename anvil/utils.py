@@ -239,7 +239,8 @@ def tempdir(**kwargs):
     # This seems like it was only added in python 3.2
     # Make it since its useful...
     # See: http://bugs.python.org/file12970/tempdir.patch
-    tdir = tempfile.mkdtemp(**kwargs)
+    with sh.Unrooted():
+        tdir = tempfile.mkdtemp(**kwargs)
     try:
         yield tdir
     finally:
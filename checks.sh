@@ -60,7 +60,16 @@ function validate_yaml {
     done
 }
 
+function run_tests {
+    echo "Running tests ..."
+    python -m unittest discover -s anvil/tests -t .
+    if [ "$?" -ne "0" ]; then
+      echo "Some tests failed!"
+    fi
+}
+
 run_pep8
 run_pylint
 validate_yaml
+run_tests
 
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+import glob
+import os
+import sys
+
+import yaml
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir,
+                               'anvil',
+                               '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from anvil import log
+from anvil import pip
+from anvil import shell as sh
+
+
+def find_all(mp, key, accum):
+    if type(mp) is dict:
+        if key in mp:
+            value = mp[key]
+            if type(value) is list:
+                for v in value:
+                    accum.append(v)
+        else:
+            for (k, v) in mp.items():
+                find_all(v, key, accum)
+
+
+def get_pip_command(data):
+    # Use the distros pip if this machine has it (it may be another distro)
+    pip_cmd = (data.get('commands') or {}).get('pip') or 'pip'
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        if sh.is_executable(os.path.join(path, pip_cmd)):
+            return pip_cmd
+    return 'pip'
+
+
+if __name__ == "__main__":
+    me = os.path.basename(sys.argv[0])
+    if len(sys.argv) < 2:
+        print("%s wheel_dir [distro ...]" % (me))
+        sys.exit(1)
+
+    log.setupLogging(log.INFO)
+    wheel_dir = os.path.abspath(sys.argv[1])
+    distro_fns = sys.argv[2:]
+    if not distro_fns:
+        distro_fns = sorted(glob.glob(os.path.join(possible_topdir, 'conf', 'distros', '*.yaml')))
+    failed = list()
+    for distro_fn in distro_fns:
+        with open(distro_fn, 'r') as fh:
+            data = yaml.load(fh.read())
+        pips = list()
+        find_all(data, 'pips', pips)
+        print("Building wheels for %s pips from %s" % (len(pips), distro_fn))
+        wheelhouse = pip.Wheelhouse(get_pip_command(data), wheel_dir)
+        if not wheelhouse.build(pips):
+            failed.append(distro_fn)
+    if failed:
+        print("Not all wheels could be built for: %s" % (", ".join(failed)))
+        sys.exit(1)